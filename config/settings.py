@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -77,10 +78,77 @@ WSGI_APPLICATION = "config.wsgi.application"
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+        # ベンチマークなどで別の DB を使うときは環境変数で差し替える
+        "NAME": os.environ.get("DATABASE_NAME", BASE_DIR / "db.sqlite3"),
     }
 }
 
+# SQLite の接続ごとに当てる PRAGMA (weather.bulk.configure_sqlite)。
+# WAL は DB ファイル自体に記録され、-wal / -shm のファイルも残るので既定では使わない。
+# 取り込みと API を同じ DB で動かすときは WEATHER_SQLITE_WAL=1 で WAL と
+# synchronous=NORMAL にして、取り込み中も読み出しを止めずにコミットを軽くする
+WEATHER_SQLITE_WAL = os.environ.get("WEATHER_SQLITE_WAL") == "1"
+WEATHER_SQLITE_PRAGMAS = {
+    **({"journal_mode": "WAL", "synchronous": "NORMAL"} if WEATHER_SQLITE_WAL else {}),
+    "temp_store": "MEMORY",
+    "cache_size": -64000,
+    "mmap_size": 268435456,
+    "busy_timeout": 5000,
+}
+# 一括書き込みで1回の executemany / COPY に載せる行数
+WEATHER_BULK_CHUNK_SIZE = 2000
+
+
+# JMA (気象庁) API
+
+JMA_BASE_URL = os.environ.get("JMA_BASE_URL", "https://www.jma.go.jp/bosai")
+
+# 条件付き GET 用の応答キャッシュの置き場所
+JMA_CACHE_DIR = Path(os.environ.get("JMA_CACHE_DIR", BASE_DIR / ".jma_cache"))
+
+# 取得した本文を保存する場所(weather.archive)。replay_archive はここから読み直す。
+# 環境変数 WEATHER_ARCHIVE_DIR を空にすると None になり、保存しない
+WEATHER_ARCHIVE_DIR = os.environ.get("WEATHER_ARCHIVE_DIR", BASE_DIR / ".jma_archive")
+WEATHER_ARCHIVE_DIR = Path(WEATHER_ARCHIVE_DIR) if WEATHER_ARCHIVE_DIR else None
+
+
+# 読み出し API のキャッシュ
+# 取り込みの版を DB に問い合わせる間隔(秒)。この間は古い版の応答を返しうる
+WEATHER_API_VERSION_TTL = 5
+# Django のキャッシュに置く応答の寿命(秒)。キーに版を含むので短くてよい
+WEATHER_API_CACHE_TIMEOUT = 300
+# プロセス内キャッシュに持つリージョン数の上限
+WEATHER_API_LOCAL_CACHE_SIZE = 10000
+
+
+# 警報の発表・解除のイベント
+# 届け先。class のほかはコンストラクタの引数。例:
+# {"class": "weather.events.WebhookSink", "url": "http://localhost:8900/"}
+# {"class": "weather.events.SpoolSink", "directory": BASE_DIR / "events"}
+WEATHER_EVENT_SINKS = [{"class": "weather.events.LogSink"}]
+# 配送待ちのイベントの上限。あふれた分は捨てる
+WEATHER_EVENT_QUEUE_SIZE = 10000
+# 1回に届けるイベント数の上限と、バッチにまとめるために待つ秒数
+WEATHER_EVENT_BATCH_SIZE = 100
+WEATHER_EVENT_FLUSH_INTERVAL = 1.0
+
+
+# 履歴の保持期間(日)。None なら消さない。
+# 生の観測値は1時間・1日の集計に畳んでから消すので、集計の期間より短くてよい
+WEATHER_RETENTION_DAYS = {
+    "observation": 7,
+    "observation_hourly": 90,
+    "observation_daily": None,
+    "forecast": 400,
+}
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {"console": {"class": "logging.StreamHandler"}},
+    "loggers": {"weather": {"handlers": ["console"], "level": "INFO"}},
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
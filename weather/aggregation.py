@@ -0,0 +1,161 @@
+from datetime import date, datetime
+
+import numpy as np
+
+PROBABILITY_MAX_WIND_SPEED = 3
+PROBABILITY_LAND = 0
+
+
+def to_array(rows: list[list[str]], width: int) -> np.ndarray:
+    """文字列の2次元リストを float の配列にする。空文字や欠けは NaN"""
+    values = np.full((len(rows), width), np.nan)
+    for i, row in enumerate(rows):
+        for j, value in enumerate(row[:width]):
+            if value != "":
+                values[i, j] = value
+    return values
+
+
+def group_stats(groups: np.ndarray, values: np.ndarray, n_groups: int):
+    """
+    values の行を groups でまとめ、列ごとに min / max / mean / 件数 を返す。
+
+    NaN は集計から外す。件数 0 のセルの min / max / mean は NaN
+    """
+    valid = ~np.isnan(values)
+    shape = (n_groups, values.shape[1])
+
+    counts = np.zeros(shape)
+    np.add.at(counts, groups, valid)
+    sums = np.zeros(shape)
+    np.add.at(sums, groups, np.where(valid, values, 0.0))
+    minimum = np.full(shape, np.inf)
+    np.minimum.at(minimum, groups, np.where(valid, values, np.inf))
+    maximum = np.full(shape, -np.inf)
+    np.maximum.at(maximum, groups, np.where(valid, values, -np.inf))
+
+    empty = counts == 0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = sums / counts
+    minimum[empty] = np.nan
+    maximum[empty] = np.nan
+    return minimum, maximum, mean, counts
+
+
+def to_datetimes(time_defines: list[str]) -> list[datetime]:
+    return [datetime.fromisoformat(date_str) for date_str in time_defines]
+
+
+def to_dates(time_defines: list[str]) -> list[date]:
+    return [time_define.date() for time_define in to_datetimes(time_defines)]
+
+
+class StationAggregation:
+    """
+    1都道府県分のアメダスの値(values_key の配列)を (観測所 × 時刻) の配列に載せ、
+    リージョン × 時刻 ごとの min / max / mean をまとめて求める
+    """
+
+    def __init__(
+        self, data: dict, amedas_regions: dict[str, str], values_key: str = "temps"
+    ):
+        self.time_defines = to_datetimes(data["timeDefines"])
+
+        region_positions = {}
+        groups, rows = [], []
+        for amedas in data["areas"]:
+            region_code = amedas_regions.get(amedas["area"]["code"])
+            if region_code is None or values_key not in amedas:
+                continue
+            groups.append(
+                region_positions.setdefault(region_code, len(region_positions))
+            )
+            rows.append(amedas[values_key])
+
+        self.region_codes = list(region_positions)
+        self.minimum, self.maximum, self.mean, self.counts = group_stats(
+            np.array(groups, dtype=np.intp),
+            to_array(rows, len(self.time_defines)),
+            len(self.region_codes),
+        )
+
+    def region_means(self, idx: int) -> dict[str, float]:
+        """idx 番目の時刻の平均を、値のあるリージョンについて小数1桁で返す"""
+        return {
+            region_code: round(float(self.mean[g, idx]), 1)
+            for g, region_code in enumerate(self.region_codes)
+            if self.counts[g, idx]
+        }
+
+
+class TemperatureAggregation(StationAggregation):
+    """
+    3日間予報の気温。その日の 00:00 の枠が朝の最低気温、09:00 の枠が日中の最高気温
+    """
+
+    MIN_TEMPS_HOUR = 0
+    MAX_TEMPS_HOUR = 9
+
+    def daily_averages(
+        self,
+    ) -> dict[date, dict[str, tuple[float | None, float | None]]]:
+        """日付 -> リージョン -> (朝の最低気温の平均, 日中の最高気温の平均)"""
+        averages = {}
+        for idx, time_define in enumerate(self.time_defines):
+            if time_define.hour == self.MIN_TEMPS_HOUR:
+                position = 0
+            elif time_define.hour == self.MAX_TEMPS_HOUR:
+                position = 1
+            else:
+                continue
+            by_region = averages.setdefault(time_define.date(), {})
+            for region_code, mean in self.region_means(idx).items():
+                temps = list(by_region.get(region_code, (None, None)))
+                temps[position] = mean
+                by_region[region_code] = tuple(temps)
+        return averages
+
+
+class WindSpeedAggregation:
+    """
+    1都道府県分の最大風速の timeCells を (リージョン × 時刻) の配列に載せ、
+    日付ごとの min / max / mean をまとめて求める
+    """
+
+    def __init__(self, data: dict):
+        dates = to_dates(data["timeDefines"])
+        self.dates = list(dict.fromkeys(dates))
+        date_positions = {target_date: i for i, target_date in enumerate(self.dates)}
+
+        self.region_codes = [a_region["code"] for a_region in data["areas"]]
+        values = to_array(
+            [
+                [
+                    time_cell["locals"][PROBABILITY_LAND]["value"]
+                    for time_cell in a_region["properties"][PROBABILITY_MAX_WIND_SPEED][
+                        "timeCells"
+                    ]
+                ]
+                for a_region in data["areas"]
+            ],
+            len(dates),
+        )
+        # 時刻(列)を日付でまとめるので、転置して行方向に集計する
+        minimum, maximum, mean, counts = group_stats(
+            np.array([date_positions[d] for d in dates], dtype=np.intp),
+            values.T,
+            len(self.dates),
+        )
+        self.minimum, self.maximum = minimum.T, maximum.T
+        self.mean, self.counts = mean.T, counts.T
+
+    def daily_averages(self) -> dict[date, dict[str, float]]:
+        """日付 -> リージョン -> 最大風速の平均"""
+        return {
+            target_date: {
+                region_code: round(float(self.mean[g, date_idx]), 1)
+                for g, region_code in enumerate(self.region_codes)
+                if self.counts[g, date_idx]
+            }
+            for date_idx, target_date in enumerate(self.dates)
+        }
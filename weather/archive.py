@@ -0,0 +1,95 @@
+import gzip
+import os
+import re
+import threading
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+from django.utils import timezone
+
+from weather.bulk import get_bulk_loader
+from weather.models import ArchivedPayload
+
+FORECAST = "forecast"
+PROBABILITY = "probability"
+WARNING = "warning"
+AMEDAS = "amedas"
+OTHER = "other"
+
+# JMA_BASE_URL からの相対パス -> (種類, キー)
+URL_PATTERNS = [
+    (re.compile(r"forecast/data/forecast/(\w+)\.json"), FORECAST),
+    (re.compile(r"probability/data/probability/(\w+)\.json"), PROBABILITY),
+    (re.compile(r"warning/data/warning/(\w+)\.json"), WARNING),
+    (re.compile(r"amedas/data/map/(\d+)\.json"), AMEDAS),
+]
+
+
+def classify(url: str) -> tuple[str, str]:
+    """URL から (種類, 都道府県コードや時刻などのキー) を決める"""
+    path = url.removeprefix(f"{settings.JMA_BASE_URL}/")
+    for pattern, kind in URL_PATTERNS:
+        if match := pattern.fullmatch(path):
+            return kind, match.group(1)
+    return OTHER, path[:50]
+
+
+class PayloadArchive:
+    """
+    取得した応答の本文を、sha256 をファイル名にして gzip で保存する。
+
+    同じ本文は1ファイルにしかならないので、変わらない予報を何度取得しても増えない。
+    どの URL をいつ取得したかは ArchivedPayload に記録する。
+    store() は取得のスレッドから呼ばれるので、ファイルだけ書いて索引はためておき、
+    flush() でまとめて DB に書く
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self.pending: list[ArchivedPayload] = []
+        self.lock = threading.Lock()
+
+    def path(self, sha256: str) -> Path:
+        return self.directory / sha256[:2] / sha256[2:4] / f"{sha256}.json.gz"
+
+    def store(self, response):
+        """JmaResponse の本文を保存する。本文が同じファイルが既にあれば書かない"""
+        path = self.path(response.sha256)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+            with gzip.open(tmp_path, "wb") as f:
+                for chunk in response.iter_chunks():
+                    f.write(chunk)
+            os.replace(tmp_path, path)
+        kind, key = classify(response.url)
+        with self.lock:
+            self.pending.append(
+                ArchivedPayload(
+                    url=response.url,
+                    kind=kind,
+                    key=key,
+                    sha256=response.sha256,
+                    size=response.size,
+                    fetched_at=timezone.now(),
+                )
+            )
+
+    def flush(self) -> int:
+        """ためた索引を書く。同じ URL と本文の組は最初に取得した1行だけを残す"""
+        with self.lock:
+            rows, self.pending = self.pending, []
+        return get_bulk_loader().upsert(
+            ArchivedPayload, rows, unique_fields=["url", "sha256"], update_fields=[]
+        )
+
+    def read(self, sha256: str) -> bytes:
+        with gzip.open(self.path(sha256), "rb") as f:
+            return f.read()
+
+
+def get_archive() -> PayloadArchive | None:
+    """settings.WEATHER_ARCHIVE_DIR が None なら保存しない"""
+    directory = settings.WEATHER_ARCHIVE_DIR
+    return PayloadArchive(directory) if directory is not None else None
@@ -0,0 +1,258 @@
+import sys
+import threading
+from array import array
+from bisect import bisect_right
+from typing import NamedTuple
+
+from weather.data_version import get_versions
+from weather.models import (
+    JmaAmedas,
+    JmaAreas1,
+    JmaAreas2,
+    JmaAreas3,
+    JmaAreas4,
+    JmaDataVersion,
+)
+
+CENTER = "center"
+PREFECTURE = "prefecture"
+REGION = "region"
+CITY = "city"
+AMEDAS = "amedas"
+
+PARENT_LEVEL = {PREFECTURE: CENTER, REGION: PREFECTURE, CITY: REGION, AMEDAS: REGION}
+CHILD_LEVELS = {CENTER: (PREFECTURE,), PREFECTURE: (REGION,), REGION: (CITY, AMEDAS)}
+# 桁数が同じ階層もあるので、細かい階層から順に探す
+LOOKUP_ORDER = (CITY, AMEDAS, REGION, PREFECTURE, CENTER)
+
+
+class Area(NamedTuple):
+    level: str
+    code: str
+    name: str
+
+
+class _Level:
+    """
+    1階層分の索引。i 番目の要素のコード・名前・親の位置を並べて持ち、
+    子の位置は親ごとに連続するよう children_offsets / children で引けるようにする
+    """
+
+    __slots__ = (
+        "codes",
+        "names",
+        "parents",
+        "positions",
+        "children_offsets",
+        "children",
+        "haystack",
+        "name_starts",
+    )
+
+    def __init__(self, rows: list[tuple[str, str, int]]):
+        self.codes = tuple(sys.intern(code) for code, _, _ in rows)
+        self.names = tuple(sys.intern(name) for _, name, _ in rows)
+        self.parents = array("i", (parent for _, _, parent in rows))
+        self.positions = {code: i for i, code in enumerate(self.codes)}
+        self.children_offsets = array("i")
+        self.children = array("i")
+
+        # 名前の部分一致検索用に、全部の名前を区切り文字でつないでおく
+        self.haystack = "\0".join(self.names)
+        starts, start = array("i"), 0
+        for name in self.names:
+            starts.append(start)
+            start += len(name) + 1
+        self.name_starts = starts
+
+    def index_children_of(self, n_parents: int):
+        """この階層の要素を親の位置ごとにまとめる(CSR 形式)"""
+        counts = [0] * (n_parents + 1)
+        for parent in self.parents:
+            if parent >= 0:
+                counts[parent + 1] += 1
+        for i in range(n_parents):
+            counts[i + 1] += counts[i]
+        offsets = array("i", counts)
+        children = array("i", [0] * offsets[-1])
+        cursor = list(counts[:-1])
+        for i, parent in enumerate(self.parents):
+            if parent >= 0:
+                children[cursor[parent]] = i
+                cursor[parent] += 1
+        self.children_offsets, self.children = offsets, children
+
+    def children_of(self, parent: int) -> array:
+        if not self.children_offsets:
+            return array("i")
+        return self.children[
+            self.children_offsets[parent] : self.children_offsets[parent + 1]
+        ]
+
+    def find(self, text: str) -> list[int]:
+        found, start = [], self.haystack.find(text)
+        while start >= 0:
+            i = bisect_right(self.name_starts, start) - 1
+            if start + len(text) <= self.name_starts[i] + len(self.names[i]):
+                if not found or found[-1] != i:
+                    found.append(i)
+            start = self.haystack.find(text, start + 1)
+        return found
+
+
+class AreaIndex:
+    """
+    地方(center) > 都道府県(office) > リージョン(class10) > 市区町村(class20) と
+    リージョンに属するアメダスの階層を、タプルと配列だけで持つ不変の索引。
+    モデルのインスタンスは持たないので、全国分でも小さく、引くのは辞書1回分
+    """
+
+    def __init__(
+        self,
+        centers: list[tuple[str, str]],
+        prefectures: list[tuple[str, str, str]],
+        regions: list[tuple[str, str, str]],
+        cities: list[tuple[str, str, str]],
+        amedas: list[tuple[str, str, str]],
+    ):
+        """centers は (code, name)、それ以外は (code, 親の code, name)"""
+        self.levels: dict[str, _Level] = {}
+        self.levels[CENTER] = _Level([(code, name, -1) for code, name in centers])
+        for level, rows in (
+            (PREFECTURE, prefectures),
+            (REGION, regions),
+            (CITY, cities),
+            (AMEDAS, amedas),
+        ):
+            parent_positions = self.levels[PARENT_LEVEL[level]].positions
+            self.levels[level] = _Level(
+                [
+                    (code, name, parent_positions.get(parent_code, -1))
+                    for code, parent_code, name in rows
+                ]
+            )
+            self.levels[level].index_children_of(
+                len(self.levels[PARENT_LEVEL[level]].codes)
+            )
+
+    def __len__(self):
+        return sum(len(level.codes) for level in self.levels.values())
+
+    def _locate(self, code: str, level: str | None = None) -> tuple[str, int] | None:
+        for candidate in (level,) if level else LOOKUP_ORDER:
+            position = self.levels[candidate].positions.get(code)
+            if position is not None:
+                return candidate, position
+        return None
+
+    def _area(self, level: str, position: int) -> Area:
+        return Area(
+            level,
+            self.levels[level].codes[position],
+            self.levels[level].names[position],
+        )
+
+    def resolve(self, code: str, level: str | None = None) -> Area | None:
+        located = self._locate(code, level)
+        return located and self._area(*located)
+
+    def parent(self, code: str, level: str | None = None) -> Area | None:
+        located = self._locate(code, level)
+        if located is None or located[0] == CENTER:
+            return None
+        level, position = located
+        parent = self.levels[level].parents[position]
+        return self._area(PARENT_LEVEL[level], parent) if parent >= 0 else None
+
+    def ancestors(self, code: str, level: str | None = None) -> tuple[Area, ...]:
+        """近い順に 親, 祖父母, ... と地方までたどる"""
+        located = self._locate(code, level)
+        if located is None:
+            return ()
+        level, position = located
+        ancestors = []
+        while level != CENTER:
+            position = self.levels[level].parents[position]
+            level = PARENT_LEVEL[level]
+            if position < 0:
+                break
+            ancestors.append(self._area(level, position))
+        return tuple(ancestors)
+
+    def region_of(self, code: str, level: str | None = None) -> Area | None:
+        """市区町村・アメダスの属するリージョン。リージョンならそれ自身"""
+        located = self._locate(code, level)
+        if located is None:
+            return None
+        if located[0] == REGION:
+            return self._area(*located)
+        if located[0] in (CITY, AMEDAS):
+            return self.parent(code, located[0])
+        return None
+
+    def children(self, code: str, level: str | None = None) -> tuple[Area, ...]:
+        located = self._locate(code, level)
+        if located is None:
+            return ()
+        level, position = located
+        return tuple(
+            self._area(child_level, child)
+            for child_level in CHILD_LEVELS.get(level, ())
+            for child in self.levels[child_level].children_of(position)
+        )
+
+    def descendants(self, code: str, level: str | None = None) -> tuple[Area, ...]:
+        """子孫を深さ優先でたどる(アメダスはリージョンの子として含む)"""
+        descendants = []
+        stack = list(reversed(self.children(code, level)))
+        while stack:
+            area = stack.pop()
+            descendants.append(area)
+            stack.extend(reversed(self.children(area.code, area.level)))
+        return tuple(descendants)
+
+    def search(self, text: str, level: str | None = None) -> tuple[Area, ...]:
+        """名前の部分一致。level を省くと全階層を地方から順に探す"""
+        levels = (level,) if level else (CENTER, PREFECTURE, REGION, CITY, AMEDAS)
+        return tuple(
+            self._area(candidate, position)
+            for candidate in levels
+            for position in self.levels[candidate].find(text)
+        )
+
+
+def load_area_index() -> AreaIndex:
+    return AreaIndex(
+        list(JmaAreas1.objects.order_by("id").values_list("id", "name")),
+        list(
+            JmaAreas2.objects.order_by("id").values_list("id", "jma_area1_id", "name")
+        ),
+        list(
+            JmaAreas3.objects.order_by("id").values_list("id", "jma_area2_id", "name")
+        ),
+        list(
+            JmaAreas4.objects.order_by("id").values_list("id", "jma_area3_id", "name")
+        ),
+        list(
+            JmaAmedas.objects.order_by("id").values_list("id", "jma_area3_id", "name")
+        ),
+    )
+
+
+_current = {"master_version": None, "index": None}
+_lock = threading.Lock()
+
+
+def get_area_index() -> AreaIndex:
+    """
+    プロセスで共有する索引。初回に読み込み、update_jma_master が
+    マスタの版を上げたら作り直す。作り直す間も古い索引は読める
+    """
+    master_version = get_versions()[JmaDataVersion.MASTER]
+    if _current["master_version"] != master_version:
+        with _lock:
+            if _current["master_version"] != master_version:
+                index = load_area_index()
+                _current["index"] = index
+                _current["master_version"] = master_version
+    return _current["index"]
@@ -0,0 +1,174 @@
+import io
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager, redirect_stdout
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+
+from weather import jma_json
+from weather.jma_client import (
+    JmaClient,
+    forecast_url,
+    jma_url,
+    probability_url,
+    warning_url,
+)
+from weather.metrics import QueryCounter
+
+MASTER_PATHS = [
+    "common/const/area.json",
+    "forecast/const/forecast_area.json",
+    "amedas/const/amedastable.json",
+]
+
+
+def fixture_path(directory: Path, url: str) -> Path:
+    """JMA の URL を、fixtures の下の同じ相対パスに対応させる"""
+    return Path(directory) / url.removeprefix(f"{settings.JMA_BASE_URL}/")
+
+
+def fixture_prefecture_ids(directory: Path) -> list[str]:
+    """area.json の都道府県のうち、予報の fixture がそろっているもの"""
+    offices = jma_json.loads((Path(directory) / MASTER_PATHS[0]).read_bytes())[
+        "offices"
+    ]
+    return [
+        prefecture_id
+        for prefecture_id in sorted(offices)
+        if fixture_path(directory, forecast_url(prefecture_id)).exists()
+    ]
+
+
+def record_fixtures(directory: Path, client: JmaClient) -> tuple[int, list[str]]:
+    """
+    気象庁から現在の応答を取得して directory に保存する。
+
+    確率予報などが無い都道府県もあるので、取得できなかった URL は返して呼び出し側に任せる
+    """
+    master_urls = [jma_url(path) for path in MASTER_PATHS]
+    responses = [client.get(url) for url in master_urls]
+    offices = responses[0].json()["offices"]
+    urls = [
+        url_of(prefecture_id)
+        for prefecture_id in sorted(offices)
+        for url_of in (forecast_url, probability_url, warning_url)
+    ]
+    results = client.fetch_grouped({url: [url] for url in urls}, budget=60)
+
+    missing = []
+    for url, result in results.items():
+        if isinstance(result, Exception):
+            missing.append(url)
+        else:
+            responses.extend(result)
+    for response in responses:
+        path = fixture_path(directory, response.url)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(response.content)
+    return len(responses), missing
+
+
+class _FixtureHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+@contextmanager
+def serve_fixtures(directory: Path):
+    """fixtures をローカルの HTTP サーバで配り、JMA_BASE_URL の代わりになる URL を返す"""
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", 0), partial(_FixtureHandler, directory=str(directory))
+    )
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def peak_rss_kb() -> int | None:
+    """このプロセスの最大常駐メモリ(KB)。resource の無い Windows では None"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS だけ単位がバイト
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def measure_command(command: str, args: list[str]) -> dict:
+    """
+    管理コマンドを1回実行して計測する。
+
+    最大常駐メモリはプロセス単位でしか取れないので、1プロセスで1コマンドだけ実行すること
+    """
+    counter = QueryCounter()
+    startup_rss_kb = peak_rss_kb()
+    started = time.perf_counter()
+    with connection.execute_wrapper(counter), redirect_stdout(io.StringIO()):
+        call_command(command, *args, stdout=io.StringIO(), stderr=io.StringIO())
+    wall_time = time.perf_counter() - started
+    return {
+        "command": command,
+        "wall_time": round(wall_time, 4),
+        "queries": counter.queries,
+        "rows_written": counter.rows_written,
+        "rows_per_sec": round(counter.rows_written / wall_time, 1),
+        "startup_rss_kb": startup_rss_kb,
+        "peak_rss_kb": peak_rss_kb(),
+    }
+
+
+def decoders() -> dict:
+    """比べるパーサ。json は requests の .json() と同じく、いったん文字列にしてから読む"""
+    found = {"json": lambda content: json.loads(content.decode("utf-8"))}
+    if jma_json.orjson is not None:
+        found["orjson"] = jma_json.orjson.loads
+    return found
+
+
+def decode_payloads(directory: Path) -> dict[str, list[bytes]]:
+    """デコードの計測に使う fixture。予報・確率・警報は全都道府県分をまとめて1つにする"""
+    directory = Path(directory)
+    payloads = {
+        Path(path).stem: [(directory / path).read_bytes()] for path in MASTER_PATHS
+    }
+    for kind in ("forecast", "probability", "warning"):
+        files = sorted((directory / kind / "data" / kind).glob("*.json"))
+        if files:
+            payloads[kind] = [path.read_bytes() for path in files]
+    return payloads
+
+
+def measure_decode(name: str, contents: list[bytes], iterations: int) -> list[dict]:
+    """contents を iterations 回デコードし、最も速かった回の所要時間をパーサごとに返す"""
+    size = sum(len(content) for content in contents)
+    results = []
+    for parser, decode in decoders().items():
+        best = float("inf")
+        for _ in range(iterations):
+            started = time.perf_counter()
+            for content in contents:
+                decode(content)
+            best = min(best, time.perf_counter() - started)
+        results.append(
+            {
+                "payload": name,
+                "files": len(contents),
+                "bytes": size,
+                "parser": parser,
+                "seconds": round(best, 6),
+                "mb_per_sec": round(size / best / 1e6, 1),
+            }
+        )
+    return results
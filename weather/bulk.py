@@ -0,0 +1,191 @@
+import csv
+import io
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Model
+
+# 1回の executemany / COPY に載せる行数
+DEFAULT_CHUNK_SIZE = 2000
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """
+    connection_created で呼ばれ、SQLite の接続に settings.WEATHER_SQLITE_PRAGMAS を当てる。
+
+    settings.WEATHER_SQLITE_WAL で WAL にしておくと、取り込みの書き込み中も
+    API の読み出しが待たされない
+    """
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for name, value in settings.WEATHER_SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+
+
+class BulkLoader:
+    """
+    モデルの行を ORM を通さずにまとめて書き込む。
+
+    bulk_create / bulk_update は行ごとにモデルの処理と SQL の組み立てを挟むので、
+    列の値だけを取り出して、DB ごとに速い経路で流し込む。
+    1回の upsert は1トランザクションに収める。実行全体を1つにまとめたいときは
+    呼び出し側で transaction.atomic() に入れる
+    """
+
+    def __init__(self, connection, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self.connection = connection
+        self.chunk_size = chunk_size
+
+    def upsert(
+        self,
+        model: type[Model],
+        rows: list[Model],
+        unique_fields: list[str],
+        update_fields: list[str],
+    ) -> int:
+        """
+        rows を書き込む。unique_fields が同じ行が既にあれば update_fields だけを上書きする
+        """
+        if not rows:
+            return 0
+        fields = self.insert_fields(model)
+        with transaction.atomic(using=self.connection.alias, savepoint=False):
+            self.write(
+                model,
+                fields,
+                [self.values(row, fields) for row in rows],
+                [model._meta.get_field(name).column for name in unique_fields],
+                [model._meta.get_field(name).column for name in update_fields],
+            )
+        return len(rows)
+
+    def insert_fields(self, model: type[Model]) -> list:
+        # 自動採番の主キーは DB に任せる
+        opts = model._meta
+        return [field for field in opts.concrete_fields if field is not opts.auto_field]
+
+    def values(self, row: Model, fields: list) -> tuple:
+        return tuple(
+            field.get_db_prep_save(field.pre_save(row, True), self.connection)
+            for field in fields
+        )
+
+    def write(
+        self,
+        model: type[Model],
+        fields: list,
+        values: list[tuple],
+        conflict_columns: list[str],
+        update_columns: list[str],
+    ):
+        raise NotImplementedError
+
+    def upsert_clause(
+        self, conflict_columns: list[str], update_columns: list[str], source: str
+    ) -> str:
+        qn = self.connection.ops.quote_name
+        conflict = ", ".join(qn(column) for column in conflict_columns)
+        if not update_columns:
+            return f"ON CONFLICT ({conflict}) DO NOTHING"
+        assignments = ", ".join(
+            f"{qn(column)} = {source}.{qn(column)}" for column in update_columns
+        )
+        return f"ON CONFLICT ({conflict}) DO UPDATE SET {assignments}"
+
+
+class SqliteBulkLoader(BulkLoader):
+    """INSERT ... ON CONFLICT DO UPDATE を chunk_size 行ずつ executemany する"""
+
+    def write(self, model, fields, values, conflict_columns, update_columns):
+        qn = self.connection.ops.quote_name
+        columns = ", ".join(qn(field.column) for field in fields)
+        placeholders = ", ".join(["%s"] * len(fields))
+        sql = (
+            f"INSERT INTO {qn(model._meta.db_table)} ({columns}) "
+            f"VALUES ({placeholders}) "
+            + self.upsert_clause(conflict_columns, update_columns, "excluded")
+        )
+        with self.connection.cursor() as cursor:
+            for start in range(0, len(values), self.chunk_size):
+                cursor.executemany(sql, values[start : start + self.chunk_size])
+
+
+class PostgresBulkLoader(BulkLoader):
+    """
+    一時テーブルに COPY で流し込んでから、INSERT ... SELECT で本体に反映する。
+
+    一時テーブルはトランザクションの終わりに消える
+    """
+
+    def write(self, model, fields, values, conflict_columns, update_columns):
+        qn = self.connection.ops.quote_name
+        table = qn(model._meta.db_table)
+        staging = qn(f"{model._meta.db_table}_staging")
+        columns = ", ".join(qn(field.column) for field in fields)
+        with self.connection.cursor() as cursor:
+            # 書き込む列だけを型ごと写す。LIKE で写すと自動採番の主キーが
+            # NOT NULL のまま残り、COPY で値を渡さない id が制約に反する
+            cursor.execute(
+                f"CREATE TEMPORARY TABLE IF NOT EXISTS {staging} ON COMMIT DROP "
+                f"AS SELECT {columns} FROM {table} WITH NO DATA"
+            )
+            cursor.execute(f"TRUNCATE {staging}")
+            for start in range(0, len(values), self.chunk_size):
+                self.copy(
+                    cursor, staging, columns, values[start : start + self.chunk_size]
+                )
+            # 同じキーの行が重なっていても ON CONFLICT が1行ずつ扱えるよう、後の方を採る
+            conflict = ", ".join(qn(column) for column in conflict_columns)
+            cursor.execute(
+                f"INSERT INTO {table} ({columns}) "
+                f"SELECT DISTINCT ON ({conflict}) {columns} FROM {staging} "
+                f"ORDER BY {conflict}, ctid DESC "
+                + self.upsert_clause(conflict_columns, update_columns, "EXCLUDED")
+            )
+
+    @staticmethod
+    def copy(cursor, staging: str, columns: str, values: list[tuple]):
+        sql = f"COPY {staging} ({columns}) FROM STDIN"
+        if hasattr(cursor, "copy"):
+            # psycopg 3
+            with cursor.copy(sql) as copy:
+                for row in values:
+                    copy.write_row(row)
+            return
+        # psycopg2 は CSV に書き出して渡す。NULL は \N で表す
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in values:
+            writer.writerow([r"\N" if value is None else value for value in row])
+        buffer.seek(0)
+        cursor.copy_expert(f"{sql} WITH (FORMAT csv, NULL '\\N')", buffer)
+
+
+class OrmBulkLoader(BulkLoader):
+    """専用の経路が無い DB では bulk_create にまかせる"""
+
+    def upsert(self, model, rows, unique_fields, update_fields):
+        if not rows:
+            return 0
+        model.objects.bulk_create(
+            rows,
+            batch_size=self.chunk_size,
+            update_conflicts=bool(update_fields),
+            ignore_conflicts=not update_fields,
+            unique_fields=unique_fields if update_fields else None,
+            update_fields=update_fields or None,
+        )
+        return len(rows)
+
+
+LOADERS = {
+    "sqlite": SqliteBulkLoader,
+    "postgresql": PostgresBulkLoader,
+}
+
+
+def get_bulk_loader(using: str = "default", chunk_size: int = None) -> BulkLoader:
+    connection = connections[using]
+    loader_class = LOADERS.get(connection.vendor, OrmBulkLoader)
+    return loader_class(connection, chunk_size or settings.WEATHER_BULK_CHUNK_SIZE)
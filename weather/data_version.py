@@ -0,0 +1,28 @@
+import threading
+import time
+
+from django.conf import settings
+
+from weather.models import JmaDataVersion
+
+_cached = {"versions": None, "expires_at": 0.0}
+_lock = threading.Lock()
+
+
+def get_versions() -> dict[str, int]:
+    """
+    JmaDataVersion の現在値。DB への問い合わせは
+    WEATHER_API_VERSION_TTL 秒に1回だけにする
+    """
+    with _lock:
+        now = time.monotonic()
+        if _cached["versions"] is None or now >= _cached["expires_at"]:
+            _cached["versions"] = JmaDataVersion.current()
+            _cached["expires_at"] = now + settings.WEATHER_API_VERSION_TTL
+        return _cached["versions"]
+
+
+def expire():
+    """次の get_versions() で必ず読み直させる"""
+    with _lock:
+        _cached["expires_at"] = 0.0
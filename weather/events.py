@@ -0,0 +1,199 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+import requests
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from weather.warning_codes import M_TARGET_WARNINGS, warning_codes
+
+logger = logging.getLogger(__name__)
+
+ISSUED = "issued"
+LIFTED = "lifted"
+
+
+def diff_warnings(
+    area_type: str,
+    previous: dict[str, int],
+    current: dict[str, int],
+    reported_at: dict[str, str],
+) -> list[dict]:
+    """
+    地域ごとの active_mask を前回と比べ、増えた警報を issued、消えた警報を lifted にする。
+
+    previous にあって current に無い地域は、警報がすべて消えたものとみなす。
+    previous に無い地域は初めて取り込んだもので、比べる前の状態が無いので何も出さない。
+    空の表に初めて取り込んだときに、出ている警報をすべて issued として送らないため
+    """
+    detected_at = datetime.now().astimezone().isoformat(timespec="seconds")
+    events = []
+    for area_code in sorted(previous):
+        before, after = previous[area_code], current.get(area_code, 0)
+        for event_type, mask in ((ISSUED, after & ~before), (LIFTED, before & ~after)):
+            for code in warning_codes(mask):
+                events.append(
+                    {
+                        "type": event_type,
+                        "area_type": area_type,
+                        "area": area_code,
+                        "warning": code,
+                        "name": M_TARGET_WARNINGS[code],
+                        "reported_at": reported_at.get(area_code),
+                        "detected_at": detected_at,
+                    }
+                )
+    return events
+
+
+class LogSink:
+    """イベントをログに1行ずつ書く"""
+
+    def send(self, events: list[dict]):
+        for event in events:
+            logger.info(json.dumps(event, ensure_ascii=False))
+
+
+class WebhookSink:
+    """イベントのバッチを JSON の配列として POST する"""
+
+    def __init__(self, url: str, timeout: float = 5):
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def send(self, events: list[dict]):
+        response = self.session.post(self.url, json=events, timeout=self.timeout)
+        response.raise_for_status()
+
+
+class SpoolSink:
+    """
+    ローカルのキュー。バッチごとに JSON Lines のファイルを directory に置く。
+
+    書きかけのファイルを読ませないよう、一時ファイルに書いてから .jsonl に改名する。
+    読み手はファイル名順に処理して消せばよい
+    """
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def send(self, events: list[dict]):
+        name = f"{time.time_ns()}-{uuid.uuid4().hex[:8]}"
+        tmp_path = self.directory / f"{name}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for event in events:
+                f.write(json.dumps(event, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.directory / f"{name}.jsonl")
+
+
+def build_sinks(configs: list[dict]) -> list:
+    """settings.WEATHER_EVENT_SINKS の {"class": ..., 引数...} から sink を作る"""
+    sinks = []
+    for config in configs:
+        options = dict(config)
+        sinks.append(import_string(options.pop("class"))(**options))
+    return sinks
+
+
+class EventDispatcher:
+    """
+    イベントを別スレッドから sink に届ける。
+
+    emit() はキューに積むだけで待たないので、sink が遅くても取り込みは止まらない。
+    キューがあふれたら古いものを待たせず新しいイベントを捨て、dropped に数える
+    """
+
+    _STOP = object()
+
+    def __init__(
+        self,
+        sinks: list,
+        queue_size: int = 10000,
+        batch_size: int = 100,
+        flush_interval: float = 1.0,
+    ):
+        self.sinks = sinks
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.thread = threading.Thread(
+            target=self._run, name="weather-events", daemon=True
+        )
+        self.thread.start()
+
+    def emit(self, events: list[dict]):
+        for event in events:
+            try:
+                self.queue.put_nowait(event)
+            except queue.Full:
+                self.dropped += 1
+                logger.warning("event queue is full, dropped %s", event)
+
+    def close(self, timeout: float = 10):
+        """積まれているイベントを届けきってからスレッドを止める"""
+        if not self.thread.is_alive():
+            return
+        self.queue.put(self._STOP)
+        self.thread.join(timeout)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = [self.queue.get()]
+            if batch[0] is self._STOP:
+                break
+            # 少し待って、その間に来たイベントを1つのバッチにまとめる
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    event = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if event is self._STOP:
+                    stopping = True
+                    break
+                batch.append(event)
+            self._deliver(batch)
+
+    def _deliver(self, batch: list[dict]):
+        # 1つの sink の失敗でほかの sink への配送を止めない
+        for sink in self.sinks:
+            try:
+                sink.send(batch)
+            except Exception:
+                logger.exception(
+                    "failed to deliver %d events to %s", len(batch), type(sink).__name__
+                )
+
+
+_dispatcher = None
+_lock = threading.Lock()
+
+
+def get_dispatcher() -> EventDispatcher:
+    """プロセスで共有する dispatcher。終了時に残りのイベントを届けてから止める"""
+    global _dispatcher
+    with _lock:
+        if _dispatcher is None:
+            _dispatcher = EventDispatcher(
+                build_sinks(settings.WEATHER_EVENT_SINKS),
+                queue_size=settings.WEATHER_EVENT_QUEUE_SIZE,
+                batch_size=settings.WEATHER_EVENT_BATCH_SIZE,
+                flush_interval=settings.WEATHER_EVENT_FLUSH_INTERVAL,
+            )
+            atexit.register(_dispatcher.close)
+        return _dispatcher
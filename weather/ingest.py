@@ -0,0 +1,290 @@
+import time
+from contextlib import contextmanager
+from typing import Any
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+
+from weather.archive import get_archive
+from weather.jma_client import (
+    DEFAULT_CONCURRENCY,
+    JmaClient,
+    JmaResponse,
+    ResponseCache,
+)
+from weather.metrics import IngestMetrics, add_metrics_arguments, instrument
+from weather.models import Facility, JmaAreas2
+from weather.read_model import refresh_city_forecasts
+
+# 1都道府県あたりの取得にかけてよい秒数
+DEFAULT_BUDGET = 30.0
+
+# run_weather_scheduler は全ジョブに call_command(client=...) で共有の JmaClient を渡す。
+# ジョブになるコマンドは、これを stealth_options にして受け付ける
+SHARED_CLIENT_OPTIONS = ("client",)
+
+
+def add_ingest_arguments(parser):
+    """fetch 系コマンドに共通のオプション"""
+    add_selection_arguments(parser)
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="process every prefecture even if JMA has not updated it",
+    )
+    add_metrics_arguments(parser)
+
+
+def add_selection_arguments(parser):
+    """取り込む都道府県と取得のしかたを決めるオプション"""
+    group = parser.add_mutually_exclusive_group()
+    # どちらも指定しなければ、施設のある都道府県だけを取り込む
+    group.add_argument(
+        "--all",
+        action="store_true",
+        help=(
+            "ingest every prefecture registered in JmaAreas2 "
+            "(default: only the prefectures that have a Facility)"
+        ),
+    )
+    group.add_argument(
+        "--prefectures",
+        nargs="+",
+        metavar="PREFECTURE",
+        help="JmaAreas2 ids or names to ingest (e.g. 280000 東京都)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help="max number of parallel requests to JMA",
+    )
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=DEFAULT_BUDGET,
+        help="seconds allowed for fetching one prefecture",
+    )
+
+
+def resolve_prefecture_ids(options: dict) -> list[str]:
+    """
+    取り込む都道府県コード。対象が1つも無ければ CommandError にして、
+    スケジューラが何も取り込めないまま常駐を始めないようにする
+    """
+    if options["concurrency"] < 1:
+        raise CommandError("--concurrency must be 1 or more")
+    if options["budget"] <= 0:
+        raise CommandError("--budget must be positive")
+
+    if options["all"]:
+        prefecture_ids = list(
+            JmaAreas2.objects.order_by("id").values_list("id", flat=True)
+        )
+        if not prefecture_ids:
+            raise CommandError("JmaAreas2 is empty. run update_jma_master first")
+        return prefecture_ids
+
+    if options["prefectures"]:
+        selectors = options["prefectures"]
+        found = {
+            selector: pref_id
+            for pref_id, name in JmaAreas2.objects.filter(
+                Q(id__in=selectors) | Q(name__in=selectors)
+            ).values_list("id", "name")
+            for selector in (pref_id, name)
+        }
+        unknown = [selector for selector in selectors if selector not in found]
+        if unknown:
+            raise CommandError(f"unknown prefectures: {', '.join(unknown)}")
+        return list(dict.fromkeys(found[selector] for selector in selectors))
+
+    prefecture_ids = get_facility_prefecture_ids()
+    if not prefecture_ids:
+        raise CommandError(
+            "no facility is registered. "
+            "run import_facility, or pass --all or --prefectures"
+        )
+    return prefecture_ids
+
+
+@contextmanager
+def ingest_client(options: dict):
+    """
+    コマンドの JmaClient。
+
+    常駐するスケジューラから call_command(client=...) で共有のクライアントを
+    渡されたときは、接続プールを使い回すためにそれを使い、閉じない。
+    抜けるときに、取得した本文の保存の索引を書く
+    """
+    if options.get("client") is not None:
+        client = options["client"]
+        try:
+            yield client
+        finally:
+            flush_archive(client)
+        return
+    with JmaClient(
+        concurrency=options.get("concurrency", DEFAULT_CONCURRENCY),
+        cache=ResponseCache(settings.JMA_CACHE_DIR),
+        force=options["force"],
+        archive=get_archive(),
+    ) as client:
+        try:
+            yield client
+        finally:
+            flush_archive(client)
+
+
+def flush_archive(client: JmaClient):
+    """取得のスレッドでためた保存済みの本文の索引を、このスレッドから DB に書く"""
+    if client.archive is not None:
+        client.archive.flush()
+
+
+def get_facility_prefecture_ids() -> list[str]:
+    """
+    施設のある都道府県コードを重複なしで返す。
+
+    施設を全件なめるのではなく、都道府県ごとに 市区町村 -> Facility.jma_area4 の
+    インデックスを EXISTS で引くだけなので、施設数が増えてもほぼ一定
+    """
+    return list(
+        JmaAreas2.objects.filter(
+            Exists(Facility.objects.filter(jma_area4__jma_area2=OuterRef("pk")))
+        )
+        .order_by("id")
+        .values_list("id", flat=True)
+    )
+
+
+class IngestSummary:
+    """1回の取り込みの集計。都道府県ごとの成否と書き込み行数を持つ"""
+
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.finished_at = None
+        self.processed: list[str] = []
+        self.not_modified: list[str] = []
+        self.failures: dict[str, str] = {}
+        self.rows_written = 0
+
+    def fail(self, prefecture_id: str, error: Exception):
+        self.failures[prefecture_id] = f"{type(error).__name__}: {error}"
+
+    def finish(self):
+        self.finished_at = time.monotonic()
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    @property
+    def prefectures_per_sec(self) -> float:
+        total = len(self.processed) + len(self.not_modified) + len(self.failures)
+        return total / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        lines = [
+            f"processed: {len(self.processed)}, not modified: {len(self.not_modified)}, "
+            f"failed: {len(self.failures)}, rows written: {self.rows_written}, "
+            f"elapsed: {self.elapsed:.2f}s ({self.prefectures_per_sec:.1f} prefectures/sec)"
+        ]
+        for prefecture_id, reason in self.failures.items():
+            lines.append(f"  {prefecture_id}: {reason}")
+        return "\n".join(lines)
+
+
+class PrefectureIngestCommand(BaseCommand):
+    """
+    都道府県ごとの JSON を取り込むコマンドの共通部分。
+
+    全都道府県の urls() を並列に取得し、変わった都道府県だけを parse() で行にする。
+    1つの都道府県の失敗は IngestSummary に記録して、ほかの都道府県は続ける。
+    処理できた都道府県の分は write() で1トランザクションにまとめて差分更新し、
+    読み出し用の表も同じトランザクションで直す。コミットできた応答だけを
+    キャッシュに覚えるので、失敗した都道府県は次回また取り込まれる
+    """
+
+    stealth_options = SHARED_CLIENT_OPTIONS
+    # instrument() に渡す名前と、終わったときのメッセージ
+    name = ""
+    completed_message = ""
+
+    def add_arguments(self, parser):
+        add_ingest_arguments(parser)
+
+    def handle(self, *args, **options):
+        with instrument(self.name, options) as metrics:
+            self.ingest(metrics, options)
+
+    def urls(self, prefecture_id: str) -> list[str]:
+        raise NotImplementedError
+
+    def prepare(self):
+        """parse() の前に1回だけ呼ばれる。都道府県によらない索引などを用意する"""
+
+    def parse(self, prefecture_id: str, *payloads) -> Any:
+        """urls() の順にデコードした JSON から、その都道府県の行を作る"""
+        raise NotImplementedError
+
+    def write(self, parsed: dict[str, Any]) -> int:
+        """都道府県 -> parse() の結果 を書き込み、書き込んだ行数を返す"""
+        raise NotImplementedError
+
+    def ingest(self, metrics: IngestMetrics, options: dict):
+        prefecture_ids = resolve_prefecture_ids(options)
+        summary = IngestSummary()
+
+        # パースを始める前に、全都道府県の分を並列で取得しておく
+        with metrics.stage("fetch"), ingest_client(options) as client:
+            fetched = client.fetch_grouped(
+                {
+                    prefecture_id: self.urls(prefecture_id)
+                    for prefecture_id in prefecture_ids
+                },
+                budget=options["budget"],
+            )
+
+        self.prepare()
+        parsed = {}
+        for prefecture_id in prefecture_ids:
+            responses = fetched[prefecture_id]
+            if isinstance(responses, Exception):
+                summary.fail(prefecture_id, responses)
+                continue
+            metrics.add_responses(prefecture_id, responses)
+            if not any(response.changed for response in responses):
+                self.stdout.write(f"{prefecture_id}: not modified")
+                summary.not_modified.append(prefecture_id)
+                continue
+            try:
+                parsed[prefecture_id] = self.parse_responses(
+                    metrics, prefecture_id, responses
+                )
+            except Exception as e:
+                summary.fail(prefecture_id, e)
+                continue
+            summary.processed.append(prefecture_id)
+
+        with metrics.stage("write"), transaction.atomic():
+            summary.rows_written = self.write(parsed)
+            city_result = refresh_city_forecasts(summary.processed)
+        self.stdout.write(f"city forecasts: {city_result}")
+        for prefecture_id in summary.processed:
+            client.remember(*fetched[prefecture_id])
+
+        summary.finish()
+        self.stdout.write(str(summary))
+        self.stdout.write(str(metrics))
+        self.stdout.write(self.style.SUCCESS(self.completed_message))
+
+    def parse_responses(
+        self, metrics: IngestMetrics, prefecture_id: str, responses: list[JmaResponse]
+    ) -> Any:
+        with metrics.stage("decode", prefecture_id):
+            payloads = [response.json() for response in responses]
+        with metrics.stage("aggregate", prefecture_id):
+            return self.parse(prefecture_id, *payloads)
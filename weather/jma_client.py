@@ -0,0 +1,393 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from weather import jma_json
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_TIMEOUT = 30
+# stream=True で本文を読み書きする単位
+STREAM_CHUNK_SIZE = 1 << 16
+
+
+def jma_url(path: str) -> str:
+    return f"{settings.JMA_BASE_URL}/{path}"
+
+
+def forecast_url(prefecture_id: str) -> str:
+    return jma_url(f"forecast/data/forecast/{prefecture_id}.json")
+
+
+def probability_url(prefecture_id: str) -> str:
+    return jma_url(f"probability/data/probability/{prefecture_id}.json")
+
+
+def warning_url(prefecture_id: str) -> str:
+    return jma_url(f"warning/data/warning/{prefecture_id}.json")
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+def iter_body(url: str, response: requests.Response, deadline: float | None):
+    """
+    本文を少しずつ返す。deadline(time.monotonic() の値)を過ぎたら BudgetExceeded。
+
+    iter_content は STREAM_CHUNK_SIZE がたまるまで戻らないので、期限を見張るときは
+    read1 で届いた分だけを読む
+    """
+    if deadline is None:
+        yield from response.iter_content(STREAM_CHUNK_SIZE)
+        return
+    while chunk := response.raw.read1(STREAM_CHUNK_SIZE, decode_content=True):
+        if time.monotonic() > deadline:
+            raise BudgetExceeded(f"exceeded the budget while reading {url}")
+        yield chunk
+
+
+class JmaResponse:
+    """
+    取得結果。changed は前回処理したときから内容が変わったかどうか。
+
+    304 のときはキャッシュ済みの本文を content に入れておくので、
+    ほかの URL が変わっていて再処理が必要になっても json() で読める。
+
+    stream=True で取得した応答は本文をメモリに載せず path のファイルに置く。
+    iter_chunks() で少しずつ読み、使い終わったら close() で一時ファイルを消す
+    """
+
+    def __init__(
+        self,
+        url: str,
+        content: bytes | None,
+        changed: bool,
+        etag: str | None = None,
+        last_modified: str | None = None,
+        path: Path | None = None,
+        sha256: str | None = None,
+        temporary: bool = False,
+    ):
+        self.url = url
+        self._content = content
+        self.changed = changed
+        self.etag = etag
+        self.last_modified = last_modified
+        self.path = path
+        self.temporary = temporary
+        self.sha256 = sha256 or hashlib.sha256(content).hexdigest()
+        # 本文の展開後のバイト数
+        self.size = len(content) if content is not None else path.stat().st_size
+        # 計測用。取得にかかった秒数と、通信で受け取った本文のバイト数。
+        # gzip で届いたときは展開前の大きさで、304 なら 0
+        self.elapsed = 0.0
+        self.downloaded = 0
+
+    @property
+    def content(self) -> bytes:
+        if self._content is None:
+            return self.path.read_bytes()
+        return self._content
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8")
+
+    def json(self):
+        return jma_json.loads(self.content)
+
+    def iter_chunks(self, chunk_size: int = STREAM_CHUNK_SIZE):
+        """本文を chunk_size バイトずつ返す"""
+        if self._content is not None:
+            for start in range(0, len(self._content), chunk_size):
+                yield self._content[start : start + chunk_size]
+            return
+        with open(self.path, "rb") as f:
+            while chunk := f.read(chunk_size):
+                yield chunk
+
+    def close(self):
+        if self.temporary:
+            self.path.unlink(missing_ok=True)
+            self.temporary = False
+
+
+class CacheEntry:
+    def __init__(self, etag: str | None, last_modified: str | None, sha256: str):
+        self.etag = etag
+        self.last_modified = last_modified
+        self.sha256 = sha256
+
+
+class ResponseCache:
+    """
+    URL ごとに ETag / Last-Modified / 本文のハッシュと本文をディスクに保持する。
+
+    処理が最後まで成功した応答だけを put() すること。途中で落ちた応答を
+    覚えてしまうと、次回「変わっていない」と判断されて取りこぼす
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, url: str, suffix: str) -> Path:
+        key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        return self.directory / f"{key}.{suffix}"
+
+    def get(self, url: str) -> CacheEntry | None:
+        try:
+            meta = json.loads(self._path(url, "meta").read_bytes())
+        except (FileNotFoundError, ValueError):
+            return None
+        return CacheEntry(meta["etag"], meta["last_modified"], meta["sha256"])
+
+    def get_content(self, url: str) -> bytes | None:
+        try:
+            return self._path(url, "body").read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def get_path(self, url: str) -> Path | None:
+        path = self._path(url, "body")
+        return path if path.exists() else None
+
+    def put(self, response: JmaResponse):
+        meta = {
+            "url": response.url,
+            "etag": response.etag,
+            "last_modified": response.last_modified,
+            "sha256": response.sha256,
+        }
+        body_path = self._path(response.url, "body")
+        if response.temporary:
+            # 一時ファイルはキャッシュと同じディレクトリにあるので、そのまま置き換える
+            os.replace(response.path, body_path)
+            response.path, response.temporary = body_path, False
+        else:
+            self._write(body_path, response.content)
+        self._write(self._path(response.url, "meta"), json.dumps(meta).encode())
+
+    @staticmethod
+    def _write(path: Path, content: bytes):
+        tmp_path = path.with_suffix(f"{path.suffix}.{os.getpid()}.tmp")
+        tmp_path.write_bytes(content)
+        os.replace(tmp_path, path)
+
+
+class JmaClient:
+    """
+    気象庁 API のクライアント。
+
+    Session を使い回して keep-alive 接続をプールし、複数の URL を
+    最大 concurrency 本まで並列に取得する。この上限はクライアント全体のもので、
+    いくつものスレッドやジョブが1つのクライアントを共有しても超えない。
+    cache を渡すと条件付き GET を行い、
+    304 か本文のハッシュが前回と同じなら changed=False の応答を返す。
+    archive を渡すと、受け取った本文をすべて保存する
+    """
+
+    def __init__(
+        self,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        timeout: int = DEFAULT_TIMEOUT,
+        cache: ResponseCache | None = None,
+        force: bool = False,
+        archive=None,
+    ):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.cache = cache
+        self.force = force
+        # 本文を受け取るたびに archive.store(応答) を呼ぶ(weather.archive.PayloadArchive)
+        self.archive = archive
+        # 同時に取得中のリクエストを数える。接続プールもこの数で足りる
+        self.slots = threading.BoundedSemaphore(concurrency)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def get(
+        self,
+        url: str,
+        timeout: float | None = None,
+        stream: bool = False,
+        deadline: float | None = None,
+    ) -> JmaResponse:
+        """
+        stream=True なら本文をメモリに載せず、一時ファイルに書き出しながらハッシュを取る。
+
+        timeout は1回の読み込みの待ち時間にしかならないので、少しずつ届き続ける応答は
+        止められない。deadline(time.monotonic() の値)を渡すと、本文を読みながら
+        それを過ぎていないか確かめ、過ぎたら BudgetExceeded にする
+        """
+        with self.slots:
+            started = time.perf_counter()
+            jma_response = self._get(url, timeout, stream, deadline)
+            jma_response.elapsed = time.perf_counter() - started
+        return jma_response
+
+    def _get(
+        self, url: str, timeout: float | None, stream: bool, deadline: float | None
+    ) -> JmaResponse:
+        timeout = timeout or self.timeout
+        # 期限を見張るときは、本文を自分で少しずつ読む
+        read_in_chunks = stream or deadline is not None
+        cached = None
+        if self.cache is not None and not self.force:
+            cached = self.cache.get(url)
+
+        headers = {}
+        if cached is not None:
+            if cached.etag:
+                headers["If-None-Match"] = cached.etag
+            if cached.last_modified:
+                headers["If-Modified-Since"] = cached.last_modified
+
+        response = self.session.get(
+            url, headers=headers, timeout=timeout, stream=read_in_chunks
+        )
+        if response.status_code == 304 and cached is not None:
+            if stream:
+                path = self.cache.get_path(url)
+                if path is not None:
+                    return JmaResponse(
+                        url,
+                        None,
+                        False,
+                        cached.etag,
+                        cached.last_modified,
+                        path=path,
+                        sha256=cached.sha256,
+                    )
+            else:
+                content = self.cache.get_content(url)
+                if content is not None:
+                    return JmaResponse(
+                        url, content, False, cached.etag, cached.last_modified
+                    )
+            # 本文が消えていたら条件なしで取り直す
+            response.close()
+            response = self.session.get(url, timeout=timeout, stream=read_in_chunks)
+        response.raise_for_status()
+
+        if stream:
+            jma_response = self._download(url, response, deadline)
+        else:
+            content = (
+                self._read(url, response, deadline)
+                if deadline is not None
+                else response.content
+            )
+            jma_response = JmaResponse(
+                url,
+                content,
+                True,
+                response.headers.get("ETag"),
+                response.headers.get("Last-Modified"),
+            )
+            jma_response.downloaded = response.raw.tell()
+        if self.archive is not None:
+            self.archive.store(jma_response)
+        if cached is not None and cached.sha256 == jma_response.sha256:
+            # 中身は処理済みのものと同じなので、新しい ETag をすぐ覚えてよい
+            jma_response.changed = False
+            self.cache.put(jma_response)
+        return jma_response
+
+    @staticmethod
+    def _read(url: str, response: requests.Response, deadline: float) -> bytes:
+        with response:
+            return b"".join(iter_body(url, response, deadline))
+
+    def _download(
+        self, url: str, response: requests.Response, deadline: float | None
+    ) -> JmaResponse:
+        directory = self.cache.directory if self.cache is not None else None
+        digest = hashlib.sha256()
+        with response, tempfile.NamedTemporaryFile(
+            dir=directory, suffix=".download", delete=False
+        ) as f:
+            try:
+                for chunk in iter_body(url, response, deadline):
+                    digest.update(chunk)
+                    f.write(chunk)
+            except BaseException:
+                f.close()
+                os.unlink(f.name)
+                raise
+        jma_response = JmaResponse(
+            url,
+            None,
+            True,
+            response.headers.get("ETag"),
+            response.headers.get("Last-Modified"),
+            path=Path(f.name),
+            sha256=digest.hexdigest(),
+            temporary=True,
+        )
+        jma_response.downloaded = response.raw.tell()
+        return jma_response
+
+    def fetch_group(self, urls: list[str], budget: float) -> list[JmaResponse]:
+        """urls を順に取得する。本文を読む途中でも、合計で budget 秒を超えたら BudgetExceeded"""
+        deadline = time.monotonic() + budget
+        responses = []
+        for url in urls:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise BudgetExceeded(f"exceeded the {budget}s budget at {url}")
+            responses.append(
+                self.get(url, timeout=min(self.timeout, remaining), deadline=deadline)
+            )
+        return responses
+
+    def fetch_grouped(
+        self, groups: dict[str, list[str]], budget: float
+    ) -> dict[str, list[JmaResponse] | Exception]:
+        """
+        グループ(都道府県など)ごとに fetch_group を並列に実行する。
+
+        あるグループが失敗しても他は続けられるよう、例外は送出せずに
+        そのグループの結果として返す
+        """
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = {
+                key: executor.submit(self.fetch_group, urls, budget)
+                for key, urls in groups.items()
+            }
+
+        results = {}
+        for key, future in futures.items():
+            try:
+                results[key] = future.result()
+            except Exception as e:
+                results[key] = e
+        return results
+
+    def remember(self, *responses: JmaResponse):
+        """処理が済んだ応答をキャッシュに記録する"""
+        if self.cache is None:
+            return
+        for response in responses:
+            if response.changed:
+                self.cache.put(response)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,132 @@
+import codecs
+import json
+from typing import Any, Iterable, Iterator
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_decoder = json.JSONDecoder()
+
+_DELIMITERS = frozenset(" \t\r\n,:]}")
+
+# 読み終えた部分がこれを超えたらバッファを詰める
+_COMPACT_THRESHOLD = 1 << 16
+
+
+def loads(content: bytes) -> Any:
+    """
+    JMA の応答の本文を bytes のままデコードする。
+
+    orjson が入っていればそれを使い、なければ標準の json を使う。
+    どちらでも失敗したときは ValueError(json.JSONDecodeError)を送出する
+    """
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+class _Reader:
+    """バイト列のチャンクを少しずつ文字列に戻しながら読み進める"""
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self.chunks = iter(chunks)
+        self.text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        if self.eof:
+            return False
+        if self.pos > _COMPACT_THRESHOLD:
+            self.buffer = self.buffer[self.pos :]
+            self.pos = 0
+        try:
+            chunk = next(self.chunks)
+        except StopIteration:
+            self.eof = True
+            self.buffer += self.text_decoder.decode(b"", final=True)
+            return False
+        self.buffer += self.text_decoder.decode(chunk)
+        return True
+
+    def peek(self) -> str:
+        """空白を読み飛ばし、次の1文字を返す。終端なら空文字"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise ValueError(f"expected {char!r} at {self.pos}")
+        self.pos += 1
+
+    def value(self) -> Any:
+        """次の値を1つ丸ごとデコードする。バッファに収まるまで読み足す"""
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.fill():
+                    continue
+                raise
+            # 数値はチャンクの境目で切れていても("12" + "3", "1." + "5")読めてしまう。
+            # 区切り文字が来るまで読み足してから確定する
+            if (
+                end == len(self.buffer) or self.buffer[end] not in _DELIMITERS
+            ) and self.fill():
+                continue
+            self.pos = end
+            return value
+
+
+def _walk(reader: _Reader, path: tuple, depth: int) -> Iterator[tuple[tuple, Any]]:
+    if depth == 0:
+        yield path, reader.value()
+        return
+
+    opening = reader.peek()
+    if opening not in "{[" or opening == "":
+        reader.value()  # 目的の深さに届かない値は読み捨てる
+        return
+
+    closing = "}" if opening == "{" else "]"
+    reader.pos += 1
+    if reader.peek() == closing:
+        reader.pos += 1
+        return
+
+    index = 0
+    while True:
+        if opening == "{":
+            key = reader.value()
+            reader.expect(":")
+        else:
+            key = index
+            index += 1
+        yield from _walk(reader, path + (key,), depth - 1)
+
+        separator = reader.peek()
+        reader.pos += 1
+        if separator == closing:
+            return
+        if separator != ",":
+            raise ValueError(f"expected ',' or {closing!r} at {reader.pos - 1}")
+
+
+def iter_items(chunks: Iterable[bytes], depth: int) -> Iterator[tuple[tuple, Any]]:
+    """
+    JSON を先頭から少しずつデコードし、depth 段目の値を (キーのパス, 値) で順に返す。
+
+    {"centers": {"010100": {...}}, ...} を depth=2 で読むと
+    (("centers", "010100"), {...}) が1件ずつ得られる。メモリに載るのは
+    読みかけのチャンクと値1つ分だけ
+    """
+    return _walk(_Reader(chunks), (), depth)
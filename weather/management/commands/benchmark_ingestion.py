@@ -0,0 +1,196 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from weather.benchmark import (
+    decode_payloads,
+    fixture_prefecture_ids,
+    measure_decode,
+    measure_command,
+    record_fixtures,
+    serve_fixtures,
+)
+from weather.jma_client import JmaClient
+
+DEFAULT_FIXTURES_DIR = settings.BASE_DIR / "benchmarks" / "fixtures"
+DEFAULT_SIZES = ["3", "10", "all"]
+
+
+class Command(BaseCommand):
+    help = "benchmark the ingestion commands against recorded JMA payloads"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--fixtures",
+            type=Path,
+            default=DEFAULT_FIXTURES_DIR,
+            help="directory holding the recorded payloads (same layout as JMA)",
+        )
+        parser.add_argument(
+            "--record",
+            action="store_true",
+            help="download the current JMA payloads into --fixtures and exit",
+        )
+        parser.add_argument(
+            "--sizes",
+            nargs="+",
+            default=DEFAULT_SIZES,
+            help="numbers of prefectures to ingest per run, or 'all'",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=1,
+            help="number of runs per size",
+        )
+        parser.add_argument(
+            "--output",
+            type=Path,
+            help="append the results as JSON lines to this file instead of stdout",
+        )
+        parser.add_argument(
+            "--decode",
+            action="store_true",
+            help="only compare JSON parsers on the recorded payloads",
+        )
+        parser.add_argument(
+            "--iterations",
+            type=int,
+            default=20,
+            help="decode runs per payload with --decode (the fastest is reported)",
+        )
+        # 子プロセスで1コマンドだけ計測するときに使う
+        parser.add_argument(
+            "--measure", nargs=argparse.REMAINDER, help=argparse.SUPPRESS
+        )
+
+    def handle(self, *args, **options):
+        if options["measure"]:
+            command, *command_args = options["measure"]
+            self.stdout.write(json.dumps(measure_command(command, command_args)))
+            return
+
+        fixtures = options["fixtures"]
+        if options["record"]:
+            with JmaClient() as client:
+                count, missing = record_fixtures(fixtures, client)
+            for url in missing:
+                self.stderr.write(f"not recorded: {url}")
+            self.stdout.write(
+                self.style.SUCCESS(f"{count} payloads were recorded in {fixtures}")
+            )
+            return
+
+        if not (fixtures / "common/const/area.json").exists():
+            raise CommandError(
+                f"no fixtures in {fixtures}. record them first with --record"
+            )
+        if options["decode"]:
+            self.benchmark_decode(fixtures, options["iterations"])
+            return
+
+        prefecture_ids = fixture_prefecture_ids(fixtures)
+        sizes = [
+            self.parse_size(size, len(prefecture_ids)) for size in options["sizes"]
+        ]
+        if options["repeat"] < 1:
+            raise CommandError("--repeat must be 1 or more")
+
+        output = open(options["output"], "a") if options["output"] else self.stdout
+        try:
+            with serve_fixtures(fixtures) as base_url:
+                for size in sizes:
+                    for repeat in range(options["repeat"]):
+                        for result in self.run_pipeline(base_url, prefecture_ids, size):
+                            result.update(
+                                size=size or "all",
+                                prefectures=size or len(prefecture_ids),
+                                repeat=repeat,
+                            )
+                            output.write(json.dumps(result) + "\n")
+                            self.stderr.write(
+                                f"{result['command']} x{result['prefectures']}: "
+                                f"{result['wall_time']:.3f}s, "
+                                f"{result['queries']} queries, "
+                                f"{result['rows_per_sec']} rows/sec"
+                            )
+        finally:
+            if options["output"]:
+                output.close()
+
+    def benchmark_decode(self, fixtures: Path, iterations: int):
+        if iterations < 1:
+            raise CommandError("--iterations must be 1 or more")
+        for name, contents in decode_payloads(fixtures).items():
+            results = measure_decode(name, contents, iterations)
+            for result in results:
+                self.stdout.write(json.dumps(result))
+            baseline = results[0]["seconds"]
+            self.stderr.write(
+                f"{name} ({results[0]['bytes']} bytes): "
+                + ", ".join(
+                    f"{result['parser']} {result['seconds'] * 1000:.2f}ms"
+                    f" (x{baseline / result['seconds']:.1f})"
+                    for result in results
+                )
+            )
+
+    @staticmethod
+    def parse_size(size: str, n_prefectures: int) -> int:
+        """'all' は 0 で表す"""
+        if size == "all":
+            return 0
+        if not size.isdigit() or not 0 < int(size) <= n_prefectures:
+            raise CommandError(f"--sizes must be 1..{n_prefectures} or 'all': {size}")
+        return int(size)
+
+    def run_pipeline(self, base_url: str, prefecture_ids: list[str], size: int):
+        """
+        空の DB にマスタ -> 予報 -> 警報 の順で取り込み、コマンドごとの計測結果を返す。
+
+        実行ごとに DB と応答キャッシュを作り直し、コマンドは別プロセスで動かすので、
+        前の実行の接続やキャッシュ、メモリの使用量は結果に混ざらない
+        """
+        selection = ["--prefectures", *prefecture_ids[:size]] if size else ["--all"]
+        with tempfile.TemporaryDirectory() as workdir:
+            env = {
+                **os.environ,
+                "DATABASE_NAME": str(Path(workdir) / "db.sqlite3"),
+                "JMA_BASE_URL": base_url,
+                "JMA_CACHE_DIR": str(Path(workdir) / "jma_cache"),
+                "WEATHER_ARCHIVE_DIR": str(Path(workdir) / "archive"),
+                # 取り込みを常駐させる構成と同じ WAL で測る
+                "WEATHER_SQLITE_WAL": "1",
+            }
+            self.run_child(env, ["migrate", "--verbosity", "0"])
+
+            started_at = datetime.now().isoformat(timespec="seconds")
+            for command, command_args in [
+                ("update_jma_master", ["--force"]),
+                ("fetch_weather_forecast", [*selection, "--force"]),
+                ("fetch_weather_warning", [*selection, "--force"]),
+            ]:
+                output = self.run_child(
+                    env, ["benchmark_ingestion", "--measure", command, *command_args]
+                )
+                yield {"started_at": started_at, **json.loads(output.splitlines()[-1])}
+
+    @staticmethod
+    def run_child(env: dict, args: list[str]) -> str:
+        completed = subprocess.run(
+            [sys.executable, str(settings.BASE_DIR / "manage.py"), *args],
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+        if completed.returncode != 0:
+            raise CommandError(f"{' '.join(args)} failed:\n{completed.stderr.strip()}")
+        return completed.stdout
@@ -0,0 +1,192 @@
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from weather.area_index import AMEDAS, AreaIndex, get_area_index
+from weather.bulk import get_bulk_loader
+from weather.ingest import DEFAULT_BUDGET, SHARED_CLIENT_OPTIONS, ingest_client
+from weather.jma_client import DEFAULT_CONCURRENCY, jma_url
+from weather.metrics import (
+    ALL_PREFECTURES,
+    IngestMetrics,
+    add_metrics_arguments,
+    instrument,
+)
+from weather.models import AmedasObservation, AmedasSnapshot
+from weather.timezone import JST
+
+# 観測値が発表される間隔
+OBSERVATION_INTERVAL = timedelta(minutes=10)
+# 欠けている時刻をさかのぼって埋める範囲(時間)
+DEFAULT_BACKFILL_HOURS = 3
+# 一度に取得して手元に置く時刻の数(並列数の倍数)
+FETCH_WINDOW_FACTOR = 4
+
+# amedas/data/map/*.json の要素名 -> AmedasObservation の列
+OBSERVATION_FIELDS = {
+    "temp": "temperature",
+    "wind": "wind_speed",
+    "windDirection": "wind_direction",
+    "precipitation10m": "precipitation_10m",
+}
+# 値は [値, 品質情報] で来る。品質情報が 0 の正常値だけを採る
+QUALITY_NORMAL = 0
+
+
+def latest_time_url() -> str:
+    return jma_url("amedas/data/latest_time.txt")
+
+
+def map_url(observed_at: datetime) -> str:
+    """全観測所のある時刻の観測値。ファイル名は JST の時刻"""
+    return jma_url(f"amedas/data/map/{observed_at.astimezone(JST):%Y%m%d%H%M%S}.json")
+
+
+class Command(BaseCommand):
+    help = "get AMeDAS observations and backfill the missing 10-minute intervals"
+    stealth_options = SHARED_CLIENT_OPTIONS
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--backfill",
+            type=float,
+            default=DEFAULT_BACKFILL_HOURS,
+            help="hours to look back for intervals that have not been ingested",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=DEFAULT_CONCURRENCY,
+            help="max number of parallel requests to JMA",
+        )
+        parser.add_argument(
+            "--budget",
+            type=float,
+            default=DEFAULT_BUDGET,
+            help="seconds allowed for fetching one interval",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="fetch the ingested intervals again and overwrite their values",
+        )
+        add_metrics_arguments(parser)
+
+    def handle(self, *args, **options):
+        if options["backfill"] < 0:
+            raise CommandError("--backfill must not be negative")
+        if options["concurrency"] < 1:
+            raise CommandError("--concurrency must be 1 or more")
+        if options["budget"] <= 0:
+            raise CommandError("--budget must be positive")
+        with instrument("fetch_amedas_observations", options) as metrics:
+            self.ingest(metrics, options)
+
+    def ingest(self, metrics: IngestMetrics, options: dict):
+        # マスタに無い観測所の行は外部キーを満たせないので捨てる
+        area_index = get_area_index()
+        loader = get_bulk_loader()
+
+        # --force で取り込み直すときは、訂正された値で上書きする
+        update_fields = list(OBSERVATION_FIELDS.values()) if options["force"] else []
+        ingested, failures, rows_written = [], {}, 0
+        with ingest_client(options) as client:
+            with metrics.stage("fetch"):
+                latest_response = client.get(latest_time_url())
+            metrics.add_responses(ALL_PREFECTURES, [latest_response])
+            latest = datetime.fromisoformat(latest_response.text.strip())
+            slots = self.missing_slots(latest, options)
+
+            # 取得は並列に、書き込みは時刻ごとの短いトランザクションで順に行う
+            window = options["concurrency"] * FETCH_WINDOW_FACTOR
+            for start in range(0, len(slots), window):
+                with metrics.stage("fetch"):
+                    fetched = client.fetch_grouped(
+                        {
+                            observed_at: [map_url(observed_at)]
+                            for observed_at in slots[start : start + window]
+                        },
+                        budget=options["budget"],
+                    )
+                for observed_at, responses in fetched.items():
+                    label = observed_at.astimezone(JST).isoformat()
+                    if isinstance(responses, Exception):
+                        failures[label] = f"{type(responses).__name__}: {responses}"
+                        continue
+                    metrics.add_responses(ALL_PREFECTURES, responses)
+                    try:
+                        with metrics.stage("decode"):
+                            observations = responses[0].json()
+                        with metrics.stage("aggregate"):
+                            rows = self.build_observation_rows(
+                                observed_at, observations, area_index
+                            )
+                    except ValueError as e:
+                        failures[label] = f"{type(e).__name__}: {e}"
+                        continue
+                    # 観測値と取り込み済みの印は一緒にコミットする
+                    with metrics.stage("write"), transaction.atomic():
+                        loader.upsert(
+                            AmedasObservation,
+                            rows,
+                            unique_fields=["jma_amedas", "observed_at"],
+                            update_fields=update_fields,
+                        )
+                        AmedasSnapshot.objects.update_or_create(
+                            observed_at=observed_at, defaults={"stations": len(rows)}
+                        )
+                    ingested.append(label)
+                    rows_written += len(rows)
+
+        self.stdout.write(
+            f"intervals: {len(slots)}, ingested: {len(ingested)}, "
+            f"failed: {len(failures)}, rows written: {rows_written}"
+        )
+        for label, reason in failures.items():
+            self.stdout.write(f"  {label}: {reason}")
+        self.stdout.write(str(metrics))
+        self.stdout.write(
+            self.style.SUCCESS("AMeDAS observation retrieve has been completed.")
+        )
+
+    @staticmethod
+    def missing_slots(latest: datetime, options: dict) -> list[datetime]:
+        """latest から --backfill 時間さかのぼった範囲の、まだ取り込んでいない時刻"""
+        earliest = latest - timedelta(hours=options["backfill"])
+        slots = []
+        observed_at = latest
+        while observed_at >= earliest:
+            slots.append(observed_at)
+            observed_at -= OBSERVATION_INTERVAL
+        if not options["force"]:
+            ingested = set(
+                AmedasSnapshot.objects.filter(observed_at__gte=earliest).values_list(
+                    "observed_at", flat=True
+                )
+            )
+            slots = [
+                observed_at for observed_at in slots if observed_at not in ingested
+            ]
+        return sorted(slots)
+
+    @staticmethod
+    def build_observation_rows(
+        observed_at: datetime, observations: dict, area_index: AreaIndex
+    ) -> list[AmedasObservation]:
+        rows = []
+        for amedas_code, elements in observations.items():
+            if not area_index.resolve(amedas_code, AMEDAS):
+                continue
+            values = {
+                field: pair[0]
+                for key, field in OBSERVATION_FIELDS.items()
+                if (pair := elements.get(key)) and pair[1] == QUALITY_NORMAL
+            }
+            if values:
+                rows.append(
+                    AmedasObservation(
+                        jma_amedas_id=amedas_code, observed_at=observed_at, **values
+                    )
+                )
+        return rows
@@ -1,15 +1,41 @@
 from datetime import date, timedelta, datetime
 
-import requests
-from django.core.management.base import BaseCommand
-
-from weather.models import JmaAmedas, JmaWeather
+from weather.aggregation import (
+    StationAggregation,
+    TemperatureAggregation,
+    WindSpeedAggregation,
+    to_dates,
+)
+from weather.bulk import get_bulk_loader
+from weather.ingest import PrefectureIngestCommand
+from weather.jma_client import forecast_url, probability_url
+from weather.models import JmaAmedas, JmaDataVersion, JmaForecast, JmaWeather
+from weather.sync import sync_rows
 
 FORECASTS_3DAYS = 0
 FORECASTS_OVERVIEW = 0
 FORECASTS_TEMPERATURE = 2
-PROBABILITY_MAX_WIND_SPEED = 3
-PROBABILITY_LAND = 0
+FORECASTS_WEEKLY = 1
+WEEKLY_OVERVIEW = 0
+WEEKLY_TEMPERATURE = 1
+
+# JmaForecast の行を発表ごとに上書きする列
+FORECAST_UPDATE_FIELDS = [
+    "reported_at",
+    "weather_code",
+    "temperature_min",
+    "temperature_max",
+    "wind_speed",
+]
+
+
+def get_amedas_regions() -> dict[str, str]:
+    """アメダス観測所コード -> リージョンコード の索引"""
+    return dict(
+        JmaAmedas.objects.filter(jma_area3__isnull=False).values_list(
+            "id", "jma_area3_id"
+        )
+    )
 
 
 class RegionWeather:
@@ -22,91 +48,27 @@ class RegionWeather:
         return f"Region {self.region_name}({self.region_code}), Weather: {self.weather_code}"
 
 
-class AmedasTemperature:
-    def __init__(
-        self, amedas_code: str, amedas_name: str, min_temps: int, max_temps: int
-    ):
-        self.amedas_code = amedas_code
-        self.amedas_name = amedas_name
-        self.min_temps = min_temps
-        self.max_temps = max_temps
-
-    def __str__(self):
-        return f"  {self.amedas_name}({self.amedas_code} の朝の最低気温: {self.min_temps}, 日中の最高気温: {self.max_temps})"
-
-
 class RegionTemperature:
     def __init__(
-        self, region_code: str, region_name: str, data: dict, target_date: date
+        self,
+        region_code: str,
+        region_name: str,
+        avg_min_temps: float,
+        avg_max_temps: float,
     ):
         self.region_code = region_code
         self.region_name = region_name
-        self.data = data
-        amedas_ids = [
-            amedas.id for amedas in JmaAmedas.objects.filter(jma_area3_id=region_code)
-        ]
-        min_temps_idx, max_temps_idx = self.get_indexes_from_time_defines(
-            data["timeDefines"], target_date
-        )
-        min_temps_list, max_temps_list = self.get_temps_list(
-            data["areas"], amedas_ids, min_temps_idx, max_temps_idx
-        )
-        self.avg_min_temps = round(sum(min_temps_list) / len(min_temps_list), 1)
-        self.avg_max_temps = round(sum(max_temps_list) / len(max_temps_list), 1)
-
-    @staticmethod
-    def get_indexes_from_time_defines(time_defines: list[str], target_date: date):
-        time_defines = [
-            datetime.fromisoformat(date_str).date() for date_str in time_defines
-        ]
-
-        return [
-            i
-            for i, time_define in enumerate(time_defines)
-            if time_define == target_date
-        ]
-
-    @staticmethod
-    def get_temps_list(
-        amedas_data,
-        target_amedas_ids: list[str],
-        min_temps_idx: int,
-        max_temps_idx: int,
-    ):
-        min_temps_list, max_temps_list = [], []
-        for amedas in amedas_data:
-            amedas_temperature = AmedasTemperature(
-                amedas["area"]["code"],
-                amedas["area"]["name"],
-                int(amedas["temps"][min_temps_idx]),
-                int(amedas["temps"][max_temps_idx]),
-            )
-            if amedas_temperature.amedas_code not in target_amedas_ids:
-                continue
-            min_temps_list.append(amedas_temperature.min_temps)
-            max_temps_list.append(amedas_temperature.max_temps)
-
-        return min_temps_list, max_temps_list
+        self.avg_min_temps = avg_min_temps
+        self.avg_max_temps = avg_max_temps
 
     def __str__(self):
         return f"Avg Min: {self.avg_min_temps}℃, Avg Max: {self.avg_max_temps}℃"
 
 
 class RegionWindSpeed:
-    def __init__(self, region_code: str, data: dict, target_indexes: list[int]):
+    def __init__(self, region_code: str, avg_wind_speed: float):
         self.region_code = region_code
-        self.data = data
-        self.avg_wind_speed = self.calc_wind_speed(data, target_indexes)
-
-    @staticmethod
-    def calc_wind_speed(wind_data, target_indexes):
-        wind_values = [
-            int(time_cell["locals"][PROBABILITY_LAND]["value"])
-            for i, time_cell in enumerate(wind_data)
-            if i in target_indexes
-        ]
-
-        return round(sum(wind_values) / len(wind_values), 1)
+        self.avg_wind_speed = avg_wind_speed
 
     def __str__(self):
         return f"{self.region_code} の最大風速（日中平均）は {self.avg_wind_speed}"
@@ -138,100 +100,228 @@ class RegionForecastResults:
         return f"{region_code}({region_name}): {forecast}"
 
 
-class Command(BaseCommand):
-    help = "get weather forecast"
+class PrefectureForecast:
+    """
+    1都道府県分の予報と確率の JSON を、リージョン × 日付 の予報にまとめる。
 
-    def handle(self, *args, **options):
-        today = datetime.now().date()
-        tomorrow = today + timedelta(days=1)
-
-        # TODO: facilityテーブルから areas2_ids を取得
-        jma_areas2_ids = ["280000", "050000", "130000"]
-
-        if not jma_areas2_ids:
-            raise Exception("facility is empty")
-
-        JmaWeather.objects.all().delete()
-        for prefecture_id in jma_areas2_ids:
-            forecasts_by_region = {}
-
-            forecasts = requests.get(
-                f"https://www.jma.go.jp/bosai/forecast/data/forecast/{prefecture_id}.json"
-            ).json()
-            overview = forecasts[FORECASTS_3DAYS]["timeSeries"][FORECASTS_OVERVIEW]
-            time_defines = [
-                datetime.fromisoformat(date_str).date()
-                for date_str in overview["timeDefines"]
-            ]
-            try:
-                tomorrow_idx = time_defines.index(tomorrow)
-                for a_region in overview["areas"]:
-                    region_code = a_region["area"]["code"]
-                    region_weather = RegionWeather(
-                        region_code,
-                        a_region["area"]["name"],
-                        a_region["weatherCodes"][tomorrow_idx],
-                    )
-                    forecasts_by_region.setdefault(region_code, {})[
-                        "weather"
-                    ] = region_weather
-                    region_temperature = RegionTemperature(
-                        region_code,
-                        a_region["area"]["name"],
-                        forecasts[FORECASTS_3DAYS]["timeSeries"][FORECASTS_TEMPERATURE],
-                        tomorrow,
-                    )
-                    forecasts_by_region.setdefault(region_code, {})[
-                        "temperature"
-                    ] = region_temperature
-
-            except ValueError:
-                print(f"{prefecture_id}: no forecast")
-
-            probabilities = requests.get(
-                f"https://www.jma.go.jp/bosai/probability/data/probability/{prefecture_id}.json"
-            ).json()
-            tomorrow_indexes = [
-                i
-                for i, date_str in enumerate(
-                    probabilities[0]["timeSeries"][1]["timeDefines"]
+    各系列の timeDefines は1回だけ解析する。3日間予報にある日付はそちらを使い、
+    週間予報はそれ以降の日付と、3日間予報に無い値を埋める
+    """
+
+    def __init__(
+        self, forecasts: list, probabilities: list, amedas_regions: dict[str, str]
+    ):
+        three_days = forecasts[FORECASTS_3DAYS]
+        overview = three_days["timeSeries"][FORECASTS_OVERVIEW]
+        self.reported_at = datetime.fromisoformat(three_days["reportDatetime"])
+        self.region_names = {
+            a_region["area"]["code"]: a_region["area"]["name"]
+            for a_region in overview["areas"]
+        }
+
+        self.weather_codes: dict[date, dict[str, str]] = {}
+        for a_region in overview["areas"]:
+            self.add_weather_codes(
+                [a_region["area"]["code"]],
+                to_dates(overview["timeDefines"]),
+                a_region["weatherCodes"],
+            )
+        self.temperatures = TemperatureAggregation(
+            three_days["timeSeries"][FORECASTS_TEMPERATURE], amedas_regions
+        ).daily_averages()
+        self.wind_speeds = WindSpeedAggregation(
+            probabilities[0]["timeSeries"][1]
+        ).daily_averages()
+
+        if len(forecasts) > FORECASTS_WEEKLY:
+            self.add_weekly(forecasts[FORECASTS_WEEKLY], amedas_regions)
+
+    def add_weather_codes(
+        self, region_codes: list[str], dates: list[date], weather_codes: list[str]
+    ):
+        for target_date, weather_code in zip(dates, weather_codes):
+            if not weather_code:
+                continue
+            by_region = self.weather_codes.setdefault(target_date, {})
+            for region_code in region_codes:
+                by_region.setdefault(region_code, weather_code)
+
+    def add_weekly(self, weekly: dict, amedas_regions: dict[str, str]):
+        overview = weekly["timeSeries"][WEEKLY_OVERVIEW]
+        dates = to_dates(overview["timeDefines"])
+        for a_area in overview["areas"]:
+            # 週間予報の地域コードがリージョンと同じならそのリージョンに、
+            # 県全体で1地域しかなければ全リージョンに割り当てる
+            area_code = a_area["area"]["code"]
+            if area_code in self.region_names:
+                region_codes = [area_code]
+            elif len(overview["areas"]) == 1:
+                region_codes = list(self.region_names)
+            else:
+                continue
+            self.add_weather_codes(region_codes, dates, a_area["weatherCodes"])
+
+        temperature = weekly["timeSeries"][WEEKLY_TEMPERATURE]
+        temps_min = StationAggregation(temperature, amedas_regions, "tempsMin")
+        temps_max = StationAggregation(temperature, amedas_regions, "tempsMax")
+        for idx, target_date in enumerate(to_dates(temperature["timeDefines"])):
+            by_region = self.temperatures.setdefault(target_date, {})
+            means_min = temps_min.region_means(idx)
+            means_max = temps_max.region_means(idx)
+            for region_code in means_min.keys() | means_max.keys():
+                if region_code not in self.region_names:
+                    continue
+                current_min, current_max = by_region.get(region_code, (None, None))
+                by_region[region_code] = (
+                    means_min.get(region_code) if current_min is None else current_min,
+                    means_max.get(region_code) if current_max is None else current_max,
+                )
+
+    @property
+    def dates(self) -> list[date]:
+        return sorted(
+            self.weather_codes.keys()
+            | self.temperatures.keys()
+            | self.wind_speeds.keys()
+        )
+
+    def results(self, target_date: date) -> list[RegionForecastResults]:
+        """target_date の予報のうち、天気・気温・風速がそろったリージョンの分"""
+        if target_date not in self.weather_codes:
+            raise ValueError("no forecast")
+
+        weather_codes = self.weather_codes[target_date]
+        temperatures = self.temperatures.get(target_date, {})
+        wind_speeds = self.wind_speeds.get(target_date, {})
+        results = []
+        for region_code, region_name in self.region_names.items():
+            temps = temperatures.get(region_code, (None, None))
+            if (
+                region_code not in weather_codes
+                or None in temps
+                or region_code not in wind_speeds
+            ):
+                continue
+            results.append(
+                RegionForecastResults(
+                    RegionWeather(region_code, region_name, weather_codes[region_code]),
+                    RegionTemperature(region_code, region_name, *temps),
+                    RegionWindSpeed(region_code, wind_speeds[region_code]),
                 )
-                if datetime.fromisoformat(date_str).date() == tomorrow
-            ]
-            for a_region in probabilities[0]["timeSeries"][1]["areas"]:
-                region_code = a_region["code"]
-                region_wind_speed = RegionWindSpeed(
-                    region_code,
-                    a_region["properties"][PROBABILITY_MAX_WIND_SPEED]["timeCells"],
-                    tomorrow_indexes,
+            )
+        return results
+
+    def history_rows(self) -> list[JmaForecast]:
+        rows = []
+        for target_date in self.dates:
+            weather_codes = self.weather_codes.get(target_date, {})
+            temperatures = self.temperatures.get(target_date, {})
+            wind_speeds = self.wind_speeds.get(target_date, {})
+            for region_code in self.region_names:
+                temperature_min, temperature_max = temperatures.get(
+                    region_code, (None, None)
                 )
-                forecasts_by_region.setdefault(region_code, {})[
-                    "wind_speed"
-                ] = region_wind_speed
-
-            region_forecast_results_list: list[RegionForecastResults] = []
-            for region_code, forecast in forecasts_by_region.items():
-                region_forecast_results = RegionForecastResults(
-                    forecast["weather"],
-                    forecast["temperature"],
-                    forecast["wind_speed"],
+                row = JmaForecast(
+                    jma_areas3_id=region_code,
+                    target_date=target_date,
+                    reported_at=self.reported_at,
+                    weather_code=weather_codes.get(region_code),
+                    temperature_min=temperature_min,
+                    temperature_max=temperature_max,
+                    wind_speed=wind_speeds.get(region_code),
                 )
-                print(region_forecast_results)
-                region_forecast_results_list.append(region_forecast_results)
-
-            JmaWeather.objects.bulk_create(
-                [
-                    JmaWeather(
-                        jma_areas3_id=item.region_weather.region_code,
-                        weather_code=item.region_weather.weather_code,
-                        temperature_min=item.region_temperature.avg_min_temps,
-                        temperature_max=item.region_temperature.avg_max_temps,
-                        wind_speed=item.region_wind_speed.avg_wind_speed,
+                if any(
+                    value is not None
+                    for value in (
+                        row.weather_code,
+                        row.temperature_min,
+                        row.temperature_max,
+                        row.wind_speed,
                     )
-                    for item in region_forecast_results_list
-                ]
-            )
+                ):
+                    rows.append(row)
+        return rows
+
+
+class Command(PrefectureIngestCommand):
+    help = "get weather forecast"
+    name = "fetch_weather_forecast"
+    completed_message = "weather forecast data retrieve has been completed."
+
+    def urls(self, prefecture_id: str) -> list[str]:
+        return [forecast_url(prefecture_id), probability_url(prefecture_id)]
 
-        self.stdout.write(
-            self.style.SUCCESS("weather forecast data retrieve has been completed.")
+    def prepare(self):
+        self.tomorrow = datetime.now().date() + timedelta(days=1)
+        self.amedas_regions = get_amedas_regions()
+
+    def parse(
+        self, prefecture_id: str, forecasts: list, probabilities: list
+    ) -> tuple[list[JmaWeather], list[JmaForecast]]:
+        prefecture_forecast = PrefectureForecast(
+            forecasts, probabilities, self.amedas_regions
+        )
+        results = prefecture_forecast.results(self.tomorrow)
+        for region_forecast_results in results:
+            self.stdout.write(str(region_forecast_results))
+        return self.build_weather_rows(results), prefecture_forecast.history_rows()
+
+    def write(self, parsed: dict) -> int:
+        weather_rows = [row for rows, _ in parsed.values() for row in rows]
+        forecast_rows = self.changed_forecast_rows(
+            [row for _, rows in parsed.values() for row in rows]
         )
+        sync_result = sync_rows(
+            JmaWeather.objects.filter(jma_areas3__jma_area2_id__in=parsed),
+            weather_rows,
+            ["weather_code", "temperature_min", "temperature_max", "wind_speed"],
+        )
+        # 全日付分の履歴は1回の一括 upsert で書く
+        get_bulk_loader().upsert(
+            JmaForecast,
+            forecast_rows,
+            unique_fields=["jma_areas3", "target_date"],
+            update_fields=FORECAST_UPDATE_FIELDS,
+        )
+        # --force で同じ発表を読み直しただけなら、版を上げて API のキャッシュを捨てない
+        if sync_result.written or forecast_rows:
+            JmaDataVersion.bump(JmaDataVersion.FORECAST)
+        self.stdout.write(str(sync_result))
+        self.stdout.write(f"forecast history rows written: {len(forecast_rows)}")
+        return sync_result.written + len(forecast_rows)
+
+    @staticmethod
+    def changed_forecast_rows(forecast_rows: list[JmaForecast]) -> list[JmaForecast]:
+        """DB に同じ値で入っている行を除く"""
+        if not forecast_rows:
+            return []
+        dates = [row.target_date for row in forecast_rows]
+        stored = {
+            (region_code, target_date): values
+            for region_code, target_date, *values in JmaForecast.objects.filter(
+                jma_areas3_id__in={row.jma_areas3_id for row in forecast_rows},
+                target_date__gte=min(dates),
+                target_date__lte=max(dates),
+            ).values_list("jma_areas3_id", "target_date", *FORECAST_UPDATE_FIELDS)
+        }
+        return [
+            row
+            for row in forecast_rows
+            if stored.get((row.jma_areas3_id, row.target_date))
+            != [getattr(row, field) for field in FORECAST_UPDATE_FIELDS]
+        ]
+
+    @staticmethod
+    def build_weather_rows(
+        region_forecast_results_list: list[RegionForecastResults],
+    ) -> list[JmaWeather]:
+        return [
+            JmaWeather(
+                jma_areas3_id=item.region_weather.region_code,
+                weather_code=item.region_weather.weather_code,
+                temperature_min=item.region_temperature.avg_min_temps,
+                temperature_max=item.region_temperature.avg_max_temps,
+                wind_speed=item.region_wind_speed.avg_wind_speed,
+            )
+            for item in region_forecast_results_list
+        ]
@@ -1,43 +1,23 @@
-import requests
-from django.core.management.base import BaseCommand
+from django.db import transaction
 
-from weather.models import JmaWarning
+from weather.area_index import CITY, REGION, get_area_index
+from weather.events import diff_warnings, get_dispatcher
+from weather.ingest import PrefectureIngestCommand
+from weather.jma_client import warning_url
+from weather.models import JmaCityWarning, JmaDataVersion, JmaWarning
+from weather.sync import sync_rows
+from weather.warning_codes import MASK_FIELDS, parse_warnings, warning_names
 
 WARNING_REGION_BASED = 0
-
-M_TARGET_WARNINGS = {
-    "03": "大雨警報",
-    "24": "霜注意報",
-    "10": "大雨注意報",
-    "21": "乾燥注意報",
-    "14": "雷注意報",
-    "18": "洪水注意報",
-    "20": "濃霧注意報",
-    "15": "強風注意報",
-    "16": "波浪注意報",
-}
+WARNING_CITY_BASED = 1
 
 
 class RegionWarning:
     def __init__(self, region_code: str, data: dict):
         self.region_code = region_code
         self.data = data
-        warning_target_codes = M_TARGET_WARNINGS.keys()
-        self.warnings = [
-            M_TARGET_WARNINGS[code]
-            for code in self.get_warnings(data["warnings"], warning_target_codes)
-        ]
-
-    @staticmethod
-    def get_warnings(warning_data, warning_target_codes):
-        warnings = []
-        try:
-            for x in warning_data:
-                if x["code"] in warning_target_codes:
-                    warnings.append(x["code"])
-        except KeyError:
-            warnings = []
-        return list(set(warnings))
+        self.masks = parse_warnings(data.get("warnings", []))
+        self.warnings = warning_names(self.masks.active)
 
     def __str__(self):
         return f"{self.region_code} の保持する警報は {self.warnings}"
@@ -53,47 +33,115 @@ class RegionWarningResults:
         return f"{region_code}: {warnings}"
 
 
-class Command(BaseCommand):
+class Command(PrefectureIngestCommand):
     help = "get weather warning"
+    name = "fetch_weather_warning"
+    completed_message = "weather warning data retrieve has been completed."
+
+    def urls(self, prefecture_id: str) -> list[str]:
+        return [warning_url(prefecture_id)]
+
+    def prepare(self):
+        # マスタに無い地域の行は外部キーを満たせないので捨てる
+        self.area_index = get_area_index()
+
+    def parse(
+        self, prefecture_id: str, warnings: dict
+    ) -> tuple[list[JmaWarning], list[JmaCityWarning], dict[str, str]]:
+        region_rows = self.build_warning_rows(warnings)
+        for row in region_rows:
+            self.stdout.write(f"{row.jma_areas3_id}: {warning_names(row.active_mask)}")
+        # 地域コード -> 発表時刻。イベントに載せる
+        reported_at = {
+            area_code: warnings.get("reportDatetime")
+            for area_code in self.area_codes(warnings)
+        }
+        return (
+            [
+                row
+                for row in region_rows
+                if self.area_index.resolve(row.jma_areas3_id, REGION)
+            ],
+            [
+                row
+                for row in self.build_city_warning_rows(warnings)
+                if self.area_index.resolve(row.jma_areas4_id, CITY)
+            ],
+            reported_at,
+        )
+
+    def write(self, parsed: dict) -> int:
+        warning_rows, city_warning_rows, reported_at = [], [], {}
+        for regions, cities, reported in parsed.values():
+            warning_rows.extend(regions)
+            city_warning_rows.extend(cities)
+            reported_at.update(reported)
+
+        regions = JmaWarning.objects.filter(jma_areas3__jma_area2_id__in=parsed)
+        cities = JmaCityWarning.objects.filter(jma_areas4__jma_area2_id__in=parsed)
+        # 書き換える前の状態と比べて、発表・解除のイベントを作る
+        events = diff_warnings(
+            REGION,
+            dict(regions.values_list("pk", "active_mask")),
+            {row.pk: row.active_mask for row in warning_rows},
+            reported_at,
+        ) + diff_warnings(
+            CITY,
+            dict(cities.values_list("pk", "active_mask")),
+            {row.pk: row.active_mask for row in city_warning_rows},
+            reported_at,
+        )
+        sync_result = sync_rows(regions, warning_rows, ["warnings", *MASK_FIELDS])
+        sync_result += sync_rows(cities, city_warning_rows, MASK_FIELDS)
+        if sync_result.written:
+            JmaDataVersion.bump(JmaDataVersion.WARNING)
+        # 配送は別スレッドに任せ、コミットされた変更だけを知らせる
+        if events:
+            transaction.on_commit(lambda: get_dispatcher().emit(events))
+        self.stdout.write(str(sync_result))
+        self.stdout.write(f"events: {len(events)}")
+        return sync_result.written
+
+    @staticmethod
+    def build_warning_rows(warnings: dict) -> list[JmaWarning]:
+        warnings_by_region = {}
+        for a_region in warnings["areaTypes"][WARNING_REGION_BASED]["areas"]:
+            region_code = a_region["code"]
+            region_warning = RegionWarning(region_code, a_region)
+            warnings_by_region.setdefault(region_code, {})["warnings"] = region_warning
+
+        region_warning_results_list: list[RegionWarningResults] = [
+            RegionWarningResults(forecast["warnings"])
+            for forecast in warnings_by_region.values()
+        ]
 
-    def handle(self, *args, **options):
-        # TODO: facilityテーブルから areas2_ids を取得
-        jma_areas2_ids = ["280000", "050000", "130000"]
-
-        if not jma_areas2_ids:
-            raise Exception("facility is empty")
-
-        JmaWarning.objects.all().delete()
-        for prefecture_id in jma_areas2_ids:
-            warnings_by_region = {}
-
-            warnings = requests.get(
-                f"https://www.jma.go.jp/bosai/warning/data/warning/{prefecture_id}.json"
-            ).json()
-            for a_region in warnings["areaTypes"][WARNING_REGION_BASED]["areas"]:
-                region_code = a_region["code"]
-                region_warning = RegionWarning(region_code, a_region)
-                warnings_by_region.setdefault(region_code, {})[
-                    "warnings"
-                ] = region_warning
-
-            region_warning_results_list: list[RegionWarningResults] = []
-            for region_code, forecast in warnings_by_region.items():
-                region_warning_results = RegionWarningResults(forecast["warnings"])
-                print(region_warning_results)
-                region_warning_results_list.append(region_warning_results)
-
-            JmaWarning.objects.bulk_create(
-                [
-                    JmaWarning(
-                        jma_areas3_id=item.region_warnings.region_code,
-                        warnings=",".join(item.region_warnings.warnings),
-                    )
-                    for item in region_warning_results_list
-                    if item.region_warnings.warnings
-                ],
+        # 警報の無いリージョンも、解除の記録とマスクの 0 を残すために行を持つ
+        return [
+            JmaWarning(
+                jma_areas3_id=item.region_warnings.region_code,
+                warnings=",".join(item.region_warnings.warnings),
+                **item.region_warnings.masks.as_fields(),
             )
+            for item in region_warning_results_list
+        ]
 
-        self.stdout.write(
-            self.style.SUCCESS("weather warning data retrieve has been completed.")
-        )
+    @staticmethod
+    def area_codes(warnings: dict) -> list[str]:
+        return [
+            an_area["code"]
+            for area_type in warnings["areaTypes"]
+            for an_area in area_type["areas"]
+        ]
+
+    @staticmethod
+    def build_city_warning_rows(warnings: dict) -> list[JmaCityWarning]:
+        area_types = warnings["areaTypes"]
+        if len(area_types) <= WARNING_CITY_BASED:
+            return []
+        return [
+            JmaCityWarning(
+                jma_areas4_id=a_city["code"],
+                **parse_warnings(a_city.get("warnings", [])).as_fields(),
+            )
+            for a_city in area_types[WARNING_CITY_BASED]["areas"]
+        ]
@@ -0,0 +1,59 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from weather.models import Facility, JmaAreas4
+
+BATCH_SIZE = 5000
+
+
+class Command(BaseCommand):
+    help = "import facilities from csv (columns: name, city_code)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("csv_path", help="csv file with a header row")
+        parser.add_argument(
+            "--replace",
+            action="store_true",
+            help="delete every existing facility before importing",
+        )
+
+    def handle(self, *args, **options):
+        city_codes = set(JmaAreas4.objects.values_list("id", flat=True))
+        if not city_codes:
+            raise CommandError("JmaAreas4 is empty. run update_jma_master first")
+
+        imported = 0
+        unknown_city_codes = set()
+        with open(options["csv_path"], encoding="utf-8-sig", newline="") as f:
+            reader = csv.DictReader(f)
+            missing_columns = {"name", "city_code"} - set(reader.fieldnames or [])
+            if missing_columns:
+                raise CommandError(f"missing columns: {', '.join(missing_columns)}")
+
+            with transaction.atomic():
+                if options["replace"]:
+                    Facility.objects.all().delete()
+
+                batch = []
+                for row in reader:
+                    city_code = row["city_code"].strip()
+                    if city_code not in city_codes:
+                        unknown_city_codes.add(city_code)
+                        continue
+                    batch.append(Facility(name=row["name"], jma_area4_id=city_code))
+                    if len(batch) >= BATCH_SIZE:
+                        Facility.objects.bulk_create(batch)
+                        imported += len(batch)
+                        batch = []
+                Facility.objects.bulk_create(batch)
+                imported += len(batch)
+
+        if unknown_city_codes:
+            self.stderr.write(
+                f"skipped unknown city codes: {', '.join(sorted(unknown_city_codes))}"
+            )
+        self.stdout.write(
+            self.style.SUCCESS(f"{imported} facilities have been imported.")
+        )
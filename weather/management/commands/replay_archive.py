@@ -0,0 +1,313 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, time, timedelta
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+
+from weather import jma_json
+from weather.archive import FORECAST, PROBABILITY, WARNING, PayloadArchive, get_archive
+from weather.area_index import CITY, REGION, get_area_index
+from weather.bulk import get_bulk_loader
+from weather.management.commands.fetch_weather_forecast import (
+    PrefectureForecast,
+    get_amedas_regions,
+)
+from weather.management.commands.fetch_weather_warning import (
+    Command as WarningCommand,
+)
+from weather.metrics import IngestMetrics, add_metrics_arguments, instrument
+from weather.models import (
+    ArchivedPayload,
+    JmaCityWarning,
+    JmaDataVersion,
+    JmaForecast,
+    JmaWarning,
+)
+from weather.read_model import refresh_city_forecasts
+from weather.sync import sync_rows
+from weather.timezone import JST
+from weather.warning_codes import MASK_FIELDS
+
+FORECAST_FIELDS = [
+    "jma_areas3_id",
+    "target_date",
+    "reported_at",
+    "weather_code",
+    "temperature_min",
+    "temperature_max",
+    "wind_speed",
+]
+REGION_WARNING_FIELDS = ["jma_areas3_id", "warnings", *MASK_FIELDS]
+CITY_WARNING_FIELDS = ["jma_areas4_id", *MASK_FIELDS]
+
+# ワーカープロセスごとの状態。init_worker で埋める
+_worker = {}
+
+
+def init_worker(archive_directory: str, amedas_regions: dict[str, str]):
+    # spawn で起動したプロセスでは Django の設定から読み込む
+    django.setup()
+    _worker["archive"] = PayloadArchive(archive_directory)
+    _worker["amedas_regions"] = amedas_regions
+
+
+def parse_forecast(job: tuple[str, str, str]) -> tuple[list[tuple] | None, str]:
+    """(都道府県, 予報の sha256, 確率の sha256) から JmaForecast の行の値を作る"""
+    _, forecast_sha, probability_sha = job
+    archive = _worker["archive"]
+    try:
+        prefecture_forecast = PrefectureForecast(
+            jma_json.loads(archive.read(forecast_sha)),
+            jma_json.loads(archive.read(probability_sha)),
+            _worker["amedas_regions"],
+        )
+        rows = prefecture_forecast.history_rows()
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+    return [tuple(getattr(row, field) for field in FORECAST_FIELDS) for row in rows], ""
+
+
+def parse_warning(job: tuple[str, str]) -> tuple[tuple | None, str]:
+    """(都道府県, 警報の sha256) から JmaWarning / JmaCityWarning の行の値を作る"""
+    _, sha256 = job
+    try:
+        warnings = jma_json.loads(_worker["archive"].read(sha256))
+        regions = WarningCommand.build_warning_rows(warnings)
+        cities = WarningCommand.build_city_warning_rows(warnings)
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+    return (
+        [
+            tuple(getattr(row, field) for field in REGION_WARNING_FIELDS)
+            for row in regions
+        ],
+        [tuple(getattr(row, field) for field in CITY_WARNING_FIELDS) for row in cities],
+    ), ""
+
+
+class Command(BaseCommand):
+    help = "re-run the forecast and warning pipeline over archived payloads"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--from",
+            dest="from_date",
+            type=date.fromisoformat,
+            required=True,
+            help="first JST date of the payloads to replay (YYYY-MM-DD)",
+        )
+        parser.add_argument(
+            "--to",
+            dest="to_date",
+            type=date.fromisoformat,
+            help="last JST date of the payloads to replay (default: today)",
+        )
+        parser.add_argument(
+            "--kinds",
+            nargs="+",
+            choices=[FORECAST, WARNING],
+            default=[FORECAST, WARNING],
+            help="pipelines to replay",
+        )
+        parser.add_argument(
+            "--prefectures",
+            nargs="+",
+            metavar="PREFECTURE",
+            help="JmaAreas2 ids to replay (default: every archived prefecture)",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count(),
+            help="number of processes that decode and aggregate the payloads",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=2000,
+            help="number of rows written in one transaction",
+        )
+        add_metrics_arguments(parser)
+
+    def handle(self, *args, **options):
+        if options["workers"] < 1:
+            raise CommandError("--workers must be 1 or more")
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be 1 or more")
+        self.archive = get_archive()
+        if self.archive is None:
+            raise CommandError("archiving is disabled: WEATHER_ARCHIVE_DIR is empty")
+        to_date = options["to_date"] or datetime.now(JST).date()
+        self.start = datetime.combine(options["from_date"], time(), JST)
+        self.end = datetime.combine(to_date + timedelta(days=1), time(), JST)
+        if self.start >= self.end:
+            raise CommandError("--from must not be after --to")
+
+        with instrument("replay_archive", options) as metrics:
+            self.replay(metrics, options)
+
+    def replay(self, metrics: IngestMetrics, options: dict):
+        with metrics.stage("plan"):
+            forecast_jobs = (
+                self.forecast_jobs(options) if FORECAST in options["kinds"] else []
+            )
+            warning_jobs = (
+                self.warning_jobs(options) if WARNING in options["kinds"] else []
+            )
+        self.stdout.write(
+            f"forecast payloads: {len(forecast_jobs)}, "
+            f"warning payloads: {len(warning_jobs)}"
+        )
+        if not forecast_jobs and not warning_jobs:
+            return
+
+        amedas_regions = get_amedas_regions()
+        # 子プロセスに接続を持ち込まないよう、fork する前に閉じておく
+        connections.close_all()
+        with ProcessPoolExecutor(
+            max_workers=options["workers"],
+            initializer=init_worker,
+            initargs=(str(self.archive.directory), amedas_regions),
+        ) as executor:
+            if forecast_jobs:
+                self.replay_forecasts(metrics, options, executor, forecast_jobs)
+            if warning_jobs:
+                self.replay_warnings(metrics, executor, warning_jobs)
+
+        self.stdout.write(str(metrics))
+        self.stdout.write(self.style.SUCCESS("the archive replay has been completed."))
+
+    def payloads(self, kinds: list[str], options: dict):
+        payloads = ArchivedPayload.objects.filter(kind__in=kinds)
+        if options["prefectures"]:
+            payloads = payloads.filter(key__in=options["prefectures"])
+        return payloads.order_by("fetched_at", "id")
+
+    def forecast_jobs(self, options: dict) -> list[tuple[str, str, str]]:
+        """
+        期間内に予報か確率が届くたびに、その時点の 予報 と 確率 の組を1つの仕事にする。
+        期間の前に届いていた方も組み合わせに使う
+        """
+        latest, jobs = {}, {}
+        for kind, key, sha256, fetched_at in (
+            self.payloads([FORECAST, PROBABILITY], options)
+            .filter(fetched_at__lt=self.end)
+            .values_list("kind", "key", "sha256", "fetched_at")
+            .iterator()
+        ):
+            latest[key, kind] = sha256
+            if fetched_at < self.start:
+                continue
+            forecast_sha = latest.get((key, FORECAST))
+            probability_sha = latest.get((key, PROBABILITY))
+            if forecast_sha and probability_sha:
+                jobs[key, forecast_sha, probability_sha] = None
+        return list(jobs)
+
+    def warning_jobs(self, options: dict) -> list[tuple[str, str]]:
+        """
+        警報の表は今の状態しか持たないので、都道府県ごとに最後に取得した警報が
+        期間内にあるときだけ、それを読み直す
+        """
+        latest = {}
+        for key, sha256, fetched_at in (
+            self.payloads([WARNING], options)
+            .values_list("key", "sha256", "fetched_at")
+            .iterator()
+        ):
+            latest[key] = (sha256, fetched_at)
+        return [
+            (key, sha256)
+            for key, (sha256, fetched_at) in sorted(latest.items())
+            if self.start <= fetched_at < self.end
+        ]
+
+    def replay_forecasts(self, metrics, options, executor, jobs):
+        area_index = get_area_index()
+        # (リージョン, 予報対象日) ごとに、いちばん新しい発表の値だけを残す
+        newest: dict[tuple, tuple] = {}
+        failures = 0
+        with metrics.stage("parse"):
+            for job, (rows, error) in zip(
+                jobs, executor.map(parse_forecast, jobs, chunksize=8)
+            ):
+                if rows is None:
+                    failures += 1
+                    self.stderr.write(f"{job[0]} {job[1][:12]}: {error}")
+                    continue
+                for row in rows:
+                    if not area_index.resolve(row[0], REGION):
+                        continue
+                    current = newest.get(row[:2])
+                    if current is None or current[2] <= row[2]:
+                        newest[row[:2]] = row
+
+        with metrics.stage("write"):
+            # DB にもっと新しい発表が入っている行は巻き戻さない
+            if newest:
+                dates = [target_date for _, target_date in newest]
+                for region_code, target_date, reported_at in JmaForecast.objects.filter(
+                    target_date__gte=min(dates), target_date__lte=max(dates)
+                ).values_list("jma_areas3_id", "target_date", "reported_at"):
+                    row = newest.get((region_code, target_date))
+                    if row is not None and row[2] < reported_at:
+                        del newest[region_code, target_date]
+
+            rows = [
+                JmaForecast(**dict(zip(FORECAST_FIELDS, row)))
+                for row in newest.values()
+            ]
+            loader = get_bulk_loader()
+            for start in range(0, len(rows), options["batch_size"]):
+                with transaction.atomic():
+                    loader.upsert(
+                        JmaForecast,
+                        rows[start : start + options["batch_size"]],
+                        unique_fields=["jma_areas3", "target_date"],
+                        update_fields=FORECAST_FIELDS[2:],
+                    )
+            if rows:
+                JmaDataVersion.bump(JmaDataVersion.FORECAST)
+        self.stdout.write(
+            f"forecast: jobs: {len(jobs)}, failed: {failures}, rows written: {len(rows)}"
+        )
+
+    def replay_warnings(self, metrics, executor, jobs):
+        area_index = get_area_index()
+        warning_rows, city_warning_rows, processed = [], [], []
+        with metrics.stage("parse"):
+            for job, (result, error) in zip(jobs, executor.map(parse_warning, jobs)):
+                if result is None:
+                    self.stderr.write(f"{job[0]} {job[1][:12]}: {error}")
+                    continue
+                regions, cities = result
+                warning_rows.extend(
+                    JmaWarning(**dict(zip(REGION_WARNING_FIELDS, row)))
+                    for row in regions
+                    if area_index.resolve(row[0], REGION)
+                )
+                city_warning_rows.extend(
+                    JmaCityWarning(**dict(zip(CITY_WARNING_FIELDS, row)))
+                    for row in cities
+                    if area_index.resolve(row[0], CITY)
+                )
+                processed.append(job[0])
+
+        # 今の状態を作り直すだけなので、発表・解除のイベントは出さない
+        with metrics.stage("write"), transaction.atomic():
+            sync_result = sync_rows(
+                JmaWarning.objects.filter(jma_areas3__jma_area2_id__in=processed),
+                warning_rows,
+                REGION_WARNING_FIELDS[1:],
+            )
+            sync_result += sync_rows(
+                JmaCityWarning.objects.filter(jma_areas4__jma_area2_id__in=processed),
+                city_warning_rows,
+                MASK_FIELDS,
+            )
+            if sync_result.written:
+                JmaDataVersion.bump(JmaDataVersion.WARNING)
+            refresh_city_forecasts(processed)
+        self.stdout.write(f"warning: prefectures: {len(processed)}, {sync_result}")
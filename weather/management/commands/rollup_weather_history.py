@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from weather.ingest import SHARED_CLIENT_OPTIONS
+from weather.metrics import IngestMetrics, add_metrics_arguments, instrument
+from weather.rollup import ObservationRollup, enforce_retention
+
+# 保持期間を過ぎた行を1トランザクションで消す件数
+DEFAULT_DELETE_BATCH_SIZE = 5000
+
+
+class Command(BaseCommand):
+    help = "roll up new observations into hourly/daily stats and drop expired history"
+    # 共有の JmaClient も渡されるが、このコマンドは使わない
+    stealth_options = SHARED_CLIENT_OPTIONS
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-hours",
+            type=int,
+            default=24,
+            help="hours of observations aggregated and written at once",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=DEFAULT_DELETE_BATCH_SIZE,
+            help="number of expired rows deleted in one transaction",
+        )
+        parser.add_argument(
+            "--skip-retention",
+            action="store_true",
+            help="only roll up, keep the rows past WEATHER_RETENTION_DAYS",
+        )
+        add_metrics_arguments(parser)
+
+    def handle(self, *args, **options):
+        if options["chunk_hours"] < 1:
+            raise CommandError("--chunk-hours must be 1 or more")
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be 1 or more")
+        with instrument("rollup_weather_history", options) as metrics:
+            self.rollup(metrics, options)
+
+    def rollup(self, metrics: IngestMetrics, options: dict):
+        rollup = ObservationRollup(options["chunk_hours"])
+        with metrics.stage("scan"):
+            rollup.find_dirty()
+        with metrics.stage("hourly"):
+            rollup.roll_hourly()
+        with metrics.stage("daily"):
+            rollup.roll_daily()
+        # 集計を書き終えてから位置を進める。途中で止まっても次回やり直せる
+        rollup.save_position()
+        self.stdout.write(f"rollup: {rollup}")
+
+        # 生の観測値は集計に畳んでから消す
+        if not options["skip_retention"]:
+            with metrics.stage("retention"):
+                deleted = enforce_retention(options["batch_size"])
+            self.stdout.write(
+                "deleted: "
+                + ", ".join(f"{label}: {count}" for label, count in deleted.items())
+            )
+        self.stdout.write(str(metrics))
+        self.stdout.write(
+            self.style.SUCCESS("weather history rollup has been completed.")
+        )
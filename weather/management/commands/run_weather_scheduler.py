@@ -0,0 +1,150 @@
+import signal
+from datetime import datetime, time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from weather.archive import get_archive
+from weather.area_index import get_area_index
+from weather.ingest import add_selection_arguments, resolve_prefecture_ids
+from weather.jma_client import JmaClient, ResponseCache
+from weather.scheduler import (
+    FORECAST_RELEASE_HOURS,
+    Job,
+    Scheduler,
+    daily_at,
+    every,
+)
+from weather.timezone import JST
+
+
+class Command(BaseCommand):
+    help = (
+        "keep running and ingest forecasts, warnings, AMeDAS observations "
+        "and the master data on schedule"
+    )
+
+    def add_arguments(self, parser):
+        add_selection_arguments(parser)
+        parser.add_argument(
+            "--forecast-delay",
+            type=int,
+            default=10,
+            help="minutes to wait after each JMA forecast release (5/11/17 JST)",
+        )
+        parser.add_argument(
+            "--warning-interval",
+            type=int,
+            default=300,
+            help="seconds between warning polls",
+        )
+        parser.add_argument(
+            "--observation-interval",
+            type=int,
+            default=600,
+            help="seconds between AMeDAS observation polls",
+        )
+        parser.add_argument(
+            "--jitter",
+            type=int,
+            default=60,
+            help="max random seconds added to every scheduled run",
+        )
+        parser.add_argument(
+            "--master-at",
+            default="04:30",
+            help="JST time of the daily master data update (HH:MM)",
+        )
+        parser.add_argument(
+            "--rollup-at",
+            default="03:30",
+            help="JST time of the daily history rollup and retention (HH:MM)",
+        )
+        parser.add_argument(
+            "--run-now",
+            action="store_true",
+            help="run every job once at startup before following the schedule",
+        )
+
+    def handle(self, *args, **options):
+        if options["warning_interval"] < 1:
+            raise CommandError("--warning-interval must be 1 or more")
+        if options["observation_interval"] < 1:
+            raise CommandError("--observation-interval must be 1 or more")
+        if options["jitter"] < 0:
+            raise CommandError("--jitter must not be negative")
+        try:
+            master_at = time.fromisoformat(options["master_at"])
+        except ValueError:
+            raise CommandError(f"--master-at must be HH:MM: {options['master_at']}")
+        try:
+            rollup_at = time.fromisoformat(options["rollup_at"])
+        except ValueError:
+            raise CommandError(f"--rollup-at must be HH:MM: {options['rollup_at']}")
+        # 指定に誤りがあれば、常駐を始める前に止める
+        resolve_prefecture_ids(options)
+
+        jobs = self.build_jobs(options, master_at, rollup_at)
+
+        # 接続プールと応答キャッシュは全ジョブで共有する
+        client = JmaClient(
+            concurrency=options["concurrency"],
+            cache=ResponseCache(settings.JMA_CACHE_DIR),
+            archive=get_archive(),
+        )
+        get_area_index()
+
+        scheduler = Scheduler(jobs, client, self.log)
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: scheduler.stop())
+        try:
+            scheduler.run(run_now=options["run_now"])
+        finally:
+            client.close()
+        self.stdout.write(self.style.SUCCESS("the scheduler has stopped."))
+
+    @staticmethod
+    def build_jobs(options: dict, master_at: time, rollup_at: time) -> list[Job]:
+        selection = {
+            key: options[key] for key in ("all", "prefectures", "concurrency", "budget")
+        }
+        forecast_times = [
+            time(
+                (hour * 60 + options["forecast_delay"]) // 60 % 24,
+                (hour * 60 + options["forecast_delay"]) % 60,
+            )
+            for hour in FORECAST_RELEASE_HOURS
+        ]
+        return [
+            Job(
+                "master",
+                "update_jma_master",
+                daily_at([master_at], options["jitter"]),
+            ),
+            Job(
+                "forecast",
+                "fetch_weather_forecast",
+                daily_at(forecast_times, options["jitter"]),
+                selection,
+            ),
+            Job(
+                "warning",
+                "fetch_weather_warning",
+                every(options["warning_interval"], options["jitter"]),
+                selection,
+            ),
+            Job(
+                "observations",
+                "fetch_amedas_observations",
+                every(options["observation_interval"], options["jitter"]),
+                {key: options[key] for key in ("concurrency", "budget")},
+            ),
+            Job(
+                "rollup",
+                "rollup_weather_history",
+                daily_at([rollup_at], options["jitter"]),
+            ),
+        ]
+
+    def log(self, message: str):
+        self.stdout.write(f"[{datetime.now(JST):%Y-%m-%d %H:%M:%S}] {message}")
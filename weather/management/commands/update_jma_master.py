@@ -1,182 +1,277 @@
 import sys
-from io import StringIO
 
-import pandas as pd
 import requests
 from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, OuterRef
 
-from weather.models import JmaAreas1, JmaAreas2, JmaAreas3, JmaAreas4, JmaAmedas
+from weather.ingest import SHARED_CLIENT_OPTIONS, ingest_client
+from weather.jma_client import jma_url
+from weather.jma_json import iter_items
+from weather.metrics import (
+    ALL_PREFECTURES,
+    IngestMetrics,
+    add_metrics_arguments,
+    instrument,
+)
+from weather.models import (
+    Facility,
+    JmaAreas1,
+    JmaAreas2,
+    JmaAreas3,
+    JmaAreas4,
+    JmaAmedas,
+    JmaDataVersion,
+)
+from weather.read_model import refresh_city_forecasts
+from weather.sync import BatchedSync, SyncResult, finish_hierarchy
 
+# マスタを DB に書き込むときの1バッチの行数
+DEFAULT_BATCH_SIZE = 500
 
-class Command(BaseCommand):
-    help = "master update"
 
-    def handle(self, *args, **options):
-        url = "https://www.jma.go.jp/bosai/common/const/area.json"
-        try:
-            # URLからデータを取得します
-            response = requests.get(url)
-            response.raise_for_status()
-        except requests.exceptions.RequestException as e:
-            print(
-                f"データの取得でエラーが発生しました。URL: {url} エラー詳細: {e}",
-                file=sys.stderr,
-            )
-            sys.exit(1)
+def to_degrees(degrees_minutes: list[float]) -> float:
+    """amedastable.json の [度, 分] を度にする"""
+    degrees, minutes = degrees_minutes
+    return degrees + minutes / 60
 
-        raw_data = pd.read_json(StringIO(response.text))
-        df_areas = pd.DataFrame({"area_name": []})
-        for code, item in raw_data["centers"].dropna().items():
-            df_areas.loc[f"{code:06}"] = [item["name"]]
 
-        df_prefs = pd.DataFrame({"area_code": [], "pref_name": []})
-        for code, item in raw_data["offices"].dropna().items():
-            df_prefs.loc[f"{code:06}"] = [item["parent"], item["name"]]
+class MasterSync:
+    """
+    area.json と forecast_area.json と amedastable.json を先頭から流し読みしながら、
+    5つのマスタテーブルへ batch_size 件ずつ差分を書き込む。
 
-        df_regions = pd.DataFrame({"pref_code": [], "region_name": []})
-        for code, item in raw_data["class10s"].dropna().items():
-            df_regions.loc[f"{code:06}"] = [item["parent"], item["name"]]
+    手元に持つのは親をたどるための コード -> 親コード の対応表と、
+    書き込み待ちの1バッチ分の行だけ
+    """
 
-        df_class15s = pd.DataFrame({"region_code": [], "class15_name": []})
-        for code, item in raw_data["class15s"].dropna().items():
-            df_class15s.loc[f"{code:06}"] = [item["parent"], item["name"]]
+    def __init__(self, batch_size: int):
+        self.syncs = {
+            # jma_areas1: 010600 近畿地方
+            "centers": BatchedSync(JmaAreas1.objects.all(), ["name"], batch_size),
+            # jma_areas2: 280000 兵庫県
+            "offices": BatchedSync(
+                JmaAreas2.objects.all(), ["jma_area1_id", "name"], batch_size
+            ),
+            # jma_areas3: 280010 南部
+            "class10s": BatchedSync(
+                JmaAreas3.objects.all(), ["jma_area2_id", "name"], batch_size
+            ),
+            # jma_areas4: 2820100 姫路市
+            "class20s": BatchedSync(
+                JmaAreas4.objects.all(),
+                ["jma_area2_id", "jma_area3_id", "name"],
+                batch_size,
+            ),
+            # 2: from forecast_area.json and amedastable.json
+            "amedas": BatchedSync(
+                JmaAmedas.objects.all(),
+                ["jma_area3_id", "name", "lat", "lon"],
+                batch_size,
+            ),
+        }
+        self.center_codes = set()
+        self.pref_centers = {}
+        self.region_prefs = {}
+        self.class15_regions = {}
+        self.city_regions = {}
+        self.amedas_regions = {}
+        # 親より先に出てきた市区町村。最後にもう一度たどる
+        self.pending_cities = []
+
+    def read_areas(self, chunks):
+        section = None
+        for (key, code), item in iter_items(chunks, 2):
+            if key != section:
+                # 子を書き込む前に、親の書き込み待ちを流しておく
+                for sync in self.syncs.values():
+                    sync.flush()
+                section = key
+
+            if key == "centers":
+                self.center_codes.add(code)
+                self.syncs[key].add(JmaAreas1(id=code, name=item["name"]))
+            elif key == "offices":
+                self.pref_centers[code] = item["parent"]
+                self.syncs[key].add(
+                    JmaAreas2(id=code, jma_area1_id=item["parent"], name=item["name"])
+                )
+            elif key == "class10s":
+                self.region_prefs[code] = item["parent"]
+                self.syncs[key].add(
+                    JmaAreas3(id=code, jma_area2_id=item["parent"], name=item["name"])
+                )
+            elif key == "class15s":
+                self.class15_regions[code] = item["parent"]
+            elif key == "class20s":
+                if not self.add_city(code, item["parent"], item["name"]):
+                    self.pending_cities.append((code, item["parent"], item["name"]))
 
-        df_cities = pd.DataFrame({"class15_code": [], "city_name": []})
-        for code, item in raw_data["class20s"].dropna().items():
-            df_cities.loc[f"{code:07}"] = [item["parent"], item["name"]]
+        # 最後まで親が見つからない市区町村は捨てる
+        for city in self.pending_cities:
+            self.add_city(*city)
+        self.pending_cities = []
 
-        df_cities = (
-            df_cities.merge(
-                df_class15s, left_on="class15_code", right_index=True, how="outer"
+    def add_city(self, code: str, class15_code: str, name: str) -> bool:
+        """
+        市区町村(class20)の親は class15 なので、class15 -> class10 -> office -> center
+        とたどってリージョンと都道府県を決める。たどれなければ False
+        """
+        region_code = self.class15_regions.get(class15_code)
+        pref_code = self.region_prefs.get(region_code)
+        if self.pref_centers.get(pref_code) not in self.center_codes:
+            return False
+        self.city_regions[code] = region_code
+        self.syncs["class20s"].add(
+            JmaAreas4(
+                id=code, jma_area2_id=pref_code, jma_area3_id=region_code, name=name
             )
-            .merge(df_regions, left_on="region_code", right_index=True)
-            .merge(df_prefs, left_on="pref_code", right_index=True)
-            .merge(df_areas, left_on="area_code", right_index=True)
-        )
-        df_cities.drop(
-            ["area_code", "area_name", "class15_code", "class15_name"],
-            axis=1,
-            inplace=True,
         )
+        return True
 
-        # jma_areas1: 010600 近畿地方
-        df_areas.index.name = "id"
-        df_areas.rename(columns={"area_name": "name"}, inplace=True)
-        dict_centers = df_areas.reset_index().to_dict("records")
-        JmaAreas1.objects.all().delete()
-        JmaAreas1.objects.bulk_create(
-            [JmaAreas1(id=item["id"], name=item["name"]) for item in dict_centers]
-        )
+    def read_amedas(self, chunks):
+        """forecast_area.json から アメダス観測所 -> リージョン を作る。先に出た方を採る"""
+        for _, item in iter_items(chunks, 2):
+            region_code = self.city_regions.get(item["class20"])
+            if region_code is None:
+                continue
+            for amedas_code in item["amedas"]:
+                self.amedas_regions.setdefault(amedas_code, region_code)
 
-        # jma_areas2: 280000 兵庫県
-        df_prefs.index.name = "id"
-        df_prefs.rename(
-            columns={"area_code": "jmaAreas1Id", "pref_name": "name"}, inplace=True
-        )
-        dict_prefs = df_prefs.reset_index().to_dict("records")
-        JmaAreas2.objects.all().delete()
-        JmaAreas2.objects.bulk_create(
-            [
-                JmaAreas2(
-                    id=item["id"], jma_area1_id=item["jmaAreas1Id"], name=item["name"]
+    def read_stations(self, chunks):
+        """
+        amedastable.json から観測所の名前と位置を書き込む。緯度経度は [度, 分] で来る。
+        一覧に無いがリージョンのある観測所も、位置なしで残す
+        """
+        amedas = self.syncs["amedas"]
+        for (amedas_code,), item in iter_items(chunks, 1):
+            amedas.add(
+                JmaAmedas(
+                    id=amedas_code,
+                    jma_area3_id=self.amedas_regions.get(amedas_code),
+                    name=item["kjName"],
+                    lat=to_degrees(item["lat"]),
+                    lon=to_degrees(item["lon"]),
                 )
-                for item in dict_prefs
-            ]
-        )
+            )
+        for amedas_code, region_code in self.amedas_regions.items():
+            if amedas_code not in amedas:
+                amedas.add(JmaAmedas(id=amedas_code, jma_area3_id=region_code))
 
-        # jma_areas3: 280010 南部
-        df_regions.index.name = "id"
-        df_regions.rename(
-            columns={"pref_code": "jmaAreas2Id", "region_name": "name"}, inplace=True
-        )
-        dict_regions = df_regions.reset_index().to_dict("records")
-        JmaAreas3.objects.all().delete()
-        JmaAreas3.objects.bulk_create(
-            [
-                JmaAreas3(
-                    id=item["id"], jma_area2_id=item["jmaAreas2Id"], name=item["name"]
-                )
-                for item in dict_regions
-            ]
-        )
+    def keep_facility_cities(self) -> list[str]:
+        """
+        JMA から消えた市区町村でも、施設があるものは親までたどって残す。
+        Facility は PROTECT なので、消そうとすると同期全体が失敗する
+        """
+        kept = []
+        for city_code, region_code, pref_code, center_code in (
+            JmaAreas4.objects.filter(
+                Exists(Facility.objects.filter(jma_area4=OuterRef("pk")))
+            )
+            .values_list(
+                "id", "jma_area3_id", "jma_area2_id", "jma_area2__jma_area1_id"
+            )
+            .iterator()
+        ):
+            if city_code in self.syncs["class20s"]:
+                continue
+            self.syncs["class20s"].keep([city_code])
+            # 親も JMA から消えていれば、一緒に残す
+            if region_code not in self.syncs["class10s"]:
+                self.syncs["class10s"].keep([region_code])
+            if pref_code not in self.syncs["offices"]:
+                self.syncs["offices"].keep([pref_code])
+            if center_code not in self.syncs["centers"]:
+                self.syncs["centers"].keep([center_code])
+            kept.append(city_code)
+        return kept
+
+    def finish(self) -> SyncResult:
+        self.kept_cities = self.keep_facility_cities()
+        return finish_hierarchy(list(self.syncs.values()))
 
-        # jma_areas4: 2820100 姫路市
-        df_cities.index.name = "id"
-        df_cities.drop(["pref_name"], axis=1, inplace=True)
-        df_cities.rename(
-            columns={
-                "pref_code": "jmaAreas2Id",
-                "region_code": "jmaAreas3Id",
-                "region_name": "regionName",
-                "city_name": "name",
-            },
-            inplace=True,
+
+class Command(BaseCommand):
+    help = "master update"
+    stealth_options = SHARED_CLIENT_OPTIONS
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="rebuild the master data even if JMA has not updated it",
         )
-        df_cities = df_cities.reindex(["jmaAreas2Id", "jmaAreas3Id", "name"], axis=1)
-        dict_cities = df_cities.reset_index().to_dict("records")
-        JmaAreas4.objects.all().delete()
-        JmaAreas4.objects.bulk_create(
-            [
-                JmaAreas4(
-                    id=item["id"],
-                    jma_area2_id=item["jmaAreas2Id"],
-                    jma_area3_id=item["jmaAreas3Id"],
-                    name=item["name"],
-                )
-                for item in dict_cities
-            ]
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=DEFAULT_BATCH_SIZE,
+            help="number of rows written to the database at once",
         )
+        add_metrics_arguments(parser)
 
-        # 2: from forecast_area.json
-        url = "https://www.jma.go.jp/bosai/forecast/const/forecast_area.json"
-        try:
-            # URLからデータを取得します
-            response = requests.get(url)
-            response.raise_for_status()
-        except requests.exceptions.RequestException as e:
-            print(
-                f"データの取得でエラーが発生しました。URL: {url} エラー詳細: {e}",
-                file=sys.stderr,
-            )
-            sys.exit(1)
+    def handle(self, *args, **options):
+        with instrument("update_jma_master", options) as metrics:
+            self.update(metrics, options)
+
+    def update(self, metrics: IngestMetrics, options: dict):
+        responses = []
+        with ingest_client(options) as client:
+            for url in [
+                jma_url("common/const/area.json"),
+                jma_url("forecast/const/forecast_area.json"),
+                jma_url("amedas/const/amedastable.json"),
+            ]:
+                try:
+                    # URLからデータを取得します。本文はメモリに載せずファイルに置く
+                    with metrics.stage("fetch"):
+                        responses.append(client.get(url, stream=True))
+                except requests.exceptions.RequestException as e:
+                    print(
+                        f"データの取得でエラーが発生しました。URL: {url} エラー詳細: {e}",
+                        file=sys.stderr,
+                    )
+                    for response in responses:
+                        response.close()
+                    sys.exit(1)
+        metrics.add_responses(ALL_PREFECTURES, responses)
+        area_response, forecast_area_response, amedas_response = responses
 
         try:
-            raw_data = response.json()  # response.text から JSON データを直接取得します
-        except ValueError:
-            print("JSONデコードエラー", file=sys.stderr)
-            sys.exit(1)
-
-        forecast_areas = []
-        for key, value in raw_data.items():
-            for item in value:
-                for amedas in item["amedas"]:
-                    forecast_areas.append(
-                        {
-                            "id": amedas,
-                            "class10_code": item["class10"],
-                            "class20_code": item["class20"],
-                        }
+            if not any(item.changed for item in responses):
+                self.stdout.write("The master data is not modified.")
+                return
+
+            # 既存のマスタとの差分だけを1トランザクションで反映する。
+            # 全消しすると CASCADE で JmaWeather / JmaWarning まで消えてしまう
+            # 流し読みとデコードと書き込みは交互に進むので、1つの段階として測る
+            with metrics.stage("sync"), transaction.atomic():
+                master_sync = MasterSync(options["batch_size"])
+                try:
+                    master_sync.read_areas(area_response.iter_chunks())
+                    master_sync.read_amedas(forecast_area_response.iter_chunks())
+                    master_sync.read_stations(amedas_response.iter_chunks())
+                except ValueError:
+                    print("JSONデコードエラー", file=sys.stderr)
+                    sys.exit(1)
+                sync_result = master_sync.finish()
+                if master_sync.kept_cities:
+                    self.stderr.write(
+                        "kept cities removed by JMA because facilities are in them: "
+                        + ", ".join(master_sync.kept_cities)
                     )
+                if sync_result.written:
+                    JmaDataVersion.bump(JmaDataVersion.MASTER)
+                    # 名前や所属が変わった市区町村は、どの都道府県にもありうる
+                    city_result = refresh_city_forecasts()
+                    print(f"city forecasts: {city_result}")
+            print(sync_result)
 
-        df_amedas = pd.DataFrame(forecast_areas).set_index("id")
-        df_amedas = df_amedas.merge(df_cities, left_on="class20_code", right_index=True)
-        df_amedas.drop(
-            ["class10_code", "class20_code", "jmaAreas2Id", "name"],
-            axis=1,
-            inplace=True,
-        )
-        dict_amedas = df_amedas.reset_index().to_dict("records")
-        JmaAmedas.objects.all().delete()
-        JmaAmedas.objects.bulk_create(
-            [
-                JmaAmedas(
-                    id=item["id"],
-                    jma_area3_id=item["jmaAreas3Id"],
-                )
-                for item in dict_amedas
-            ]
-        )
+            client.remember(*responses)
+        finally:
+            for response in responses:
+                response.close()
 
+        self.stdout.write(str(metrics))
         self.stdout.write(
             self.style.SUCCESS("The master data update has been completed.")
         )
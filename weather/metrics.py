@@ -0,0 +1,231 @@
+import cProfile
+import json
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.db import connection
+
+from weather.jma_client import JmaResponse
+
+PROMETHEUS = "prometheus"
+JSONL = "jsonl"
+
+# 都道府県に分けられない段階(まとめて取得・まとめて書き込み)のラベル
+ALL_PREFECTURES = "all"
+
+
+def add_metrics_arguments(parser):
+    parser.add_argument(
+        "--metrics-file",
+        type=Path,
+        help="write per-stage timings to this file after the run",
+    )
+    parser.add_argument(
+        "--metrics-format",
+        choices=[PROMETHEUS, JSONL],
+        default=PROMETHEUS,
+        help="prometheus textfile (overwritten) or JSON lines (appended)",
+    )
+    parser.add_argument(
+        "--profile",
+        type=Path,
+        metavar="FILE",
+        help="write a cProfile dump of the run (main thread only) to FILE",
+    )
+
+
+class QueryCounter:
+    """
+    connection.execute_wrapper に渡して、クエリ数と書き込んだ行数を数える。
+
+    RETURNING 付きの INSERT は結果を読み終えるまで rowcount が決まらないので、
+    カーソルを覚えておき、次のクエリか rows_written を読むときに数える
+    """
+
+    WRITES = ("INSERT", "UPDATE", "DELETE")
+
+    def __init__(self):
+        self.queries = 0
+        self._rows_written = 0
+        self._returning = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self._count_returning()
+        result = execute(sql, params, many, context)
+        self.queries += 1
+        if sql.lstrip()[:6].upper() in self.WRITES:
+            if " RETURNING " in sql.upper():
+                self._returning.append(context["cursor"])
+            else:
+                self._rows_written += max(context["cursor"].rowcount, 0)
+        return result
+
+    def _count_returning(self):
+        for cursor in self._returning:
+            self._rows_written += max(cursor.rowcount, 0)
+        self._returning = []
+
+    @property
+    def rows_written(self) -> int:
+        self._count_returning()
+        return self._rows_written
+
+
+class StageStats:
+    def __init__(self):
+        self.seconds = 0.0
+        self.queries = 0
+        self.calls = 0
+
+
+class IngestMetrics:
+    """
+    1回の取り込みの段階(取得・デコード・集計・書き込み)ごとの所要時間とクエリ数、
+    都道府県ごとのダウンロード量を集める
+    """
+
+    def __init__(self, command: str):
+        self.command = command
+        self.started_at = time.time()
+        self.counter = QueryCounter()
+        self.stages: dict[tuple[str, str], StageStats] = {}
+        self.downloaded: dict[str, int] = {}
+
+    def _stats(self, name: str, prefecture_id: str) -> StageStats:
+        return self.stages.setdefault((name, prefecture_id), StageStats())
+
+    @contextmanager
+    def stage(self, name: str, prefecture_id: str = ALL_PREFECTURES):
+        queries = self.counter.queries
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            stats = self._stats(name, prefecture_id)
+            stats.seconds += time.perf_counter() - started
+            stats.queries += self.counter.queries - queries
+            stats.calls += 1
+
+    def add_responses(self, prefecture_id: str, responses: list[JmaResponse]):
+        """並列に取得した応答の所要時間とバイト数を、都道府県の http 段階として記録する"""
+        stats = self._stats("http", prefecture_id)
+        for response in responses:
+            stats.seconds += response.elapsed
+            stats.calls += 1
+            self.downloaded[prefecture_id] = (
+                self.downloaded.get(prefecture_id, 0) + response.downloaded
+            )
+
+    def totals(self) -> dict[str, float]:
+        """段階ごとの合計秒数。http は並列なので、実時間ではなく各リクエストの合計"""
+        totals = {}
+        for (name, _), stats in self.stages.items():
+            totals[name] = totals.get(name, 0.0) + stats.seconds
+        return totals
+
+    def __str__(self):
+        stages = ", ".join(
+            f"{name} {seconds:.3f}s" for name, seconds in self.totals().items()
+        )
+        return (
+            f"stages: {stages}; queries: {self.counter.queries}, "
+            f"downloaded: {sum(self.downloaded.values())} bytes"
+        )
+
+    def records(self) -> list[dict]:
+        records = [
+            {
+                "command": self.command,
+                "started_at": self.started_at,
+                "stage": name,
+                "prefecture": prefecture_id,
+                "seconds": round(stats.seconds, 6),
+                "queries": stats.queries,
+                "calls": stats.calls,
+                "bytes": (
+                    self.downloaded.get(prefecture_id, 0) if name == "http" else None
+                ),
+            }
+            for (name, prefecture_id), stats in self.stages.items()
+        ]
+        records.append(
+            {
+                "command": self.command,
+                "started_at": self.started_at,
+                "stage": "total",
+                "prefecture": ALL_PREFECTURES,
+                "seconds": round(time.time() - self.started_at, 6),
+                "queries": self.counter.queries,
+                "calls": 1,
+                "bytes": sum(self.downloaded.values()),
+            }
+        )
+        return records
+
+    def write_jsonl(self, path: Path):
+        with open(path, "a", encoding="utf-8") as f:
+            for record in self.records():
+                f.write(json.dumps(record) + "\n")
+
+    def write_prometheus(self, path: Path):
+        """
+        node_exporter の textfile collector 形式で書く。
+
+        読み手に書きかけのファイルを見せないよう、一時ファイルに書いてから置き換える
+        """
+        lines = []
+        for metric, help_text, key in [
+            ("jma_ingest_stage_seconds", "Time spent in each stage.", "seconds"),
+            ("jma_ingest_stage_queries", "ORM queries run in each stage.", "queries"),
+            ("jma_ingest_downloaded_bytes", "Bytes downloaded from JMA.", "bytes"),
+        ]:
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} gauge")
+            for record in self.records():
+                if record[key] is None:
+                    continue
+                labels = ",".join(
+                    f'{label}="{record[label]}"'
+                    for label in ("command", "stage", "prefecture")
+                )
+                lines.append(f"{metric}{{{labels}}} {record[key]}")
+        lines.append("# HELP jma_ingest_last_run_timestamp_seconds Start of the run.")
+        lines.append("# TYPE jma_ingest_last_run_timestamp_seconds gauge")
+        lines.append(
+            f'jma_ingest_last_run_timestamp_seconds{{command="{self.command}"}} '
+            f"{self.started_at}"
+        )
+
+        tmp_path = Path(f"{path}.{os.getpid()}.tmp")
+        tmp_path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+        os.replace(tmp_path, path)
+
+    def write(self, path: Path, metrics_format: str):
+        if metrics_format == JSONL:
+            self.write_jsonl(path)
+        else:
+            self.write_prometheus(path)
+
+
+@contextmanager
+def instrument(command: str, options: dict):
+    """
+    取り込み全体を囲み、クエリを数えながら IngestMetrics を渡す。
+
+    終わったら --metrics-file に書き出し、--profile があれば cProfile の結果を保存する
+    """
+    metrics = IngestMetrics(command)
+    profiler = cProfile.Profile() if options.get("profile") else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        with connection.execute_wrapper(metrics.counter):
+            yield metrics
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(options["profile"])
+    if options.get("metrics_file"):
+        metrics.write(options["metrics_file"], options["metrics_format"])
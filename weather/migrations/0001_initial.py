@@ -0,0 +1,135 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:45
+#
+# migrations を置く前の、migrate --run-syncdb で作った表と同じ構成。
+# 既存の DB は一度だけ `manage.py migrate weather --fake-initial` を実行すると、
+# この migration を適用済みにして 0002 以降の列の追加・変更だけを当てる
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = []
+
+    operations = [
+        migrations.CreateModel(
+            name="JmaAreas1",
+            fields=[
+                (
+                    "id",
+                    models.CharField(max_length=6, primary_key=True, serialize=False),
+                ),
+                ("name", models.CharField(max_length=100)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="JmaAreas3",
+            fields=[
+                (
+                    "id",
+                    models.CharField(max_length=6, primary_key=True, serialize=False),
+                ),
+                ("name", models.CharField(max_length=100)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="JmaAreas2",
+            fields=[
+                (
+                    "id",
+                    models.CharField(max_length=6, primary_key=True, serialize=False),
+                ),
+                ("name", models.CharField(max_length=100)),
+                (
+                    "jma_area1",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="weather.jmaareas1",
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="JmaWarning",
+            fields=[
+                (
+                    "jma_areas3",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        serialize=False,
+                        to="weather.jmaareas3",
+                    ),
+                ),
+                ("warnings", models.CharField(max_length=100)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="JmaWeather",
+            fields=[
+                (
+                    "jma_areas3",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        serialize=False,
+                        to="weather.jmaareas3",
+                    ),
+                ),
+                ("weather_code", models.CharField(max_length=3)),
+                ("temperature_min", models.FloatField()),
+                ("temperature_max", models.FloatField()),
+                ("wind_speed", models.FloatField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name="jmaareas3",
+            name="jma_area2",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE, to="weather.jmaareas2"
+            ),
+        ),
+        migrations.CreateModel(
+            name="JmaAmedas",
+            fields=[
+                (
+                    "id",
+                    models.CharField(max_length=5, primary_key=True, serialize=False),
+                ),
+                (
+                    "jma_area3",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="weather.jmaareas3",
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="JmaAreas4",
+            fields=[
+                (
+                    "id",
+                    models.CharField(max_length=7, primary_key=True, serialize=False),
+                ),
+                ("name", models.CharField(max_length=100)),
+                (
+                    "jma_area2",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="weather.jmaareas2",
+                    ),
+                ),
+                (
+                    "jma_area3",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="weather.jmaareas3",
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("weather", "0002_facility"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="JmaForecast",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("target_date", models.DateField()),
+                ("reported_at", models.DateTimeField()),
+                ("weather_code", models.CharField(max_length=3, null=True)),
+                ("temperature_min", models.FloatField(null=True)),
+                ("temperature_max", models.FloatField(null=True)),
+                ("wind_speed", models.FloatField(null=True)),
+                (
+                    "jma_areas3",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="weather.jmaareas3",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("jma_areas3", "target_date"),
+                        name="unique_jma_forecast_region_date",
+                    )
+                ],
+            },
+        ),
+    ]
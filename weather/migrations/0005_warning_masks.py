@@ -0,0 +1,112 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:21
+
+import django.db.models.deletion
+import django.db.models.expressions
+import weather.warning_codes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("weather", "0004_jmadataversion"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="jmawarning",
+            name="active_mask",
+            field=weather.warning_codes.WarningMaskField(default=0),
+        ),
+        migrations.AddField(
+            model_name="jmawarning",
+            name="issued_mask",
+            field=weather.warning_codes.WarningMaskField(default=0),
+        ),
+        migrations.AddField(
+            model_name="jmawarning",
+            name="continued_mask",
+            field=weather.warning_codes.WarningMaskField(default=0),
+        ),
+        migrations.AddField(
+            model_name="jmawarning",
+            name="cancelled_mask",
+            field=weather.warning_codes.WarningMaskField(default=0),
+        ),
+        migrations.CreateModel(
+            name="JmaCityWarning",
+            fields=[
+                ("active_mask", weather.warning_codes.WarningMaskField(default=0)),
+                ("issued_mask", weather.warning_codes.WarningMaskField(default=0)),
+                ("continued_mask", weather.warning_codes.WarningMaskField(default=0)),
+                ("cancelled_mask", weather.warning_codes.WarningMaskField(default=0)),
+                (
+                    "jma_areas4",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        serialize=False,
+                        to="weather.jmaareas4",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        django.db.models.expressions.CombinedExpression(
+                            models.F("active_mask"), "&", models.Value(8)
+                        ),
+                        name="city_warning_active_03",
+                    ),
+                    models.Index(
+                        django.db.models.expressions.CombinedExpression(
+                            models.F("active_mask"), "&", models.Value(1024)
+                        ),
+                        name="city_warning_active_10",
+                    ),
+                    models.Index(
+                        django.db.models.expressions.CombinedExpression(
+                            models.F("active_mask"), "&", models.Value(16384)
+                        ),
+                        name="city_warning_active_14",
+                    ),
+                    models.Index(
+                        django.db.models.expressions.CombinedExpression(
+                            models.F("active_mask"), "&", models.Value(32768)
+                        ),
+                        name="city_warning_active_15",
+                    ),
+                    models.Index(
+                        django.db.models.expressions.CombinedExpression(
+                            models.F("active_mask"), "&", models.Value(65536)
+                        ),
+                        name="city_warning_active_16",
+                    ),
+                    models.Index(
+                        django.db.models.expressions.CombinedExpression(
+                            models.F("active_mask"), "&", models.Value(262144)
+                        ),
+                        name="city_warning_active_18",
+                    ),
+                    models.Index(
+                        django.db.models.expressions.CombinedExpression(
+                            models.F("active_mask"), "&", models.Value(1048576)
+                        ),
+                        name="city_warning_active_20",
+                    ),
+                    models.Index(
+                        django.db.models.expressions.CombinedExpression(
+                            models.F("active_mask"), "&", models.Value(2097152)
+                        ),
+                        name="city_warning_active_21",
+                    ),
+                    models.Index(
+                        django.db.models.expressions.CombinedExpression(
+                            models.F("active_mask"), "&", models.Value(16777216)
+                        ),
+                        name="city_warning_active_24",
+                    ),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,105 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:27
+
+import django.db.models.deletion
+import django.db.models.expressions
+import weather.warning_codes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("weather", "0005_warning_masks"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="JmaCityForecast",
+            fields=[
+                (
+                    "jma_areas4",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        serialize=False,
+                        to="weather.jmaareas4",
+                    ),
+                ),
+                ("city_name", models.CharField(max_length=100)),
+                ("region_code", models.CharField(max_length=6)),
+                ("region_name", models.CharField(max_length=100)),
+                ("prefecture_code", models.CharField(max_length=6)),
+                ("prefecture_name", models.CharField(max_length=100)),
+                ("center_code", models.CharField(max_length=6)),
+                ("center_name", models.CharField(max_length=100)),
+                ("weather_code", models.CharField(max_length=3, null=True)),
+                ("temperature_min", models.FloatField(null=True)),
+                ("temperature_max", models.FloatField(null=True)),
+                ("wind_speed", models.FloatField(null=True)),
+                ("active_mask", weather.warning_codes.WarningMaskField(default=0)),
+                ("warnings", models.CharField(max_length=100)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["prefecture_code", "jma_areas4"],
+                        name="city_forecast_prefecture",
+                    ),
+                    models.Index(
+                        django.db.models.expressions.CombinedExpression(
+                            models.F("active_mask"), "&", models.Value(8)
+                        ),
+                        name="city_forecast_active_03",
+                    ),
+                    models.Index(
+                        django.db.models.expressions.CombinedExpression(
+                            models.F("active_mask"), "&", models.Value(1024)
+                        ),
+                        name="city_forecast_active_10",
+                    ),
+                    models.Index(
+                        django.db.models.expressions.CombinedExpression(
+                            models.F("active_mask"), "&", models.Value(16384)
+                        ),
+                        name="city_forecast_active_14",
+                    ),
+                    models.Index(
+                        django.db.models.expressions.CombinedExpression(
+                            models.F("active_mask"), "&", models.Value(32768)
+                        ),
+                        name="city_forecast_active_15",
+                    ),
+                    models.Index(
+                        django.db.models.expressions.CombinedExpression(
+                            models.F("active_mask"), "&", models.Value(65536)
+                        ),
+                        name="city_forecast_active_16",
+                    ),
+                    models.Index(
+                        django.db.models.expressions.CombinedExpression(
+                            models.F("active_mask"), "&", models.Value(262144)
+                        ),
+                        name="city_forecast_active_18",
+                    ),
+                    models.Index(
+                        django.db.models.expressions.CombinedExpression(
+                            models.F("active_mask"), "&", models.Value(1048576)
+                        ),
+                        name="city_forecast_active_20",
+                    ),
+                    models.Index(
+                        django.db.models.expressions.CombinedExpression(
+                            models.F("active_mask"), "&", models.Value(2097152)
+                        ),
+                        name="city_forecast_active_21",
+                    ),
+                    models.Index(
+                        django.db.models.expressions.CombinedExpression(
+                            models.F("active_mask"), "&", models.Value(16777216)
+                        ),
+                        name="city_forecast_active_24",
+                    ),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("weather", "0006_jmacityforecast"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="jmaamedas",
+            name="name",
+            field=models.CharField(default="", max_length=100),
+        ),
+        migrations.AddField(
+            model_name="jmaamedas",
+            name="lat",
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name="jmaamedas",
+            name="lon",
+            field=models.FloatField(null=True),
+        ),
+        migrations.AlterField(
+            model_name="jmaamedas",
+            name="jma_area3",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                to="weather.jmaareas3",
+            ),
+        ),
+    ]
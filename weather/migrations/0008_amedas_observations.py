@@ -0,0 +1,63 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("weather", "0007_amedas_location"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AmedasObservation",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("observed_at", models.DateTimeField()),
+                ("temperature", models.FloatField(null=True)),
+                ("wind_speed", models.FloatField(null=True)),
+                ("wind_direction", models.SmallIntegerField(null=True)),
+                ("precipitation_10m", models.FloatField(null=True)),
+                (
+                    "jma_amedas",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="weather.jmaamedas",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["observed_at"], name="amedas_observation_time")
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("jma_amedas", "observed_at"),
+                        name="unique_amedas_observation_station_time",
+                    )
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="AmedasSnapshot",
+            fields=[
+                (
+                    "observed_at",
+                    models.DateTimeField(primary_key=True, serialize=False),
+                ),
+                ("stations", models.PositiveIntegerField()),
+                ("ingested_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
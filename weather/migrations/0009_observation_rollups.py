@@ -0,0 +1,102 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("weather", "0008_amedas_observations"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AmedasObservationHourly",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("samples", models.PositiveIntegerField()),
+                ("temperature_min", models.FloatField(null=True)),
+                ("temperature_max", models.FloatField(null=True)),
+                ("temperature_avg", models.FloatField(null=True)),
+                ("wind_speed_max", models.FloatField(null=True)),
+                ("wind_speed_avg", models.FloatField(null=True)),
+                ("precipitation_sum", models.FloatField(null=True)),
+                ("hour", models.DateTimeField()),
+                (
+                    "jma_amedas",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="weather.jmaamedas",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [models.Index(fields=["hour"], name="amedas_hourly_hour")],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("jma_amedas", "hour"),
+                        name="unique_amedas_hourly_station_hour",
+                    )
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="AmedasObservationDaily",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("samples", models.PositiveIntegerField()),
+                ("temperature_min", models.FloatField(null=True)),
+                ("temperature_max", models.FloatField(null=True)),
+                ("temperature_avg", models.FloatField(null=True)),
+                ("wind_speed_max", models.FloatField(null=True)),
+                ("wind_speed_avg", models.FloatField(null=True)),
+                ("precipitation_sum", models.FloatField(null=True)),
+                ("date", models.DateField()),
+                (
+                    "jma_amedas",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="weather.jmaamedas",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [models.Index(fields=["date"], name="amedas_daily_date")],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("jma_amedas", "date"),
+                        name="unique_amedas_daily_station_date",
+                    )
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="RollupWatermark",
+            fields=[
+                (
+                    "name",
+                    models.CharField(max_length=50, primary_key=True, serialize=False),
+                ),
+                ("position", models.DateTimeField()),
+            ],
+        ),
+    ]
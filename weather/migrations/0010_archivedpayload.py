@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("weather", "0009_observation_rollups"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ArchivedPayload",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("url", models.CharField(max_length=200)),
+                ("kind", models.CharField(max_length=20)),
+                ("key", models.CharField(max_length=50)),
+                ("sha256", models.CharField(max_length=64)),
+                ("size", models.PositiveIntegerField()),
+                ("fetched_at", models.DateTimeField()),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["kind", "fetched_at"], name="archived_payload_kind"
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("url", "sha256"),
+                        name="unique_archived_payload_url_body",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -1,4 +1,7 @@
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
+
+from weather.warning_codes import WARNING_BITS, WarningMaskField
 
 
 class JmaAreas1(models.Model):
@@ -34,10 +37,18 @@ class JmaAreas4(models.Model):
 
 
 class JmaAmedas(models.Model):
-    """気象観測所。生データでは amedas という名前で取り扱われている"""
+    """
+    気象観測所。生データでは amedas という名前で取り扱われている。
+
+    位置は amedastable.json から、リージョンは forecast_area.json から埋める。
+    予報に使われない観測所はリージョンを持たない
+    """
 
     id = models.CharField(primary_key=True, max_length=5)
-    jma_area3 = models.ForeignKey(JmaAreas3, on_delete=models.CASCADE)
+    jma_area3 = models.ForeignKey(JmaAreas3, on_delete=models.CASCADE, null=True)
+    name = models.CharField(max_length=100, default="")
+    lat = models.FloatField(null=True)
+    lon = models.FloatField(null=True)
 
 
 class JmaWeather(models.Model):
@@ -50,8 +61,277 @@ class JmaWeather(models.Model):
     wind_speed = models.FloatField()
 
 
-class JmaWarning(models.Model):
+class JmaForecast(models.Model):
+    """
+    リージョン × 予報対象日 ごとの予報の履歴。3日間予報と週間予報の両方から埋める。
+    発表ごとに同じ (jma_areas3, target_date) の行を上書きする
+    """
+
+    jma_areas3 = models.ForeignKey(JmaAreas3, on_delete=models.CASCADE)
+    target_date = models.DateField()
+    reported_at = models.DateTimeField()
+    weather_code = models.CharField(max_length=3, null=True)
+    temperature_min = models.FloatField(null=True)
+    temperature_max = models.FloatField(null=True)
+    wind_speed = models.FloatField(null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["jma_areas3", "target_date"],
+                name="unique_jma_forecast_region_date",
+            )
+        ]
+
+
+class WarningStatus(models.Model):
+    """
+    警報をビットマスクで持つ。ビットは weather.warning_codes.WARNING_BITS。
+    active は今出ている警報、残りは直近の発表での 発表 / 継続 / 解除 の内訳
+    """
+
+    active_mask = WarningMaskField(default=0)
+    issued_mask = WarningMaskField(default=0)
+    continued_mask = WarningMaskField(default=0)
+    cancelled_mask = WarningMaskField(default=0)
+
+    class Meta:
+        abstract = True
+
+
+class JmaWarning(WarningStatus):
+    """リージョン(class10)の警報。warnings は今出ている警報の名前をカンマでつないだもの"""
+
     jma_areas3 = models.OneToOneField(
         JmaAreas3, primary_key=True, on_delete=models.CASCADE
     )
     warnings = models.CharField(max_length=100)
+
+
+class JmaCityWarning(WarningStatus):
+    """
+    市区町村(class20)の警報。
+
+    警報ごとに (active_mask & ビット) の式インデックスを張るので、
+    filter(active_mask__has_warning="03") は文字列の LIKE ではなくインデックスで引ける
+    """
+
+    jma_areas4 = models.OneToOneField(
+        JmaAreas4, primary_key=True, on_delete=models.CASCADE
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(
+                models.F("active_mask").bitand(bit),
+                name=f"city_warning_active_{code}",
+            )
+            for code, bit in WARNING_BITS.items()
+        ]
+
+
+class JmaCityForecast(models.Model):
+    """
+    市区町村(class20)ごとの読み出し用の表。一覧を JOIN なしの1回の走査で返すために、
+    地域の名前・翌日の予報・警報を1行に平らに持つ。
+
+    取り込みのたびに weather.read_model.refresh_city_forecasts で、
+    取り込んだ都道府県の行だけを作り直す
+    """
+
+    jma_areas4 = models.OneToOneField(
+        JmaAreas4, primary_key=True, on_delete=models.CASCADE
+    )
+    city_name = models.CharField(max_length=100)
+    region_code = models.CharField(max_length=6)
+    region_name = models.CharField(max_length=100)
+    prefecture_code = models.CharField(max_length=6)
+    prefecture_name = models.CharField(max_length=100)
+    center_code = models.CharField(max_length=6)
+    center_name = models.CharField(max_length=100)
+    weather_code = models.CharField(max_length=3, null=True)
+    temperature_min = models.FloatField(null=True)
+    temperature_max = models.FloatField(null=True)
+    wind_speed = models.FloatField(null=True)
+    # 市区町村の警報。市区町村単位の発表が無ければリージョンの警報
+    active_mask = WarningMaskField(default=0)
+    warnings = models.CharField(max_length=100)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["prefecture_code", "jma_areas4"],
+                name="city_forecast_prefecture",
+            ),
+            *(
+                models.Index(
+                    models.F("active_mask").bitand(bit),
+                    name=f"city_forecast_active_{code}",
+                )
+                for code, bit in WARNING_BITS.items()
+            ),
+        ]
+
+
+class AmedasObservation(models.Model):
+    """
+    アメダスの10分ごとの観測値。(観測所, 観測時刻) で一意。
+
+    観測所ごとの期間の検索は一意制約の複合インデックスで引く。
+    追記しかしないので、履歴が増えても書き込みは各観測所の末尾への追加で済む
+    """
+
+    # 外部キーの単独のインデックスは、複合インデックスの先頭の列で足りる
+    jma_amedas = models.ForeignKey(JmaAmedas, on_delete=models.CASCADE, db_index=False)
+    observed_at = models.DateTimeField()
+    temperature = models.FloatField(null=True)
+    wind_speed = models.FloatField(null=True)
+    # 16方位。1 が北北東、16 が北
+    wind_direction = models.SmallIntegerField(null=True)
+    precipitation_10m = models.FloatField(null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["jma_amedas", "observed_at"],
+                name="unique_amedas_observation_station_time",
+            )
+        ]
+        # 集計と保持期間の削除は、観測所をまたいで時刻の範囲で引く
+        indexes = [models.Index(fields=["observed_at"], name="amedas_observation_time")]
+
+
+class AmedasSnapshot(models.Model):
+    """
+    取り込み済みの観測時刻。欠けている時刻を、観測値の表をなめずに探すために使う。
+    ingested_at は取り込み直すたびに進むので、集計はそれを見て時刻を集計し直す
+    """
+
+    observed_at = models.DateTimeField(primary_key=True)
+    stations = models.PositiveIntegerField()
+    ingested_at = models.DateTimeField(auto_now=True)
+
+
+class ObservationStats(models.Model):
+    """
+    観測値の集計。samples は集計した観測の数、平均は値のあった観測だけで取る
+    """
+
+    jma_amedas = models.ForeignKey(JmaAmedas, on_delete=models.CASCADE, db_index=False)
+    samples = models.PositiveIntegerField()
+    temperature_min = models.FloatField(null=True)
+    temperature_max = models.FloatField(null=True)
+    temperature_avg = models.FloatField(null=True)
+    wind_speed_max = models.FloatField(null=True)
+    wind_speed_avg = models.FloatField(null=True)
+    precipitation_sum = models.FloatField(null=True)
+
+    class Meta:
+        abstract = True
+
+
+class AmedasObservationHourly(ObservationStats):
+    """1時間ごとの集計。hour は UTC の正時"""
+
+    hour = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["jma_amedas", "hour"], name="unique_amedas_hourly_station_hour"
+            )
+        ]
+        indexes = [models.Index(fields=["hour"], name="amedas_hourly_hour")]
+
+
+class AmedasObservationDaily(ObservationStats):
+    """1日ごとの集計。date は JST の日付"""
+
+    date = models.DateField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["jma_amedas", "date"], name="unique_amedas_daily_station_date"
+            )
+        ]
+        indexes = [models.Index(fields=["date"], name="amedas_daily_date")]
+
+
+class RollupWatermark(models.Model):
+    """
+    集計がどこまで進んだか。AmedasSnapshot.ingested_at がこれより新しい時刻だけを集計し直す
+    """
+
+    name = models.CharField(primary_key=True, max_length=50)
+    position = models.DateTimeField()
+
+
+class ArchivedPayload(models.Model):
+    """
+    取得した応答の索引。本文は weather.archive.PayloadArchive に sha256 ごとに置く。
+    同じ URL で同じ本文を何度取得しても、最初に取得したときの1行だけを持つ
+    """
+
+    url = models.CharField(max_length=200)
+    # forecast / probability / warning / amedas / other と、都道府県コードなど
+    kind = models.CharField(max_length=20)
+    key = models.CharField(max_length=50)
+    sha256 = models.CharField(max_length=64)
+    size = models.PositiveIntegerField()
+    fetched_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["url", "sha256"], name="unique_archived_payload_url_body"
+            )
+        ]
+        indexes = [
+            models.Index(fields=["kind", "fetched_at"], name="archived_payload_kind")
+        ]
+
+
+class Facility(models.Model):
+    """
+    施設。所在する市区町村(JmaAreas4)にひもづく。都道府県は市区町村からたどる。
+
+    施設は利用者の持ち物なので、マスタの同期で市区町村が消えても巻き込まれないよう
+    PROTECT にする。update_jma_master は施設のある市区町村を消さずに残す
+    """
+
+    name = models.CharField(max_length=200)
+    jma_area4 = models.ForeignKey(JmaAreas4, on_delete=models.PROTECT)
+
+
+class JmaDataVersion(models.Model):
+    """
+    取り込んだデータの版。コマンドが書き込むたびに version を上げる。
+    読み出し側はこれをキャッシュのキーと ETag に使う
+    """
+
+    MASTER = "master"
+    FORECAST = "forecast"
+    WARNING = "warning"
+
+    name = models.CharField(primary_key=True, max_length=20)
+    version = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @classmethod
+    def bump(cls, name: str):
+        # data_version は models を読み込むので、循環しないようここで読み込む
+        from weather.data_version import expire
+
+        cls.objects.get_or_create(name=name)
+        cls.objects.filter(name=name).update(
+            version=models.F("version") + 1, updated_at=timezone.now()
+        )
+        # 同じプロセスの索引やキャッシュには、TTL を待たずに新しい版を見せる
+        transaction.on_commit(expire)
+
+    @classmethod
+    def current(cls) -> dict[str, int]:
+        versions = dict.fromkeys([cls.MASTER, cls.FORECAST, cls.WARNING], 0)
+        versions.update(cls.objects.values_list("name", "version"))
+        return versions
@@ -0,0 +1,154 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+
+from weather.area_index import AMEDAS, CITY, REGION, get_area_index
+from weather.data_version import get_versions
+from weather.models import (
+    JmaAreas3,
+    JmaDataVersion,
+    JmaForecast,
+    JmaWarning,
+    JmaWeather,
+)
+from weather.timezone import JST
+
+# コードの桁数で種類がわかる。JmaAreas3: 280010, JmaAreas4: 2820100, JmaAmedas: 63518
+KIND_BY_LENGTH = {6: REGION, 7: CITY, 5: AMEDAS}
+
+
+class LocalCache:
+    """プロセス内の LRU キャッシュ。キーに版を含めるので古い値は自然に追い出される"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_many(self, keys: list[str]) -> dict:
+        found = {}
+        with self.lock:
+            for key in keys:
+                if key in self.items:
+                    self.items.move_to_end(key)
+                    found[key] = self.items[key]
+        return found
+
+    def set_many(self, values: dict):
+        with self.lock:
+            self.items.update(values)
+            for key in values:
+                self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+
+local_cache = LocalCache(settings.WEATHER_API_LOCAL_CACHE_SIZE)
+
+
+def get_version_key() -> str:
+    """
+    取り込みの版をまとめた文字列。daily は今日(JST)からの予報なので、
+    日付が変わったら版が同じでも別のキャッシュにする
+    """
+    versions = get_versions()
+    return (
+        f"m{versions[JmaDataVersion.MASTER]}"
+        f".f{versions[JmaDataVersion.FORECAST]}"
+        f".w{versions[JmaDataVersion.WARNING]}"
+        f".d{datetime.now(JST):%Y%m%d}"
+    )
+
+
+def resolve_region_code(kind: str, code: str) -> str | None:
+    region = get_area_index().region_of(code, kind)
+    return region and region.code
+
+
+def load_region_payloads(region_codes: list[str]) -> dict[str, dict]:
+    """リージョンごとの予報・警報の JSON を、件数にかかわらず数クエリでまとめて作る"""
+    regions = {
+        region["id"]: region
+        for region in JmaAreas3.objects.filter(id__in=region_codes).values(
+            "id", "name", "jma_area2_id", "jma_area2__name"
+        )
+    }
+    weathers = {
+        weather.jma_areas3_id: weather
+        for weather in JmaWeather.objects.filter(jma_areas3_id__in=regions)
+    }
+    warnings = dict(
+        JmaWarning.objects.filter(jma_areas3_id__in=regions).values_list(
+            "jma_areas3_id", "warnings"
+        )
+    )
+    # 履歴は保持期間のあいだ残るので、今日より前の日付は返さない
+    daily = {}
+    for forecast in JmaForecast.objects.filter(
+        jma_areas3_id__in=regions, target_date__gte=datetime.now(JST).date()
+    ).order_by("target_date"):
+        daily.setdefault(forecast.jma_areas3_id, []).append(
+            {
+                "date": forecast.target_date.isoformat(),
+                "weather_code": forecast.weather_code,
+                "temperature_min": forecast.temperature_min,
+                "temperature_max": forecast.temperature_max,
+                "wind_speed": forecast.wind_speed,
+            }
+        )
+
+    payloads = {}
+    for region_code, region in regions.items():
+        weather = weathers.get(region_code)
+        payloads[region_code] = {
+            "region": {"code": region_code, "name": region["name"]},
+            "prefecture": {
+                "code": region["jma_area2_id"],
+                "name": region["jma_area2__name"],
+            },
+            "forecast": weather
+            and {
+                "weather_code": weather.weather_code,
+                "temperature_min": weather.temperature_min,
+                "temperature_max": weather.temperature_max,
+                "wind_speed": weather.wind_speed,
+            },
+            "daily": daily.get(region_code, []),
+            "warnings": (
+                warnings[region_code].split(",") if warnings.get(region_code) else []
+            ),
+        }
+    return payloads
+
+
+def get_region_payloads(region_codes: list[str], version_key: str) -> dict[str, dict]:
+    """
+    プロセス内キャッシュ -> Django のキャッシュ -> DB の順に探す。
+    キーに版を含めるので、取り込みがあれば自動的に読み直される
+    """
+    keys = {
+        region_code: f"weather:region:{version_key}:{region_code}"
+        for region_code in region_codes
+    }
+    found = local_cache.get_many(list(keys.values()))
+
+    missing = [key for key in keys.values() if key not in found]
+    if missing:
+        from_shared = cache.get_many(missing)
+        local_cache.set_many(from_shared)
+        found.update(from_shared)
+
+    missing_codes = [code for code, key in keys.items() if key not in found]
+    if missing_codes:
+        loaded = {
+            keys[code]: payload
+            for code, payload in load_region_payloads(missing_codes).items()
+        }
+        cache.set_many(loaded, settings.WEATHER_API_CACHE_TIMEOUT)
+        local_cache.set_many(loaded)
+        found.update(loaded)
+
+    return {code: found[key] for code, key in keys.items() if key in found}
@@ -0,0 +1,79 @@
+from django.db.models import QuerySet
+
+from weather.models import JmaAreas4, JmaCityForecast
+from weather.sync import SyncResult, sync_rows
+from weather.warning_codes import warning_names
+
+# JmaCityForecast の列のうち、取り込みで変わりうるもの
+CITY_FORECAST_FIELDS = [
+    "city_name",
+    "region_code",
+    "region_name",
+    "prefecture_code",
+    "prefecture_name",
+    "center_code",
+    "center_name",
+    "weather_code",
+    "temperature_min",
+    "temperature_max",
+    "wind_speed",
+    "active_mask",
+    "warnings",
+]
+
+
+def build_city_forecasts(cities: QuerySet) -> list[JmaCityForecast]:
+    """市区町村ごとに、マスタ・予報・警報の5表を1回の JOIN で引いて平らな行にする"""
+    rows = []
+    for city in cities.values(
+        "id",
+        "name",
+        "jma_area3_id",
+        "jma_area3__name",
+        "jma_area2_id",
+        "jma_area2__name",
+        "jma_area2__jma_area1_id",
+        "jma_area2__jma_area1__name",
+        "jma_area3__jmaweather__weather_code",
+        "jma_area3__jmaweather__temperature_min",
+        "jma_area3__jmaweather__temperature_max",
+        "jma_area3__jmaweather__wind_speed",
+        "jma_area3__jmawarning__active_mask",
+        "jmacitywarning__active_mask",
+    ).iterator():
+        active_mask = city["jmacitywarning__active_mask"]
+        if active_mask is None:
+            active_mask = city["jma_area3__jmawarning__active_mask"] or 0
+        rows.append(
+            JmaCityForecast(
+                jma_areas4_id=city["id"],
+                city_name=city["name"],
+                region_code=city["jma_area3_id"],
+                region_name=city["jma_area3__name"],
+                prefecture_code=city["jma_area2_id"],
+                prefecture_name=city["jma_area2__name"],
+                center_code=city["jma_area2__jma_area1_id"],
+                center_name=city["jma_area2__jma_area1__name"],
+                weather_code=city["jma_area3__jmaweather__weather_code"],
+                temperature_min=city["jma_area3__jmaweather__temperature_min"],
+                temperature_max=city["jma_area3__jmaweather__temperature_max"],
+                wind_speed=city["jma_area3__jmaweather__wind_speed"],
+                active_mask=active_mask,
+                warnings=",".join(warning_names(active_mask)),
+            )
+        )
+    return rows
+
+
+def refresh_city_forecasts(prefecture_ids: list[str] = None) -> SyncResult:
+    """
+    prefecture_ids の都道府県の JmaCityForecast を作り直す。None なら全部。
+
+    変わった行だけを書き込むので、取り込みと同じトランザクションの中で呼ぶ
+    """
+    cities = JmaAreas4.objects.all()
+    current = JmaCityForecast.objects.all()
+    if prefecture_ids is not None:
+        cities = cities.filter(jma_area2_id__in=prefecture_ids)
+        current = current.filter(prefecture_code__in=prefecture_ids)
+    return sync_rows(current, build_city_forecasts(cities), CITY_FORECAST_FIELDS)
@@ -0,0 +1,186 @@
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Avg, Count, Max, Min, Model, Sum
+from django.db.models.functions import TruncDate, TruncHour
+from django.utils import timezone
+
+from weather.bulk import get_bulk_loader
+from weather.models import (
+    AmedasObservation,
+    AmedasObservationDaily,
+    AmedasObservationHourly,
+    AmedasSnapshot,
+    JmaForecast,
+    RollupWatermark,
+)
+from weather.timezone import JST
+
+OBSERVATION_WATERMARK = "amedas_observation"
+# 取り込みのトランザクションと入れ違いになった時刻を取りこぼさないよう、
+# 前回の位置から少し戻って集計し直す。集計は何度やっても同じ結果になる
+WATERMARK_OVERLAP = timedelta(minutes=5)
+
+STAT_FIELDS = [
+    "samples",
+    "temperature_min",
+    "temperature_max",
+    "temperature_avg",
+    "wind_speed_max",
+    "wind_speed_avg",
+    "precipitation_sum",
+]
+
+
+def observation_stats() -> dict:
+    return {
+        "samples": Count("id"),
+        "temperature_min": Min("temperature"),
+        "temperature_max": Max("temperature"),
+        "temperature_avg": Avg("temperature"),
+        "wind_speed_max": Max("wind_speed"),
+        "wind_speed_avg": Avg("wind_speed"),
+        "precipitation_sum": Sum("precipitation_10m"),
+    }
+
+
+def contiguous_ranges(starts: list[datetime], step: timedelta, max_steps: int):
+    """並んだ区間の先頭を、連続する [start, end) にまとめる。1つは max_steps 区間まで"""
+    run_start = previous = None
+    steps = 0
+    for start in sorted(starts):
+        if run_start is not None and start == previous + step and steps < max_steps:
+            previous, steps = start, steps + 1
+            continue
+        if run_start is not None:
+            yield run_start, previous + step
+        run_start = previous = start
+        steps = 1
+    if run_start is not None:
+        yield run_start, previous + step
+
+
+class ObservationRollup:
+    """
+    アメダスの観測値を1時間・1日ごとに集計する。
+
+    前回から新しく取り込まれた時刻(AmedasSnapshot.ingested_at で判断する)を含む
+    時間と日だけを、生の観測値から集計し直して upsert する。遅れて埋まった時刻も
+    同じように拾える。範囲ごとに読み出してから短いトランザクションで書くので、
+    書き込みのロックを長く握らない
+    """
+
+    def __init__(self, chunk_hours: int = 24):
+        self.chunk_hours = chunk_hours
+        self.loader = get_bulk_loader()
+        self.hours: set[datetime] = set()
+        self.days: set[date] = set()
+        self.position = None
+        self.hourly_rows = self.daily_rows = 0
+
+    def find_dirty(self):
+        watermark = RollupWatermark.objects.filter(name=OBSERVATION_WATERMARK).first()
+        snapshots = AmedasSnapshot.objects.all()
+        if watermark is not None:
+            self.position = watermark.position
+            snapshots = snapshots.filter(
+                ingested_at__gt=watermark.position - WATERMARK_OVERLAP
+            )
+        for observed_at, ingested_at in snapshots.values_list(
+            "observed_at", "ingested_at"
+        ).iterator():
+            utc = observed_at.astimezone(dt_timezone.utc)
+            self.hours.add(utc.replace(minute=0, second=0, microsecond=0))
+            self.days.add(observed_at.astimezone(JST).date())
+            if self.position is None or ingested_at > self.position:
+                self.position = ingested_at
+
+    def roll_hourly(self):
+        for start, end in contiguous_ranges(
+            list(self.hours), timedelta(hours=1), self.chunk_hours
+        ):
+            rows = [
+                AmedasObservationHourly(**stats)
+                for stats in AmedasObservation.objects.filter(
+                    observed_at__gte=start, observed_at__lt=end
+                )
+                .annotate(hour=TruncHour("observed_at", tzinfo=dt_timezone.utc))
+                .values("jma_amedas_id", "hour")
+                .annotate(**observation_stats())
+                .order_by()
+            ]
+            self.write(AmedasObservationHourly, rows, ["jma_amedas", "hour"])
+            self.hourly_rows += len(rows)
+
+    def roll_daily(self):
+        starts = [datetime.combine(day, time(), JST) for day in self.days]
+        for start, end in contiguous_ranges(
+            starts, timedelta(days=1), max(1, self.chunk_hours // 24)
+        ):
+            rows = [
+                AmedasObservationDaily(**stats)
+                for stats in AmedasObservation.objects.filter(
+                    observed_at__gte=start, observed_at__lt=end
+                )
+                .annotate(date=TruncDate("observed_at", tzinfo=JST))
+                .values("jma_amedas_id", "date")
+                .annotate(**observation_stats())
+                .order_by()
+            ]
+            self.write(AmedasObservationDaily, rows, ["jma_amedas", "date"])
+            self.daily_rows += len(rows)
+
+    def write(self, model: type[Model], rows: list[Model], unique_fields: list[str]):
+        with transaction.atomic():
+            self.loader.upsert(model, rows, unique_fields, STAT_FIELDS)
+
+    def save_position(self):
+        if self.position is not None:
+            RollupWatermark.objects.update_or_create(
+                name=OBSERVATION_WATERMARK, defaults={"position": self.position}
+            )
+
+    def __str__(self):
+        return (
+            f"hours: {len(self.hours)} ({self.hourly_rows} rows), "
+            f"days: {len(self.days)} ({self.daily_rows} rows)"
+        )
+
+
+# settings.WEATHER_RETENTION_DAYS のキー -> 対象のモデルと時刻の列
+RETENTION_TARGETS = [
+    ("observation", AmedasObservation, "observed_at"),
+    ("observation", AmedasSnapshot, "observed_at"),
+    ("observation_hourly", AmedasObservationHourly, "hour"),
+    ("observation_daily", AmedasObservationDaily, "date"),
+    ("forecast", JmaForecast, "target_date"),
+]
+
+
+def delete_before(model: type[Model], field: str, cutoff, batch_size: int) -> int:
+    """cutoff より古い行を batch_size 件ずつ、別々のトランザクションで消す"""
+    deleted = 0
+    old_rows = model.objects.filter(**{f"{field}__lt": cutoff}).order_by(field)
+    while True:
+        pks = list(old_rows.values_list("pk", flat=True)[:batch_size])
+        if not pks:
+            return deleted
+        with transaction.atomic():
+            model.objects.filter(pk__in=pks).delete()
+        deleted += len(pks)
+
+
+def enforce_retention(batch_size: int) -> dict[str, int]:
+    """保持期間を過ぎた行を消す。期間が None の表は消さない"""
+    now = timezone.now()
+    deleted = {}
+    for key, model, field in RETENTION_TARGETS:
+        days = settings.WEATHER_RETENTION_DAYS.get(key)
+        if days is None:
+            continue
+        cutoff = now - timedelta(days=days)
+        if model._meta.get_field(field).get_internal_type() == "DateField":
+            cutoff = cutoff.astimezone(JST).date()
+        deleted[model._meta.label] = delete_before(model, field, cutoff, batch_size)
+    return deleted
@@ -0,0 +1,142 @@
+import random
+import threading
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, time, timedelta
+from typing import Callable
+
+from django.core.management import call_command
+from django.db import connections
+
+from weather.timezone import JST
+
+# 気象庁が天気予報を発表する時刻(JST)
+FORECAST_RELEASE_HOURS = [5, 11, 17]
+
+# 次の実行時刻を待つあいだに、停止や時計の変化を確かめる間隔(秒)
+MAX_SLEEP = 60
+
+
+def daily_at(times: list[time], jitter: float) -> Callable[[datetime], datetime]:
+    """毎日 times(JST)の時刻に、0〜jitter 秒ずらして実行する"""
+
+    def next_run(now: datetime) -> datetime:
+        now = now.astimezone(JST)
+        candidates = [
+            datetime.combine(now.date() + timedelta(days=days), at, tzinfo=JST)
+            for days in (0, 1)
+            for at in times
+        ]
+        upcoming = min(candidate for candidate in candidates if candidate > now)
+        return upcoming + timedelta(seconds=random.uniform(0, jitter))
+
+    return next_run
+
+
+def every(interval: float, jitter: float) -> Callable[[datetime], datetime]:
+    """interval 秒ごとに、0〜jitter 秒ずらして実行する"""
+
+    def next_run(now: datetime) -> datetime:
+        return now + timedelta(seconds=interval + random.uniform(0, jitter))
+
+    return next_run
+
+
+class Job:
+    """
+    定期的に実行する管理コマンド。
+
+    ジョブごとに1スレッドの executor を持つので、同じジョブは重ならず、
+    時間のかかるジョブがいてもほかのジョブの起動は遅れない
+    """
+
+    def __init__(
+        self,
+        name: str,
+        command: str,
+        schedule: Callable[[datetime], datetime],
+        options: dict | None = None,
+    ):
+        self.name = name
+        self.command = command
+        self.schedule = schedule
+        self.options = options or {}
+        self.next_run: datetime | None = None
+        self.future: Future | None = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+
+    @property
+    def running(self) -> bool:
+        return self.future is not None and not self.future.done()
+
+
+def discard_unusable_connections():
+    """
+    常駐中に切れた DB 接続だけを閉じる。使える接続はそのまま使い回す。
+
+    Django はリクエストの区切りで接続を片付けるが、常駐プロセスには区切りがない
+    """
+    for connection in connections.all(initialized_only=True):
+        if connection.connection is not None and not connection.is_usable():
+            connection.close()
+
+
+class Scheduler:
+    """
+    ジョブを時刻どおりに起動し続ける。1プロセスに常駐するので、
+    client(JmaClient)の接続プールや索引、DB 接続はジョブをまたいで使い回される。
+
+    どのジョブも DB に書き込む。SQLite は読んでから書くトランザクションが重なると
+    busy_timeout を待たずに database is locked で失敗するので、コマンドは
+    write_lock で1つずつ実行する
+    """
+
+    def __init__(self, jobs: list[Job], client, log: Callable[[str], None]):
+        self.jobs = jobs
+        self.client = client
+        self.log = log
+        self.stopped = threading.Event()
+        self.write_lock = threading.Lock()
+
+    def run(self, run_now: bool = False):
+        now = datetime.now(JST)
+        for job in self.jobs:
+            job.next_run = now if run_now else job.schedule(now)
+            self.log(f"{job.name}: next run at {job.next_run:%Y-%m-%d %H:%M:%S %Z}")
+
+        while not self.stopped.is_set():
+            job = min(self.jobs, key=lambda item: item.next_run)
+            wait = (job.next_run - datetime.now(JST)).total_seconds()
+            if wait > 0:
+                self.stopped.wait(min(wait, MAX_SLEEP))
+                continue
+
+            if job.running:
+                self.log(f"{job.name}: skipped, the previous run is still running")
+            else:
+                job.future = job.executor.submit(self.execute, job)
+            job.next_run = job.schedule(datetime.now(JST))
+
+        self.log("stopping: waiting for running jobs")
+        for job in self.jobs:
+            job.executor.shutdown(wait=True)
+
+    def stop(self):
+        self.stopped.set()
+
+    def execute(self, job: Job):
+        if not self.write_lock.acquire(blocking=False):
+            self.log(f"{job.name}: waiting for the running job to finish")
+            self.write_lock.acquire()
+        try:
+            discard_unusable_connections()
+            self.log(f"{job.name}: started")
+            try:
+                call_command(job.command, client=self.client, **job.options)
+            except (Exception, SystemExit):
+                # 1回の失敗で常駐をやめない。次の時刻にまた試す
+                self.log(f"{job.name}: failed\n{traceback.format_exc()}")
+            else:
+                self.log(f"{job.name}: finished")
+        finally:
+            self.write_lock.release()
@@ -0,0 +1,231 @@
+import threading
+from typing import NamedTuple
+
+import numpy as np
+
+from weather.data_version import get_versions
+from weather.models import JmaAmedas, JmaDataVersion
+
+# 地球の平均半径(km)
+EARTH_RADIUS_KM = 6371.0088
+# 葉に入れる観測所の数の上限
+LEAF_SIZE = 32
+# 一括検索で一度に作る 地点 × 葉 の表の要素数の上限
+QUERY_CHUNK_CELLS = 1 << 20
+
+
+class Neighbor(NamedTuple):
+    code: str
+    region_code: str | None
+    distance_km: float
+
+
+class Nearest(NamedTuple):
+    """nearest_many の結果。どれも (地点数, k) の配列で、近い順に並ぶ"""
+
+    codes: np.ndarray
+    region_codes: np.ndarray
+    distances_km: np.ndarray
+
+
+def to_unit_vectors(lats, lons) -> np.ndarray:
+    """緯度経度(度)を単位球上の (x, y, z) にする"""
+    lat = np.radians(np.atleast_1d(np.asarray(lats, dtype=float)))
+    lon = np.radians(np.atleast_1d(np.asarray(lons, dtype=float)))
+    cos_lat = np.cos(lat)
+    return np.column_stack([cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)])
+
+
+def chord_to_km(chord):
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(np.asarray(chord) / 2, 1.0))
+
+
+def km_to_chord(distance_km: float) -> float:
+    return 2 * np.sin(min(distance_km / (2 * EARTH_RADIUS_KM), np.pi / 2))
+
+
+class StationIndex:
+    """
+    観測所の位置の KD 木。
+
+    緯度経度を単位球上の3次元の点にして、広がりの最も大きい軸の中央値で
+    葉が leaf_size 件以下になるまで分ける。2点を結ぶ弦の長さは大圏距離と
+    同じ順に並ぶので、近さは3次元のユークリッド距離で比べられる。
+
+    検索は地点をまとめて numpy で行う。地点ごとに各葉の外接箱までの距離を出し、
+    近い葉から順に、それまでの k 番目より近い点がありうる葉だけを調べる
+    """
+
+    def __init__(self, codes, region_codes, lats, lons, leaf_size: int = LEAF_SIZE):
+        points = to_unit_vectors(lats, lons) if len(codes) else np.empty((0, 3))
+        leaves = []
+        stack = [np.arange(len(points))] if len(points) else []
+        while stack:
+            members = stack.pop()
+            if len(members) <= leaf_size:
+                leaves.append(members)
+                continue
+            coords = points[members]
+            axis = np.argmax(np.ptp(coords, axis=0))
+            members = members[np.argsort(coords[:, axis], kind="stable")]
+            half = len(members) // 2
+            stack.append(members[half:])
+            stack.append(members[:half])
+
+        # 葉ごとに観測所が連続するよう並べ直し、葉は [offsets[i], offsets[i+1]) で引く
+        order = np.concatenate(leaves) if leaves else np.empty(0, dtype=int)
+        self.codes = np.asarray(codes, dtype=object)[order]
+        self.region_codes = np.asarray(region_codes, dtype=object)[order]
+        self.points = points[order]
+        self.leaf_offsets = np.cumsum([0] + [len(leaf) for leaf in leaves])
+        self.leaf_lower = np.array(
+            [points[leaf].min(axis=0) for leaf in leaves]
+        ).reshape(-1, 3)
+        self.leaf_upper = np.array(
+            [points[leaf].max(axis=0) for leaf in leaves]
+        ).reshape(-1, 3)
+        self.chunk_size = max(1, QUERY_CHUNK_CELLS // max(1, len(leaves)))
+
+    def __len__(self):
+        return len(self.codes)
+
+    def nearest(self, lat: float, lon: float, k: int = 1) -> list[Neighbor]:
+        found = self.nearest_many([lat], [lon], k)
+        return [
+            Neighbor(code, region_code, float(distance))
+            for code, region_code, distance in zip(
+                found.codes[0], found.region_codes[0], found.distances_km[0]
+            )
+        ]
+
+    def nearest_many(self, lats, lons, k: int = 1) -> Nearest:
+        """地点ごとに近い順 k 件の観測所。観測所が k 件に満たなければあるだけ返す"""
+        queries = to_unit_vectors(lats, lons)
+        k = min(k, len(self))
+        positions = np.empty((len(queries), k), dtype=int)
+        chords = np.empty((len(queries), k))
+        for start in range(0, len(queries), self.chunk_size):
+            chunk = slice(start, start + self.chunk_size)
+            chords[chunk], positions[chunk] = self._nearest_chunk(queries[chunk], k)
+        return Nearest(
+            self.codes[positions],
+            self.region_codes[positions],
+            chord_to_km(chords),
+        )
+
+    def within(self, lat: float, lon: float, radius_km: float) -> list[Neighbor]:
+        return self.within_many([lat], [lon], radius_km)[0]
+
+    def within_many(self, lats, lons, radius_km: float) -> list[list[Neighbor]]:
+        """地点ごとに、radius_km 以内の観測所を近い順に"""
+        queries = to_unit_vectors(lats, lons)
+        radius = km_to_chord(radius_km)
+        hits = [[] for _ in range(len(queries))]
+        for start in range(0, len(queries), self.chunk_size):
+            chunk = queries[start : start + self.chunk_size]
+            box = self._box_distances(chunk)
+            for leaf in range(len(self.leaf_offsets) - 1):
+                rows = np.flatnonzero(box[:, leaf] <= radius)
+                if not len(rows):
+                    continue
+                first = self.leaf_offsets[leaf]
+                distances = self._distances(chunk[rows], leaf)
+                for row, column in zip(*np.nonzero(distances <= radius)):
+                    hits[start + rows[row]].append(
+                        (distances[row, column], first + column)
+                    )
+        return [
+            [
+                Neighbor(
+                    self.codes[position],
+                    self.region_codes[position],
+                    float(chord_to_km(chord)),
+                )
+                for chord, position in sorted(found)
+            ]
+            for found in hits
+        ]
+
+    def _box_distances(self, queries: np.ndarray) -> np.ndarray:
+        """(地点数, 葉の数) の、地点から各葉の外接箱までの距離。箱の中なら 0"""
+        gap = np.maximum(self.leaf_lower[None] - queries[:, None], 0) + np.maximum(
+            queries[:, None] - self.leaf_upper[None], 0
+        )
+        return np.sqrt((gap**2).sum(axis=2))
+
+    def _distances(self, queries: np.ndarray, leaf: int) -> np.ndarray:
+        points = self.points[self.leaf_offsets[leaf] : self.leaf_offsets[leaf + 1]]
+        return np.linalg.norm(queries[:, None] - points[None], axis=2)
+
+    def _nearest_chunk(self, queries: np.ndarray, k: int):
+        best = np.full((len(queries), k), np.inf)
+        best_positions = np.full((len(queries), k), -1)
+        if not k:
+            return best, best_positions
+        box = self._box_distances(queries)
+        ranked = np.argsort(box, axis=1)
+        everyone = np.arange(len(queries))
+        for rank in range(ranked.shape[1]):
+            leaves = ranked[:, rank]
+            # この順位の葉の箱が、今の k 番目より遠い地点はもう調べなくてよい
+            active = box[everyone, leaves] < best[:, -1]
+            if not active.any():
+                break
+            for leaf in np.unique(leaves[active]):
+                rows = np.flatnonzero(active & (leaves == leaf))
+                first = self.leaf_offsets[leaf]
+                distances = self._distances(queries[rows], leaf)
+                candidates = np.concatenate([best[rows], distances], axis=1)
+                candidate_positions = np.concatenate(
+                    [
+                        best_positions[rows],
+                        np.broadcast_to(
+                            np.arange(first, first + distances.shape[1]),
+                            distances.shape,
+                        ),
+                    ],
+                    axis=1,
+                )
+                picked = np.argsort(candidates, axis=1, kind="stable")[:, :k]
+                best[rows] = np.take_along_axis(candidates, picked, axis=1)
+                best_positions[rows] = np.take_along_axis(
+                    candidate_positions, picked, axis=1
+                )
+        return best, best_positions
+
+
+def load_station_index(regions_only: bool = False) -> StationIndex:
+    stations = JmaAmedas.objects.filter(lat__isnull=False, lon__isnull=False)
+    if regions_only:
+        stations = stations.filter(jma_area3__isnull=False)
+    rows = list(stations.order_by("id").values_list("id", "jma_area3_id", "lat", "lon"))
+    codes, region_codes, lats, lons = zip(*rows) if rows else ((), (), (), ())
+    return StationIndex(codes, region_codes, lats, lons)
+
+
+_current: dict[bool, tuple[int, StationIndex]] = {}
+_lock = threading.Lock()
+
+
+def get_station_index(regions_only: bool = False) -> StationIndex:
+    """
+    プロセスで共有する観測所の索引。regions_only なら予報のリージョンを持つ観測所だけ。
+    area_index と同じく、マスタの版が上がったら作り直す
+    """
+    master_version = get_versions()[JmaDataVersion.MASTER]
+    cached = _current.get(regions_only)
+    if cached is None or cached[0] != master_version:
+        with _lock:
+            cached = _current.get(regions_only)
+            if cached is None or cached[0] != master_version:
+                cached = (master_version, load_station_index(regions_only))
+                _current[regions_only] = cached
+    return cached[1]
+
+
+def nearest_regions(lats, lons) -> np.ndarray:
+    """地点ごとに、最寄りの観測所の属するリージョン(JmaAreas3)のコード"""
+    index = get_station_index(regions_only=True)
+    if not len(index):
+        return np.full(len(np.atleast_1d(lats)), None, dtype=object)
+    return index.nearest_many(lats, lons).region_codes[:, 0]
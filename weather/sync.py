@@ -0,0 +1,168 @@
+from django.db.models import Model, QuerySet
+
+from weather.bulk import get_bulk_loader
+
+
+def upsert_rows(model: type[Model], rows: list[Model], fields: list[str]):
+    """増えた行と変わった行を、主キーで突き合わせる1回の upsert でまとめて書く"""
+    get_bulk_loader().upsert(model, rows, [model._meta.pk.name], fields)
+
+
+class SyncResult:
+    def __init__(self, created: int = 0, updated: int = 0, deleted: int = 0):
+        self.created = created
+        self.updated = updated
+        self.deleted = deleted
+
+    @property
+    def written(self) -> int:
+        return self.created + self.updated + self.deleted
+
+    def __add__(self, other: "SyncResult") -> "SyncResult":
+        return SyncResult(
+            self.created + other.created,
+            self.updated + other.updated,
+            self.deleted + other.deleted,
+        )
+
+    def __str__(self):
+        return (
+            f"created: {self.created}, updated: {self.updated}, "
+            f"deleted: {self.deleted}"
+        )
+
+
+class RowDiff:
+    """
+    queryset の範囲にある行と rows との差分。
+
+    主キーで突き合わせて、増えた行は to_create、fields のどれかが変わった行は
+    to_update、rows に無い行の主キーは stale_pks に振り分ける。
+    変わっていない行はどこにも入らないので書き込まれない
+    """
+
+    def __init__(self, queryset: QuerySet, rows: list[Model], fields: list[str]):
+        self.model = queryset.model
+        self.fields = fields
+        current = {obj.pk: obj for obj in queryset}
+
+        self.to_create, self.to_update = [], []
+        for row in rows:
+            existing = current.pop(row.pk, None)
+            if existing is None:
+                self.to_create.append(row)
+            elif any(
+                getattr(existing, field) != getattr(row, field) for field in fields
+            ):
+                self.to_update.append(row)
+        self.stale_pks = list(current)
+        self.deleted = 0
+
+    def save(self):
+        upsert_rows(self.model, self.to_create + self.to_update, self.fields)
+
+    def delete(self):
+        if self.stale_pks:
+            _, deleted_by_model = self.model.objects.filter(
+                pk__in=self.stale_pks
+            ).delete()
+            self.deleted = deleted_by_model.get(self.model._meta.label, 0)
+
+    def result(self) -> SyncResult:
+        return SyncResult(len(self.to_create), len(self.to_update), self.deleted)
+
+
+def sync_rows(queryset: QuerySet, rows: list[Model], fields: list[str]) -> SyncResult:
+    """
+    queryset の範囲にある行を rows と同じ内容にそろえる。
+
+    読み手に途中の状態を見せないよう、呼び出し側で transaction.atomic() に入れること
+    """
+    diff = RowDiff(queryset, rows, fields)
+    diff.save()
+    diff.delete()
+    return diff.result()
+
+
+class BatchedSync:
+    """
+    queryset の範囲にある行を、流れてくる行と同じ内容にそろえる。
+
+    add() された行を batch_size 件ずつ in_bulk で突き合わせて書き込むので、
+    手元に持つのは1バッチ分の行と、出てきた主キーの集合だけ。
+    最後まで流し終えたら delete_stale() で出てこなかった行を消す
+    """
+
+    def __init__(self, queryset: QuerySet, fields: list[str], batch_size: int = 500):
+        self.queryset = queryset
+        self.model = queryset.model
+        self.fields = fields
+        self.batch_size = batch_size
+        self.pending: dict = {}
+        self.seen: set = set()
+        self.created = self.updated = self.deleted = 0
+
+    def __contains__(self, pk) -> bool:
+        return pk in self.seen or pk in self.pending
+
+    def add(self, row: Model):
+        self.pending[row.pk] = row
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        current = self.queryset.in_bulk(list(self.pending))
+        to_create, to_update = [], []
+        for pk, row in self.pending.items():
+            existing = current.get(pk)
+            if existing is None:
+                to_create.append(row)
+            elif any(
+                getattr(existing, field) != getattr(row, field) for field in self.fields
+            ):
+                to_update.append(row)
+        upsert_rows(self.model, to_create + to_update, self.fields)
+        self.created += len(to_create)
+        self.updated += len(to_update)
+        self.seen.update(self.pending)
+        self.pending = {}
+
+    def keep(self, pks):
+        """pks の行は、流れてこなくても delete_stale() で消さない"""
+        self.seen.update(pks)
+
+    def delete_stale(self):
+        self.flush()
+        stale_pks = [
+            pk
+            for pk in self.queryset.values_list("pk", flat=True).iterator()
+            if pk not in self.seen
+        ]
+        for start in range(0, len(stale_pks), self.batch_size):
+            _, deleted_by_model = self.model.objects.filter(
+                pk__in=stale_pks[start : start + self.batch_size]
+            ).delete()
+            self.deleted += deleted_by_model.get(self.model._meta.label, 0)
+
+    def result(self) -> SyncResult:
+        return SyncResult(self.created, self.updated, self.deleted)
+
+
+def finish_hierarchy(syncs: list[BatchedSync]) -> SyncResult:
+    """
+    親子関係のある BatchedSync をまとめて締める。syncs は親から順に並べること。
+
+    残りの書き込みは親から、削除は子から行う。付け替えられた子が親の削除に
+    巻き込まれて CASCADE で消えることがないようにするため
+    """
+    for sync in syncs:
+        sync.flush()
+    for sync in reversed(syncs):
+        sync.delete_stale()
+
+    result = SyncResult()
+    for sync in syncs:
+        result += sync.result()
+    return result
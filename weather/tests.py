@@ -1,3 +1,1641 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import tempfile
+import threading
+from datetime import date, datetime, time, timedelta
+from pathlib import Path
+from time import sleep
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from weather.events import (
+    ISSUED,
+    LIFTED,
+    EventDispatcher,
+    WebhookSink,
+    diff_warnings,
+)
+from weather import area_index, data_version, jma_json
+from weather.area_index import (
+    AMEDAS,
+    CENTER,
+    CITY,
+    PREFECTURE,
+    REGION,
+    Area,
+    AreaIndex,
+)
+from weather.archive import PayloadArchive
+from weather.aggregation import TemperatureAggregation, WindSpeedAggregation
+from weather.bulk import SqliteBulkLoader, get_bulk_loader
+from weather.ingest import resolve_prefecture_ids
+from weather.jma_client import (
+    JmaClient,
+    JmaResponse,
+    ResponseCache,
+    forecast_url,
+    probability_url,
+    warning_url,
+)
+from weather.management.commands.fetch_weather_forecast import (
+    Command as ForecastCommand,
+    PrefectureForecast,
+)
+from weather.management.commands.replay_archive import Command as ReplayCommand
+from weather.management.commands.update_jma_master import MasterSync
+from weather.management.commands.run_weather_scheduler import (
+    Command as SchedulerCommand,
+)
+from weather.models import (
+    AmedasObservation,
+    AmedasObservationDaily,
+    AmedasObservationHourly,
+    AmedasSnapshot,
+    ArchivedPayload,
+    JmaAmedas,
+    JmaAreas1,
+    JmaAreas2,
+    JmaAreas3,
+    JmaAreas4,
+    JmaCityWarning,
+    JmaDataVersion,
+    JmaForecast,
+    JmaWarning,
+    JmaWeather,
+    RollupWatermark,
+)
+from weather.payloads import local_cache
+from weather.rollup import (
+    OBSERVATION_WATERMARK,
+    STAT_FIELDS,
+    ObservationRollup,
+    enforce_retention,
+)
+from weather.scheduler import Job, Scheduler, every
+from weather.spatial import StationIndex, chord_to_km, to_unit_vectors
+from weather.sync import BatchedSync, sync_rows
+from weather.timezone import JST
+from weather.warning_codes import (
+    WARNING_BITS,
+    WarningMasks,
+    parse_warnings,
+    warning_codes,
+    warning_names,
+)
+
+
+class StubServer:
+    """
+    テスト用のローカル HTTP サーバ。handle(method, path, headers, body) が
+    (status, headers, body) を返す。受けたリクエストは requests に残す
+    """
+
+    def __init__(self, handle):
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def respond(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                stub.requests.append((self.command, self.path, self.headers, body))
+                status, headers, content = handle(
+                    self.command, self.path, self.headers, body
+                )
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            do_GET = do_POST = respond
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def create_areas():
+    """兵庫県の 南部 / 北部 と、その市区町村を1つずつ作る"""
+    JmaAreas1.objects.create(id="010600", name="近畿地方")
+    JmaAreas2.objects.create(id="280000", jma_area1_id="010600", name="兵庫県")
+    JmaAreas3.objects.bulk_create(
+        [
+            JmaAreas3(id="280010", jma_area2_id="280000", name="南部"),
+            JmaAreas3(id="280020", jma_area2_id="280000", name="北部"),
+        ]
+    )
+    JmaAreas4.objects.bulk_create(
+        [
+            JmaAreas4(
+                id="2820100",
+                jma_area2_id="280000",
+                jma_area3_id="280010",
+                name="姫路市",
+            ),
+            JmaAreas4(
+                id="2820900",
+                jma_area2_id="280000",
+                jma_area3_id="280020",
+                name="豊岡市",
+            ),
+        ]
+    )
+
+
+class SchedulerTests(SimpleTestCase):
+    def test_every_job_accepts_the_shared_client(self):
+        command = SchedulerCommand()
+        parser = command.create_parser("manage.py", "run_weather_scheduler")
+        options = vars(parser.parse_args([]))
+        jobs = command.build_jobs(options, time(4, 30), time(3, 30))
+        logs = []
+        scheduler = Scheduler(jobs, client=object(), log=logs.append)
+
+        # コマンドの本体は動かさず、call_command がオプションを受け付けるかだけを見る
+        with mock.patch.object(BaseCommand, "execute") as execute:
+            for job in jobs:
+                scheduler.execute(job)
+
+        self.assertEqual(execute.call_count, len(jobs))
+        self.assertEqual(
+            [message for message in logs if message.endswith("finished")],
+            [f"{job.name}: finished" for job in jobs],
+        )
+
+    def test_jobs_do_not_overlap(self):
+        jobs = [Job(name, name, every(60, 0)) for name in ("warning", "master")]
+        logs, running, overlapped = [], [], []
+        started, waiting = threading.Event(), threading.Event()
+
+        def log(message: str):
+            logs.append(message)
+            if message.endswith("waiting for the running job to finish"):
+                waiting.set()
+
+        def write(command, **options):
+            running.append(command)
+            overlapped.append(len(running) > 1)
+            started.set()
+            # 2つ目のジョブが書き込みの順番を待ち始めるまで書き続ける
+            waiting.wait(5)
+            running.remove(command)
+
+        scheduler = Scheduler(jobs, client=object(), log=log)
+        with mock.patch("weather.scheduler.call_command", write):
+            first = threading.Thread(target=scheduler.execute, args=[jobs[0]])
+            first.start()
+            started.wait(5)
+            second = threading.Thread(target=scheduler.execute, args=[jobs[1]])
+            second.start()
+            first.join()
+            second.join()
+
+        self.assertTrue(waiting.is_set())
+        self.assertEqual(overlapped, [False, False])
+        self.assertEqual(
+            [message for message in logs if message.endswith("finished")],
+            ["warning: finished", "master: finished"],
+        )
+
+
+class ResolvePrefectureIdsTests(TestCase):
+    options = {"all": False, "prefectures": None, "concurrency": 1, "budget": 1.0}
+
+    def test_no_facility_is_an_error(self):
+        with self.assertRaisesMessage(CommandError, "no facility is registered"):
+            resolve_prefecture_ids(self.options)
+
+    def test_empty_master_is_an_error(self):
+        with self.assertRaisesMessage(CommandError, "JmaAreas2 is empty"):
+            resolve_prefecture_ids({**self.options, "all": True})
+
+
+class SyncTests(TestCase):
+    def setUp(self):
+        JmaAreas1.objects.bulk_create(
+            [
+                JmaAreas1(id="010100", name="北海道地方"),
+                JmaAreas1(id="010200", name="東北地方"),
+                JmaAreas1(id="010300", name="関東甲信地方"),
+            ]
+        )
+
+    def assertAreas(self, expected: dict[str, str]):
+        self.assertEqual(dict(JmaAreas1.objects.values_list("id", "name")), expected)
+
+    def test_sync_rows_creates_updates_and_deletes(self):
+        result = sync_rows(
+            JmaAreas1.objects.all(),
+            [
+                JmaAreas1(id="010100", name="北海道地方"),
+                JmaAreas1(id="010200", name="東北"),
+                JmaAreas1(id="010400", name="東海地方"),
+            ],
+            ["name"],
+        )
+
+        self.assertEqual((result.created, result.updated, result.deleted), (1, 1, 1))
+        self.assertAreas(
+            {"010100": "北海道地方", "010200": "東北", "010400": "東海地方"}
+        )
+
+    def test_sync_rows_writes_nothing_when_unchanged(self):
+        rows = list(JmaAreas1.objects.all())
+        self.assertEqual(sync_rows(JmaAreas1.objects.all(), rows, ["name"]).written, 0)
+
+    def test_sync_rows_only_touches_the_queryset(self):
+        result = sync_rows(
+            JmaAreas1.objects.filter(id="010100"),
+            [JmaAreas1(id="010100", name="北海道")],
+            ["name"],
+        )
+
+        self.assertEqual((result.updated, result.deleted), (1, 0))
+        self.assertEqual(JmaAreas1.objects.count(), 3)
+
+    def test_batched_sync_across_batches(self):
+        sync = BatchedSync(JmaAreas1.objects.all(), ["name"], batch_size=2)
+        for code, name in [
+            ("010100", "北海道地方"),
+            ("010300", "関東"),
+            ("010400", "東海地方"),
+            ("010500", "北陸地方"),
+        ]:
+            sync.add(JmaAreas1(id=code, name=name))
+        sync.delete_stale()
+
+        result = sync.result()
+        self.assertEqual((result.created, result.updated, result.deleted), (2, 1, 1))
+        self.assertAreas(
+            {
+                "010100": "北海道地方",
+                "010300": "関東",
+                "010400": "東海地方",
+                "010500": "北陸地方",
+            }
+        )
+
+    def test_batched_sync_keeps_rows(self):
+        sync = BatchedSync(JmaAreas1.objects.all(), ["name"])
+        sync.add(JmaAreas1(id="010100", name="北海道地方"))
+        sync.keep(["010200"])
+        sync.delete_stale()
+
+        self.assertEqual(sync.result().deleted, 1)
+        self.assertAreas({"010100": "北海道地方", "010200": "東北地方"})
+
+
+class WarningCodeTests(TestCase):
+    def test_parse_warnings(self):
+        masks = parse_warnings(
+            [
+                {"code": "03", "status": "発表"},
+                {"code": "10", "status": "継続"},
+                {"code": "14", "status": "解除"},
+                {"code": "15", "status": "警報から注意報"},
+                # 対象外のコードは無視する
+                {"code": "99", "status": "発表"},
+            ]
+        )
+
+        bits = WARNING_BITS
+        self.assertEqual(
+            masks,
+            WarningMasks(
+                active=bits["03"] | bits["10"] | bits["15"],
+                issued=bits["03"],
+                continued=bits["10"],
+                cancelled=bits["14"],
+            ),
+        )
+        self.assertEqual(warning_codes(masks.active), ["03", "10", "15"])
+        self.assertEqual(
+            warning_names(masks.active), ["大雨警報", "大雨注意報", "強風注意報"]
+        )
+
+    def test_has_warning_lookup(self):
+        create_areas()
+        JmaCityWarning.objects.bulk_create(
+            [
+                JmaCityWarning(
+                    jma_areas4_id="2820100",
+                    **parse_warnings([{"code": "03", "status": "発表"}]).as_fields(),
+                ),
+                JmaCityWarning(
+                    jma_areas4_id="2820900",
+                    **parse_warnings([{"code": "10", "status": "発表"}]).as_fields(),
+                ),
+            ]
+        )
+
+        def cities(code: str) -> list[str]:
+            return list(
+                JmaCityWarning.objects.filter(active_mask__has_warning=code)
+                .order_by("pk")
+                .values_list("pk", flat=True)
+            )
+
+        self.assertEqual(cities("03"), ["2820100"])
+        self.assertEqual(cities("10"), ["2820900"])
+        self.assertEqual(cities("14"), [])
+        with self.assertRaises(ValueError):
+            cities("99")
+
+
+class DiffWarningsTests(SimpleTestCase):
+    def summarize(self, events: list[dict]) -> list[tuple]:
+        return [(event["type"], event["area"], event["warning"]) for event in events]
+
+    def test_issued_and_lifted(self):
+        bits = WARNING_BITS
+        events = diff_warnings(
+            "city",
+            {"2820100": bits["03"] | bits["10"], "2820900": bits["14"]},
+            {"2820100": bits["03"] | bits["15"]},
+            {"2820100": "2026-10-18T05:00:00+09:00"},
+        )
+
+        self.assertEqual(
+            self.summarize(events),
+            [
+                (ISSUED, "2820100", "15"),
+                (LIFTED, "2820100", "10"),
+                # 今回の発表に無い地域は、警報がすべて消えたとみなす
+                (LIFTED, "2820900", "14"),
+            ],
+        )
+        self.assertEqual(events[0]["name"], "強風注意報")
+        self.assertEqual(events[0]["reported_at"], "2026-10-18T05:00:00+09:00")
+        self.assertIsNone(events[2]["reported_at"])
+
+    def test_unchanged_areas_emit_nothing(self):
+        mask = WARNING_BITS["03"]
+        self.assertEqual(
+            diff_warnings("region", {"280010": mask}, {"280010": mask}, {}), []
+        )
+
+    def test_areas_without_previous_state_emit_nothing(self):
+        # 空の表への最初の取り込みで、出ている警報を issued として送らない
+        self.assertEqual(
+            diff_warnings("region", {}, {"280010": WARNING_BITS["03"]}, {}), []
+        )
+
+
+class EventDispatcherTests(SimpleTestCase):
+    def test_webhook_receives_batches(self):
+        with StubServer(lambda *request: (204, {}, b"")) as receiver:
+            dispatcher = EventDispatcher(
+                [WebhookSink(f"{receiver.url}/events")],
+                batch_size=2,
+                flush_interval=0.05,
+            )
+            dispatcher.emit([{"n": n} for n in range(3)])
+            dispatcher.close()
+
+        received = [json.loads(body) for _, path, _, body in receiver.requests]
+        self.assertEqual(sum(received, []), [{"n": 0}, {"n": 1}, {"n": 2}])
+        self.assertTrue(all(len(batch) <= 2 for batch in received))
+        self.assertEqual({path for _, path, _, _ in receiver.requests}, {"/events"})
+
+    def test_a_failing_sink_does_not_stop_the_others(self):
+        delivered = []
+
+        class ListSink:
+            def send(self, events):
+                delivered.extend(events)
+
+        with StubServer(lambda *request: (500, {}, b"")) as receiver:
+            dispatcher = EventDispatcher(
+                [WebhookSink(receiver.url), ListSink()], flush_interval=0.05
+            )
+            with self.assertLogs("weather.events", "ERROR"):
+                dispatcher.emit([{"n": 0}])
+                dispatcher.close()
+
+        self.assertEqual(delivered, [{"n": 0}])
+
+
+class IterItemsTests(SimpleTestCase):
+    document = {
+        "centers": {"010100": {"name": "北海道地方", "children": ["011000"]}},
+        "offices": {
+            "011000": {"name": "宗谷地方", "officeName": "稚内地方気象台"},
+            "280000": {"name": "兵庫県", "temp": [12.5, -3, 1e3], "ok": True},
+        },
+        "empty": {},
+        "scalar": None,
+    }
+
+    def chunked(self, content: bytes, size: int) -> list[bytes]:
+        return [content[i : i + size] for i in range(0, len(content), size)]
+
+    def test_matches_json_loads_across_chunk_boundaries(self):
+        content = json.dumps(self.document, ensure_ascii=False, indent=1).encode()
+        expected = [
+            ((group, key), value)
+            for group, children in self.document.items()
+            if isinstance(children, dict)
+            for key, value in children.items()
+        ]
+        # 1〜3 バイトずつ渡し、マルチバイト文字や数値がチャンクの境目で切れても読めること
+        for size in (1, 2, 3, len(content)):
+            with self.subTest(size=size):
+                items = list(jma_json.iter_items(self.chunked(content, size), 2))
+                self.assertEqual(items, expected)
+
+    def test_lists_are_indexed(self):
+        content = b'[{"a": 1}, {"b": [2, 3]}]'
+        self.assertEqual(
+            list(jma_json.iter_items(self.chunked(content, 1), 1)),
+            [((0,), {"a": 1}), ((1,), {"b": [2, 3]})],
+        )
+
+    def test_broken_json_is_an_error(self):
+        with self.assertRaises(ValueError):
+            list(jma_json.iter_items([b'{"a": 1 "b": 2}'], 1))
+
+
+class StationIndexTests(SimpleTestCase):
+    def setUp(self):
+        # 日本の周りにばらまいた観測所。葉を小さくして木を深くする
+        random = np.random.default_rng(0)
+        self.lats = random.uniform(24, 46, 500)
+        self.lons = random.uniform(122, 146, 500)
+        self.codes = [f"{i:05d}" for i in range(500)]
+        self.index = StationIndex(
+            self.codes, [f"r{i % 7}" for i in range(500)], self.lats, self.lons, 4
+        )
+        self.queries = list(
+            zip(random.uniform(20, 50, 50), random.uniform(118, 150, 50))
+        )
+
+    def brute_force(self, lat: float, lon: float) -> np.ndarray:
+        """全観測所までの距離(km)"""
+        points = to_unit_vectors(self.lats, self.lons)
+        return chord_to_km(np.linalg.norm(points - to_unit_vectors(lat, lon), axis=1))
+
+    def test_nearest_matches_brute_force(self):
+        for lat, lon in self.queries:
+            distances = self.brute_force(lat, lon)
+            order = np.argsort(distances, kind="stable")[:5]
+            found = self.index.nearest(lat, lon, k=5)
+            self.assertEqual([n.code for n in found], [self.codes[i] for i in order])
+            np.testing.assert_allclose([n.distance_km for n in found], distances[order])
+
+    def test_nearest_many_matches_nearest(self):
+        lats, lons = zip(*self.queries)
+        found = self.index.nearest_many(lats, lons, k=3)
+        for row, (lat, lon) in enumerate(self.queries):
+            self.assertEqual(
+                list(found.codes[row]),
+                [n.code for n in self.index.nearest(lat, lon, 3)],
+            )
+
+    def test_within_matches_brute_force(self):
+        for lat, lon in self.queries:
+            distances = self.brute_force(lat, lon)
+            expected = sorted(
+                (distance, self.codes[i])
+                for i, distance in enumerate(distances)
+                if distance <= 150
+            )
+            found = self.index.within(lat, lon, 150)
+            self.assertEqual([n.code for n in found], [code for _, code in expected])
+            self.assertTrue(all(n.distance_km <= 150 for n in found))
+
+    def test_k_larger_than_the_index(self):
+        index = StationIndex(["a", "b"], [None, None], [35, 36], [135, 136])
+        self.assertEqual([n.code for n in index.nearest(35, 135, k=5)], ["a", "b"])
+        self.assertEqual(StationIndex([], [], [], []).nearest(35, 135), [])
+
+
+class ReadApiTests(TestCase):
+    def setUp(self):
+        create_areas()
+        JmaWeather.objects.create(
+            jma_areas3_id="280010",
+            weather_code="100",
+            temperature_min=12,
+            temperature_max=21,
+            wind_speed=3,
+        )
+        JmaWarning.objects.create(
+            jma_areas3_id="280010",
+            warnings="大雨警報",
+            **parse_warnings([{"code": "03", "status": "発表"}]).as_fields(),
+        )
+        # 版・索引・応答はプロセス内にも残るので、テストごとに捨てる
+        self.reset_caches()
+        self.addCleanup(self.reset_caches)
+
+    def reset_caches(self):
+        data_version.expire()
+        area_index._current["master_version"] = None
+        local_cache.items.clear()
+        cache.clear()
+
+    def test_city_resolves_to_its_region(self):
+        response = self.client.get(reverse("weather:city", args=["2820100"]))
+
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual((body["code"], body["kind"]), ("2820100", "city"))
+        self.assertEqual(body["region"], {"code": "280010", "name": "南部"})
+        self.assertEqual(body["forecast"]["weather_code"], "100")
+        self.assertEqual(body["warnings"], ["大雨警報"])
+
+    def test_etag_and_not_modified(self):
+        url = reverse("weather:region", args=["280010"])
+        etag = self.client.get(url)["ETag"]
+
+        response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+        # 取り込みで版が上がれば、同じ ETag でも本文を返す
+        with self.captureOnCommitCallbacks(execute=True):
+            JmaDataVersion.bump(JmaDataVersion.FORECAST)
+        response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_unknown_code_is_not_found(self):
+        response = self.client.get(reverse("weather:region", args=["999999"]))
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json(), {"code": "999999", "error": "not found"})
+
+    def test_bulk(self):
+        response = self.client.post(
+            reverse("weather:bulk"),
+            {"codes": ["280010", "2820900", "999999"]},
+            content_type="application/json",
+        )
+
+        self.assertEqual(response.status_code, 200)
+        lines = [
+            json.loads(line)
+            for line in b"".join(response.streaming_content).splitlines()
+        ]
+        self.assertEqual(
+            [line["code"] for line in lines], ["280010", "2820900", "999999"]
+        )
+        self.assertEqual(lines[1]["region"], {"code": "280020", "name": "北部"})
+        self.assertEqual(lines[2]["error"], "not found")
+
+    def test_bulk_rejects_bad_requests(self):
+        url = reverse("weather:bulk")
+        for body in (
+            "not json",
+            {"code": []},
+            {"codes": "280010"},
+            {"codes": [280010]},
+        ):
+            with self.subTest(body=body):
+                response = self.client.post(url, body, content_type="application/json")
+                self.assertEqual(response.status_code, 400)
+
+        response = self.client.post(
+            url, {"codes": ["280010"] * 10001}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 413)
+
+
+class BulkLoaderTests(TestCase):
+    fields = ["reported_at", "weather_code", "temperature_max"]
+
+    def setUp(self):
+        create_areas()
+        # chunk_size を小さくして executemany を何回かに分ける
+        self.loader = get_bulk_loader(chunk_size=2)
+
+    def forecasts(self, region_code: str, reported_at: datetime, code: str):
+        return [
+            JmaForecast(
+                jma_areas3_id=region_code,
+                target_date=date(2026, 10, day),
+                reported_at=reported_at,
+                weather_code=code,
+                temperature_max=20 + day,
+            )
+            for day in range(18, 23)
+        ]
+
+    def stored(self) -> dict[tuple, str]:
+        return {
+            (region, target_date.day): code
+            for region, target_date, code in JmaForecast.objects.values_list(
+                "jma_areas3_id", "target_date", "weather_code"
+            )
+        }
+
+    def test_inserts_and_updates_on_conflict(self):
+        self.assertIsInstance(self.loader, SqliteBulkLoader)
+        first = datetime(2026, 10, 18, 5, tzinfo=JST)
+        self.loader.upsert(
+            JmaForecast,
+            self.forecasts("280010", first, "100"),
+            ["jma_areas3", "target_date"],
+            self.fields,
+        )
+        ids = set(JmaForecast.objects.values_list("id", flat=True))
+
+        second = datetime(2026, 10, 18, 11, tzinfo=JST)
+        written = self.loader.upsert(
+            JmaForecast,
+            self.forecasts("280010", second, "200")[2:]
+            + self.forecasts("280020", second, "300"),
+            ["jma_areas3", "target_date"],
+            self.fields,
+        )
+
+        self.assertEqual(written, 8)
+        stored = self.stored()
+        self.assertEqual(len(stored), 10)
+        self.assertEqual(
+            [stored["280010", day] for day in range(18, 23)],
+            ["100", "100", "200", "200", "200"],
+        )
+        self.assertEqual(stored["280020", 18], "300")
+        # 上書きした行は同じ id のまま
+        self.assertTrue(ids <= set(JmaForecast.objects.values_list("id", flat=True)))
+        self.assertEqual(
+            JmaForecast.objects.get(
+                jma_areas3="280010", target_date=date(2026, 10, 22)
+            ).reported_at,
+            second,
+        )
+
+    def test_without_update_fields_keeps_existing_rows(self):
+        reported_at = datetime(2026, 10, 18, 5, tzinfo=JST)
+        self.loader.upsert(
+            JmaForecast,
+            self.forecasts("280010", reported_at, "100")[:1],
+            ["jma_areas3", "target_date"],
+            self.fields,
+        )
+        self.loader.upsert(
+            JmaForecast,
+            self.forecasts("280010", reported_at, "200"),
+            ["jma_areas3", "target_date"],
+            [],
+        )
+
+        stored = self.stored()
+        self.assertEqual(
+            [stored["280010", day] for day in range(18, 23)],
+            ["100", "200", "200", "200", "200"],
+        )
+
+    def test_nothing_to_write(self):
+        self.assertEqual(self.loader.upsert(JmaForecast, [], ["jma_areas3"], []), 0)
+
+
+class JmaClientTests(SimpleTestCase):
+    def setUp(self):
+        self.document = {"etag": '"v1"', "body": b'{"version": 1}'}
+        self.server = StubServer(self.handle)
+        self.server.__enter__()
+        self.addCleanup(self.server.__exit__)
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        self.client = JmaClient(concurrency=2, cache=ResponseCache(cache_dir.name))
+        self.addCleanup(self.client.close)
+        self.url = f"{self.server.url}/forecast/280000.json"
+
+    def handle(self, method, path, headers, body):
+        if path == "/broken.json":
+            return 500, {}, b""
+        if path.startswith("/slow/"):
+            with self.lock:
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            sleep(0.05)
+            with self.lock:
+                self.in_flight -= 1
+            return 200, {}, b"{}"
+        if path == "/gzip.json":
+            return 200, {"Content-Encoding": "gzip"}, gzip.compress(self.large_body)
+        if headers.get("If-None-Match") == self.document["etag"]:
+            return 304, {"ETag": self.document["etag"]}, b""
+        return 200, {"ETag": self.document["etag"]}, self.document["body"]
+
+    def sent_etags(self) -> list[str | None]:
+        return [
+            headers.get("If-None-Match") for _, _, headers, _ in self.server.requests
+        ]
+
+    def test_conditional_get(self):
+        first = self.client.get(self.url)
+        self.assertTrue(first.changed)
+        self.assertEqual(first.json(), {"version": 1})
+
+        # 処理が済むまでは覚えないので、もう一度取りに行く
+        self.assertTrue(self.client.get(self.url).changed)
+        self.client.remember(first)
+
+        second = self.client.get(self.url)
+        self.assertFalse(second.changed)
+        self.assertEqual(second.json(), {"version": 1})
+        self.assertEqual(second.downloaded, 0)
+        self.assertEqual(self.sent_etags(), [None, None, '"v1"'])
+
+        self.document.update(etag='"v2"', body=b'{"version": 2}')
+        third = self.client.get(self.url)
+        self.assertTrue(third.changed)
+        self.assertEqual(third.json(), {"version": 2})
+
+    def test_same_body_with_a_new_etag_is_unchanged(self):
+        self.client.remember(self.client.get(self.url))
+        self.document["etag"] = '"v2"'
+
+        self.assertFalse(self.client.get(self.url).changed)
+        # 新しい ETag はすぐに覚えるので、次は 304 になる
+        self.client.get(self.url)
+        self.assertEqual(self.sent_etags(), [None, '"v1"', '"v2"'])
+
+    def test_streamed_not_modified_reads_the_cached_body(self):
+        first = self.client.get(self.url, stream=True)
+        self.client.remember(first)
+
+        second = self.client.get(self.url, stream=True)
+        self.assertFalse(second.changed)
+        self.assertEqual(b"".join(second.iter_chunks(4)), b'{"version": 1}')
+        second.close()
+        self.assertTrue(second.path.exists())
+
+    large_body = json.dumps([{"code": "100"}] * 1000).encode()
+
+    def test_downloaded_counts_compressed_bytes(self):
+        url = f"{self.server.url}/gzip.json"
+        compressed = len(gzip.compress(self.large_body))
+        for options in ({}, {"stream": True}, {"deadline": float("inf")}):
+            with self.subTest(**options):
+                response = self.client.get(url, **options)
+                self.assertEqual(response.content, self.large_body)
+                self.assertEqual(response.size, len(self.large_body))
+                self.assertEqual(response.downloaded, compressed)
+                response.close()
+
+    def test_concurrency_is_shared_by_every_caller(self):
+        self.lock = threading.Lock()
+        self.in_flight = self.max_in_flight = 0
+        groups = {
+            str(n): [f"{self.server.url}/slow/{n}/{i}.json" for i in range(2)]
+            for n in range(4)
+        }
+        # スケジューラのジョブのように、2つのスレッドが同時に fetch_grouped する
+        callers = [
+            threading.Thread(target=self.client.fetch_grouped, args=[groups, 5])
+            for _ in range(2)
+        ]
+        for caller in callers:
+            caller.start()
+        for caller in callers:
+            caller.join()
+
+        self.assertEqual(len(self.server.requests), 16)
+        self.assertEqual(self.max_in_flight, self.client.concurrency)
+
+    def test_fetch_grouped_keeps_failures_per_group(self):
+        results = self.client.fetch_grouped(
+            {"280000": [self.url], "broken": [f"{self.server.url}/broken.json"]},
+            budget=5,
+        )
+
+        self.assertEqual(results["280000"][0].json(), {"version": 1})
+        self.assertIsInstance(results["broken"], Exception)
+
+
+# 兵庫県の予報と確率の JSON を、テストに要る要素だけに縮めたもの
+AMEDAS_REGIONS = {"63518": "280010", "63571": "280010", "63051": "280020"}
+
+
+def jst(day: int, hour: int = 0) -> str:
+    return f"2026-10-{day:02d}T{hour:02d}:00:00+09:00"
+
+
+def forecast_payloads(reported_hour: int = 5) -> tuple[list, list]:
+    three_days = {
+        "reportDatetime": jst(18, reported_hour),
+        "timeSeries": [
+            {
+                "timeDefines": [jst(18, 5), jst(19), jst(20)],
+                "areas": [
+                    {
+                        "area": {"code": "280010", "name": "南部"},
+                        "weatherCodes": ["100", "101", "200"],
+                    },
+                    {
+                        "area": {"code": "280020", "name": "北部"},
+                        "weatherCodes": ["300", "301", ""],
+                    },
+                ],
+            },
+            {"timeDefines": [], "areas": []},
+            {
+                "timeDefines": [jst(19, 0), jst(19, 9), jst(20, 0), jst(20, 9)],
+                "areas": [
+                    {"area": {"code": "63518"}, "temps": ["12", "21", "13", "22"]},
+                    {"area": {"code": "63571"}, "temps": ["10", "20", "", "23"]},
+                    {"area": {"code": "63051"}, "temps": ["8", "17", "", ""]},
+                ],
+            },
+        ],
+    }
+    weekly = {
+        "timeSeries": [
+            {
+                "timeDefines": [jst(day) for day in range(19, 23)],
+                # 県全体で1地域の週間予報は、すべてのリージョンに割り当てる
+                "areas": [
+                    {
+                        "area": {"code": "280000"},
+                        "weatherCodes": ["111", "211", "311", "411"],
+                    }
+                ],
+            },
+            {
+                "timeDefines": [jst(day) for day in range(19, 23)],
+                "areas": [
+                    {
+                        "area": {"code": "63518"},
+                        "tempsMin": ["", "11", "14", "15"],
+                        "tempsMax": ["", "30", "24", "25"],
+                    },
+                    {
+                        "area": {"code": "63051"},
+                        "tempsMin": ["", "7", "9", ""],
+                        "tempsMax": ["", "16", "18", ""],
+                    },
+                ],
+            },
+        ]
+    }
+
+    def wind(values: list[str]) -> dict:
+        return {"timeCells": [{"locals": [{"value": value}]} for value in values]}
+
+    probabilities = [
+        {
+            "timeSeries": [
+                {},
+                {
+                    "timeDefines": [jst(19, 0), jst(19, 12), jst(20, 0), jst(20, 12)],
+                    "areas": [
+                        {
+                            "code": "280010",
+                            "properties": [{}, {}, {}, wind(["4", "6", "3", "3"])],
+                        },
+                        {
+                            "code": "280020",
+                            "properties": [{}, {}, {}, wind(["2", "", "5", "6"])],
+                        },
+                    ],
+                },
+            ]
+        }
+    ]
+    return [three_days, weekly], probabilities
+
+
+class PrefectureForecastTests(SimpleTestCase):
+    def setUp(self):
+        self.forecast = PrefectureForecast(*forecast_payloads(), AMEDAS_REGIONS)
+
+    def history(self) -> dict[tuple, tuple]:
+        return {
+            (row.jma_areas3_id, row.target_date.day): (
+                row.weather_code,
+                row.temperature_min,
+                row.temperature_max,
+                row.wind_speed,
+            )
+            for row in self.forecast.history_rows()
+        }
+
+    def test_three_day_series(self):
+        history = self.history()
+        self.assertEqual(history["280010", 18], ("100", None, None, None))
+        self.assertEqual(history["280010", 19], ("101", 11.0, 20.5, 5.0))
+        # 空の値は平均から外す
+        self.assertEqual(history["280010", 20], ("200", 13.0, 22.5, 3.0))
+        self.assertEqual(history["280020", 19], ("301", 8.0, 17.0, 2.0))
+
+    def test_weekly_series_fills_the_rest(self):
+        history = self.history()
+        # 3日間予報に無い値だけを週間予報で埋める
+        self.assertEqual(history["280020", 20], ("211", 7.0, 16.0, 5.5))
+        self.assertEqual(history["280010", 21], ("311", 14.0, 24.0, None))
+        self.assertEqual(history["280020", 21], ("311", 9.0, 18.0, None))
+        self.assertEqual(history["280010", 22], ("411", 15.0, 25.0, None))
+        self.assertEqual(history["280020", 22], ("411", None, None, None))
+        self.assertEqual(len(history), 10)
+        self.assertEqual(
+            {row.reported_at for row in self.forecast.history_rows()},
+            {datetime(2026, 10, 18, 5, tzinfo=JST)},
+        )
+
+    def test_results(self):
+        results = self.forecast.results(date(2026, 10, 19))
+        self.assertEqual(
+            [
+                (
+                    item.region_weather.region_code,
+                    item.region_weather.weather_code,
+                    item.region_temperature.avg_min_temps,
+                    item.region_temperature.avg_max_temps,
+                    item.region_wind_speed.avg_wind_speed,
+                )
+                for item in results
+            ],
+            [("280010", "101", 11.0, 20.5, 5.0), ("280020", "301", 8.0, 17.0, 2.0)],
+        )
+        # 風速の無い日は、値のそろったリージョンが無い
+        self.assertEqual(self.forecast.results(date(2026, 10, 21)), [])
+        with self.assertRaisesMessage(ValueError, "no forecast"):
+            self.forecast.results(date(2026, 10, 30))
+
+
+class ForecastWriteTests(TestCase):
+    def setUp(self):
+        create_areas()
+        self.command = ForecastCommand(stdout=io.StringIO())
+        self.command.tomorrow = date(2026, 10, 19)
+        self.command.amedas_regions = AMEDAS_REGIONS
+
+    def write(self, reported_hour: int = 5) -> int:
+        parsed = {
+            "280000": self.command.parse("280000", *forecast_payloads(reported_hour))
+        }
+        return self.command.write(parsed)
+
+    def version(self) -> int:
+        return JmaDataVersion.current()[JmaDataVersion.FORECAST]
+
+    def test_bumps_the_version_only_when_rows_change(self):
+        self.assertEqual(self.write(), 2 + 10)
+        self.assertEqual(self.version(), 1)
+        self.assertEqual(JmaForecast.objects.count(), 10)
+
+        # --force で同じ発表を読み直しても書かない
+        self.assertEqual(self.write(), 0)
+        self.assertEqual(self.version(), 1)
+
+        # 次の発表は同じ値でも reported_at が変わるので書き直す
+        self.assertEqual(self.write(reported_hour=11), 10)
+        self.assertEqual(self.version(), 2)
+
+
+class AggregationTests(SimpleTestCase):
+    """NumPy でまとめて求めた平均が、行ごとに足し上げる元の計算と同じになること"""
+
+    def setUp(self):
+        random = np.random.default_rng(1)
+        self.time_defines = [jst(day, hour) for day in (19, 20, 21) for hour in (0, 9)]
+        # 4つに1つはマスタに無い観測所
+        self.amedas_regions = {
+            f"{i:05d}": ("280010", "280020", "280010")[i % 4]
+            for i in range(60)
+            if i % 4 != 3
+        }
+        # 欠測(空文字)を混ぜ、280020 の観測所は 21日の値を全部欠測にする
+        self.stations = []
+        for i in range(60):
+            temps = [str(value) for value in random.integers(-5, 35, 6)]
+            for j in range(6):
+                if random.random() < 0.2:
+                    temps[j] = ""
+            if i % 4 == 1:
+                temps[4:] = ["", ""]
+            self.stations.append({"area": {"code": f"{i:05d}"}, "temps": temps})
+        self.stations.append({"area": {"code": "99999"}, "temps": ["1"] * 6})
+        self.stations.append({"area": {"code": "00000"}})
+
+    def per_row_temperatures(self) -> dict:
+        """元の実装と同じく、リージョンごとに観測所の値を int にして足し上げる"""
+        averages = {}
+        for idx, time_define in enumerate(self.time_defines):
+            moment = datetime.fromisoformat(time_define)
+            position = 0 if moment.hour == 0 else 1
+            by_region = averages.setdefault(moment.date(), {})
+            for region_code in sorted(set(self.amedas_regions.values())):
+                values = [
+                    int(station["temps"][idx])
+                    for station in self.stations
+                    if self.amedas_regions.get(station["area"]["code"]) == region_code
+                    and "temps" in station
+                    and station["temps"][idx] != ""
+                ]
+                if not values:
+                    continue
+                temps = list(by_region.get(region_code, (None, None)))
+                temps[position] = round(sum(values) / len(values), 1)
+                by_region[region_code] = tuple(temps)
+        return averages
+
+    def test_temperatures_match_the_per_row_loop(self):
+        aggregation = TemperatureAggregation(
+            {"timeDefines": self.time_defines, "areas": self.stations},
+            self.amedas_regions,
+        )
+        averages = aggregation.daily_averages()
+
+        self.assertEqual(averages, self.per_row_temperatures())
+        self.assertEqual(list(averages[date(2026, 10, 21)]), ["280010"])
+
+    def test_wind_speeds_match_the_per_row_loop(self):
+        time_defines = [jst(day, hour) for day in (19, 20) for hour in (0, 6, 12, 18)]
+        regions = {
+            "280010": ["4", "6", "3", "", "7", "7", "8", "9"],
+            "280020": ["", "", "", "", "2", "3", "5", "4"],
+            "280030": ["1", "2", "2", "2", "3", "3", "3", "3"],
+        }
+        data = {
+            "timeDefines": time_defines,
+            "areas": [
+                {
+                    "code": code,
+                    "properties": [
+                        {},
+                        {},
+                        {},
+                        {
+                            "timeCells": [
+                                {"locals": [{"value": value}]} for value in values
+                            ]
+                        },
+                    ],
+                }
+                for code, values in regions.items()
+            ],
+        }
+
+        expected = {}
+        for day in (19, 20):
+            target_date = date(2026, 10, day)
+            for code, values in regions.items():
+                picked = [
+                    int(value)
+                    for time_define, value in zip(time_defines, values)
+                    if datetime.fromisoformat(time_define).date() == target_date
+                    and value != ""
+                ]
+                if picked:
+                    expected.setdefault(target_date, {})[code] = round(
+                        sum(picked) / len(picked), 1
+                    )
+
+        self.assertEqual(WindSpeedAggregation(data).daily_averages(), expected)
+        self.assertEqual(expected[date(2026, 10, 19)], {"280010": 4.3, "280030": 1.8})
+
+
+class AreaIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = AreaIndex(
+            [("010600", "近畿地方"), ("010300", "関東甲信地方")],
+            [("280000", "010600", "兵庫県"), ("130000", "010300", "東京都")],
+            [
+                ("280010", "280000", "南部"),
+                ("280020", "280000", "北部"),
+                ("130010", "130000", "東京地方"),
+            ],
+            [
+                ("2820100", "280010", "姫路市"),
+                ("2820900", "280020", "豊岡市"),
+                ("2821000", "280010", "加古川市"),
+                # 親のリージョンがマスタに無い市区町村
+                ("9990000", "999999", "迷子市"),
+            ],
+            [("63518", "280010", "姫路"), ("63051", "280020", "豊岡")],
+        )
+
+    def test_resolve(self):
+        self.assertEqual(self.index.resolve("2820100"), Area(CITY, "2820100", "姫路市"))
+        self.assertEqual(self.index.resolve("63051"), Area(AMEDAS, "63051", "豊岡"))
+        self.assertEqual(self.index.resolve("280010", REGION).name, "南部")
+        # 階層を指定したら、その階層だけを探す
+        self.assertIsNone(self.index.resolve("280010", CITY))
+        self.assertIsNone(self.index.resolve("000000"))
+        self.assertEqual(len(self.index), 2 + 2 + 3 + 4 + 2)
+
+    def test_parents(self):
+        self.assertEqual(self.index.parent("2820900").code, "280020")
+        self.assertEqual(
+            [area.code for area in self.index.ancestors("63518")],
+            ["280010", "280000", "010600"],
+        )
+        self.assertEqual(self.index.region_of("2821000").code, "280010")
+        self.assertEqual(self.index.region_of("63051").code, "280020")
+        self.assertEqual(self.index.region_of("280020").code, "280020")
+        self.assertIsNone(self.index.region_of("280000"))
+        self.assertIsNone(self.index.parent("010600"))
+        self.assertIsNone(self.index.parent("9990000"))
+        self.assertEqual(self.index.ancestors("9990000"), ())
+        self.assertEqual(self.index.ancestors("000000"), ())
+
+    def test_children(self):
+        self.assertEqual(
+            [(area.level, area.code) for area in self.index.children("280010")],
+            [(CITY, "2820100"), (CITY, "2821000"), (AMEDAS, "63518")],
+        )
+        self.assertEqual(
+            [area.code for area in self.index.descendants("280000")],
+            ["280010", "2820100", "2821000", "63518", "280020", "2820900", "63051"],
+        )
+        self.assertEqual(
+            [area.code for area in self.index.children("010300")], ["130000"]
+        )
+        self.assertEqual(self.index.children("130010"), ())
+        self.assertEqual(self.index.children("63518"), ())
+        self.assertEqual(self.index.children("000000"), ())
+
+    def test_search(self):
+        self.assertEqual(
+            [area.code for area in self.index.search("市", CITY)],
+            ["2820100", "2820900", "2821000", "9990000"],
+        )
+        self.assertEqual(
+            [(area.level, area.code) for area in self.index.search("姫路")],
+            [(CITY, "2820100"), (AMEDAS, "63518")],
+        )
+        # 名前の先頭と末尾でも見つかり、つないだ名前の境目をまたいでは見つからない
+        self.assertEqual(
+            [area.code for area in self.index.search("部", REGION)],
+            ["280010", "280020"],
+        )
+        self.assertEqual(self.index.search("南部北", REGION), ())
+        self.assertEqual(self.index.search("部\0北", REGION), ())
+        self.assertEqual(self.index.search("地方", CENTER)[1].code, "010300")
+        self.assertEqual(self.index.search("大阪"), ())
+        self.assertEqual(
+            [area.code for area in self.index.search("県", PREFECTURE)], ["280000"]
+        )
+
+
+def master_documents(version: int) -> tuple[dict, dict, dict]:
+    """
+    area.json / forecast_area.json / amedastable.json の小さな版。
+    2版目では 南部 と 姫路 の名前が変わり、豊岡市 が 南部 に移り、東京都 が消える
+    """
+    southern = "南部" if version == 1 else "播磨南部"
+    area = {
+        "centers": {"010600": {"name": "近畿地方"}},
+        "offices": {"280000": {"name": "兵庫県", "parent": "010600"}},
+        "class10s": {
+            "280010": {"name": southern, "parent": "280000"},
+            "280020": {"name": "北部", "parent": "280000"},
+        },
+        "class15s": {
+            "280011": {"name": "播磨南西部", "parent": "280010"},
+            "280021": {"name": "但馬北部", "parent": "280020"},
+        },
+        "class20s": {
+            "2820100": {"name": "姫路市", "parent": "280011"},
+            "2820900": {
+                "name": "豊岡市",
+                "parent": "280021" if version == 1 else "280011",
+            },
+        },
+    }
+    forecast_area = {
+        "280000": [
+            {"class10": "280010", "class20": "2820100", "amedas": ["63518"]},
+            {"class10": "280020", "class20": "2820900", "amedas": ["63051"]},
+        ]
+    }
+    stations = {
+        "63518": {
+            "kjName": "姫路" if version == 1 else "姫路特別",
+            "lat": [34, 50.3],
+            "lon": [134, 40.2],
+        },
+        "63051": {"kjName": "豊岡", "lat": [35, 31.9], "lon": [134, 49.8]},
+    }
+    if version == 1:
+        area["centers"]["010300"] = {"name": "関東甲信地方"}
+        area["offices"]["130000"] = {"name": "東京都", "parent": "010300"}
+        area["class10s"]["130010"] = {"name": "東京地方", "parent": "130000"}
+        area["class15s"]["130011"] = {"name": "23区西部", "parent": "130010"}
+        area["class20s"]["1310100"] = {"name": "千代田区", "parent": "130011"}
+        forecast_area["130000"] = [
+            {"class10": "130010", "class20": "1310100", "amedas": ["44132"]}
+        ]
+        stations["44132"] = {"kjName": "東京", "lat": [35, 41.5], "lon": [139, 45.0]}
+    return area, forecast_area, stations
+
+
+class MasterSyncTests(TestCase):
+    models = [JmaAreas1, JmaAreas2, JmaAreas3, JmaAreas4, JmaAmedas]
+
+    def sync(self, version: int):
+        master_sync = MasterSync(batch_size=2)
+        area, forecast_area, stations = (
+            json.dumps(document, ensure_ascii=False).encode()
+            for document in master_documents(version)
+        )
+        # 流し読みなので、チャンクの境目がどこにあっても同じ結果になること
+        master_sync.read_areas(self.chunked(area))
+        master_sync.read_amedas(self.chunked(forecast_area))
+        master_sync.read_stations(self.chunked(stations))
+        return master_sync.finish()
+
+    @staticmethod
+    def chunked(content: bytes) -> list[bytes]:
+        return [content[i : i + 5] for i in range(0, len(content), 5)]
+
+    def dump(self) -> dict:
+        return {
+            model.__name__: list(model.objects.order_by("pk").values())
+            for model in self.models
+        }
+
+    def test_streaming_sync_matches_a_full_reload(self):
+        self.sync(1)
+        result = self.sync(2)
+        synced = self.dump()
+
+        for model in reversed(self.models):
+            model.objects.all().delete()
+        self.sync(2)
+
+        self.assertEqual(synced, self.dump())
+        # 南部・姫路 の改名と、豊岡市 とその観測所の 南部 への付け替え
+        self.assertEqual((result.created, result.updated, result.deleted), (0, 4, 5))
+
+    def test_renames_and_removals_are_applied(self):
+        self.sync(1)
+        self.assertEqual(JmaAreas4.objects.count(), 3)
+
+        self.sync(2)
+
+        self.assertEqual(JmaAreas3.objects.get(pk="280010").name, "播磨南部")
+        self.assertEqual(JmaAmedas.objects.get(pk="63518").name, "姫路特別")
+        self.assertEqual(JmaAreas4.objects.get(pk="2820900").jma_area3_id, "280010")
+        self.assertEqual(JmaAmedas.objects.get(pk="63051").jma_area3_id, "280010")
+        # 消えた都道府県は、子から順にすべての階層で消える
+        self.assertEqual(
+            list(JmaAreas1.objects.values_list("pk", flat=True)), ["010600"]
+        )
+        self.assertFalse(JmaAreas2.objects.filter(pk="130000").exists())
+        self.assertFalse(JmaAreas3.objects.filter(pk="130010").exists())
+        self.assertFalse(JmaAreas4.objects.filter(pk="1310100").exists())
+        self.assertFalse(JmaAmedas.objects.filter(pk="44132").exists())
+
+    def test_unchanged_master_writes_nothing(self):
+        self.sync(2)
+        self.assertEqual(self.sync(2).written, 0)
+
+
+def oct18(hour: int, minute: int = 0) -> datetime:
+    return datetime(2026, 10, 18, hour, minute, tzinfo=JST)
+
+
+class RollupTests(TestCase):
+    def setUp(self):
+        create_areas()
+        JmaAmedas.objects.bulk_create(
+            [
+                JmaAmedas(id="63518", jma_area3_id="280010", name="姫路"),
+                JmaAmedas(id="63051", jma_area3_id="280020", name="豊岡"),
+            ]
+        )
+        # 63518 は 17日 23:50 と 18日 0時台、63051 は 0:10 だけ。値の欠けも混ぜる
+        self.observe(
+            oct18(23, 50) - timedelta(days=1), oct18(1), {"63518": (10, 2, 0.5)}
+        )
+        self.observe(oct18(0), oct18(1), {"63518": (12, None, 0)})
+        self.observe(
+            oct18(0, 10), oct18(1), {"63518": (None, 4, 1.0), "63051": (8, None, None)}
+        )
+        self.observe(oct18(0, 50), oct18(1), {"63518": (14, 6, None)})
+
+    def observe(self, observed_at: datetime, ingested_at: datetime, values: dict):
+        """観測所 -> (気温, 風速, 10分間降水量) を、取り込んだ時刻つきで書く"""
+        AmedasObservation.objects.bulk_create(
+            [
+                AmedasObservation(
+                    jma_amedas_id=station,
+                    observed_at=observed_at,
+                    temperature=temperature,
+                    wind_speed=wind_speed,
+                    precipitation_10m=precipitation,
+                )
+                for station, (temperature, wind_speed, precipitation) in values.items()
+            ]
+        )
+        AmedasSnapshot.objects.update_or_create(
+            observed_at=observed_at, defaults={"stations": len(values)}
+        )
+        # ingested_at は auto_now なので、保存したあとで書き換える
+        AmedasSnapshot.objects.filter(observed_at=observed_at).update(
+            ingested_at=ingested_at
+        )
+
+    def rollup(self) -> ObservationRollup:
+        rollup = ObservationRollup(chunk_hours=1)
+        rollup.find_dirty()
+        rollup.roll_hourly()
+        rollup.roll_daily()
+        rollup.save_position()
+        return rollup
+
+    def hourly(self, station: str, hour: datetime) -> tuple:
+        return AmedasObservationHourly.objects.values_list(*STAT_FIELDS).get(
+            jma_amedas_id=station, hour=hour
+        )
+
+    def daily(self, station: str, day: int) -> tuple:
+        return AmedasObservationDaily.objects.values_list(*STAT_FIELDS).get(
+            jma_amedas_id=station, date=date(2026, 10, day)
+        )
+
+    def watermark(self) -> datetime:
+        return RollupWatermark.objects.get(name=OBSERVATION_WATERMARK).position
+
+    def test_hourly_and_daily_stats(self):
+        rollup = self.rollup()
+
+        self.assertEqual(rollup.hourly_rows, 3)
+        self.assertEqual(rollup.daily_rows, 3)
+        # 平均は値のあった観測だけで取る
+        self.assertEqual(self.hourly("63518", oct18(0)), (3, 12, 14, 13, 6, 5, 1.0))
+        self.assertEqual(
+            self.hourly("63518", oct18(23, 0) - timedelta(days=1)),
+            (1, 10, 10, 10, 2, 2, 0.5),
+        )
+        self.assertEqual(self.hourly("63051", oct18(0)), (1, 8, 8, 8, None, None, None))
+        # 日は JST で区切るので、17日 23:50 は 17日に入る
+        self.assertEqual(self.daily("63518", 18), (3, 12, 14, 13, 6, 5, 1.0))
+        self.assertEqual(self.daily("63518", 17), (1, 10, 10, 10, 2, 2, 0.5))
+
+    def test_watermark_advances(self):
+        self.rollup()
+        self.assertEqual(self.watermark(), oct18(1))
+        self.observe(oct18(1, 50), oct18(2), {"63518": (15, 1, 0)})
+        self.rollup()
+        self.assertEqual(self.watermark(), oct18(2))
+
+        self.observe(oct18(2, 50), oct18(3), {"63518": (16, 1, 0)})
+        rollup = self.rollup()
+
+        # 前回の位置より前に取り込まれた時刻は、重ねて戻る5分の分を除いて集計し直さない
+        self.assertEqual(rollup.hours, {oct18(1), oct18(2)})
+        self.assertEqual(rollup.days, {date(2026, 10, 18)})
+        self.assertEqual(self.watermark(), oct18(3))
+        self.assertEqual(self.hourly("63518", oct18(2)), (1, 16, 16, 16, 1, 1, 0))
+
+    def test_backfilled_hours_are_rolled_again(self):
+        self.rollup()
+        self.observe(oct18(1, 50), oct18(2), {"63518": (15, 1, 0)})
+        self.rollup()
+
+        # 遅れて埋まった 0:30 と、前回の集計と入れ違いにコミットされた 0:40
+        self.observe(oct18(0, 30), oct18(3), {"63518": (20, 8, 2.0)})
+        self.observe(oct18(0, 40), oct18(1, 57), {"63051": (6, 3, 0)})
+        rollup = self.rollup()
+
+        self.assertIn(oct18(0), rollup.hours)
+        self.assertNotIn(oct18(23) - timedelta(days=1), rollup.hours)
+        self.assertEqual(self.hourly("63518", oct18(0)), (4, 12, 20, 46 / 3, 8, 6, 3.0))
+        self.assertEqual(self.hourly("63051", oct18(0)), (2, 6, 8, 7, 3, 3, 0))
+        self.assertEqual(self.daily("63518", 18), (5, 12, 20, 15.25, 8, 4.75, 3.0))
+        self.assertEqual(self.daily("63051", 18), (2, 6, 8, 7, 3, 3, 0))
+
+    def test_retention_deletes_observations_older_than_seven_days(self):
+        self.observe(oct18(12) - timedelta(days=30), oct18(1), {"63518": (5, 1, 0)})
+        self.observe(oct18(13), oct18(13), {"63518": (6, 1, 0)})
+        self.rollup()
+
+        # 18日 12:00 より古い観測値が保持期間を過ぎる
+        with mock.patch(
+            "weather.rollup.timezone.now", return_value=oct18(12) + timedelta(days=7)
+        ):
+            deleted = enforce_retention(batch_size=2)
+
+        self.assertEqual(deleted["weather.AmedasObservation"], 6)
+        self.assertEqual(deleted["weather.AmedasSnapshot"], 5)
+        # 集計は観測値より長く残す
+        self.assertEqual(deleted["weather.AmedasObservationHourly"], 0)
+        self.assertNotIn("weather.AmedasObservationDaily", deleted)
+        self.assertEqual(
+            list(AmedasObservation.objects.values_list("observed_at", flat=True)),
+            [oct18(13)],
+        )
+        self.assertEqual(
+            list(AmedasSnapshot.objects.values_list("observed_at", flat=True)),
+            [oct18(13)],
+        )
+        self.assertEqual(AmedasObservationHourly.objects.count(), 5)
+
+
+WARNINGS = {
+    "reportDatetime": jst(18, 5),
+    "areaTypes": [
+        {
+            "areas": [
+                {
+                    "code": "280010",
+                    "warnings": [
+                        {"code": "03", "status": "発表"},
+                        {"code": "15", "status": "継続"},
+                    ],
+                },
+                {"code": "280020", "warnings": [{"code": "10", "status": "解除"}]},
+            ]
+        },
+        {
+            "areas": [
+                {"code": "2820100", "warnings": [{"code": "03", "status": "発表"}]},
+                {"code": "2820900", "warnings": []},
+            ]
+        },
+    ],
+}
+
+
+class ReplayArchiveTests(TestCase):
+    def setUp(self):
+        create_areas()
+        JmaAmedas.objects.bulk_create(
+            [
+                JmaAmedas(id=code, jma_area3_id=region_code)
+                for code, region_code in AMEDAS_REGIONS.items()
+            ]
+        )
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(override_settings(WEATHER_ARCHIVE_DIR=Path(directory.name)))
+        self.archive = PayloadArchive(directory.name)
+
+    def store(self, url: str, document, fetched_at: datetime) -> str:
+        response = JmaResponse(
+            url, json.dumps(document, ensure_ascii=False).encode(), changed=True
+        )
+        with mock.patch("weather.archive.timezone.now", return_value=fetched_at):
+            self.archive.store(response)
+        self.archive.flush()
+        return response.sha256
+
+    def store_forecast(self, fetched_at: datetime, reported_hour: int = 5) -> str:
+        forecast, _ = forecast_payloads(reported_hour)
+        return self.store(forecast_url("280000"), forecast, fetched_at)
+
+    def store_probability(self, fetched_at: datetime) -> str:
+        _, probabilities = forecast_payloads()
+        return self.store(probability_url("280000"), probabilities, fetched_at)
+
+    def replay(self, workers: int) -> str:
+        stdout = io.StringIO()
+        call_command(
+            "replay_archive",
+            "--from",
+            "2026-10-18",
+            "--to",
+            "2026-10-18",
+            "--workers",
+            str(workers),
+            stdout=stdout,
+        )
+        return stdout.getvalue()
+
+    def dump(self) -> list:
+        # JmaForecast の id は書き込みのたびに振られるので比べない
+        return [
+            list(
+                JmaForecast.objects.order_by("jma_areas3", "target_date").values_list(
+                    "jma_areas3",
+                    "target_date",
+                    "reported_at",
+                    "weather_code",
+                    "temperature_min",
+                    "temperature_max",
+                    "wind_speed",
+                )
+            ),
+            list(JmaWarning.objects.order_by("pk").values()),
+            list(JmaCityWarning.objects.order_by("pk").values()),
+        ]
+
+    def test_payloads_are_stored_once_per_body(self):
+        sha256 = self.store_forecast(oct18(6))
+        self.assertEqual(self.store_forecast(oct18(7)), sha256)
+        self.store(forecast_url("130000"), forecast_payloads()[0], oct18(8))
+
+        # 同じ本文は1ファイル。索引は URL と本文の組ごとに、最初に取得した1行
+        self.assertEqual(len(list(self.archive.directory.rglob("*.json.gz"))), 1)
+        self.assertEqual(
+            list(
+                ArchivedPayload.objects.order_by("id").values_list(
+                    "kind", "key", "sha256", "fetched_at"
+                )
+            ),
+            [
+                ("forecast", "280000", sha256, oct18(6)),
+                ("forecast", "130000", sha256, oct18(8)),
+            ],
+        )
+        self.assertEqual(json.loads(self.archive.read(sha256)), forecast_payloads()[0])
+
+    def test_forecast_jobs_pair_the_latest_payloads(self):
+        # 期間の前に届いた予報も、期間内に届いた確率と組にする
+        first = self.store_forecast(oct18(23) - timedelta(days=1))
+        probability = self.store_probability(oct18(6))
+        second = self.store_forecast(oct18(12), reported_hour=11)
+        self.store_forecast(oct18(13), reported_hour=11)
+        self.store(probability_url("130000"), [], oct18(6))
+        self.store_forecast(oct18(5) + timedelta(days=1), reported_hour=17)
+
+        command = ReplayCommand()
+        command.start = oct18(0)
+        command.end = oct18(0) + timedelta(days=1)
+        self.assertEqual(
+            command.forecast_jobs({"prefectures": None}),
+            [("280000", first, probability), ("280000", second, probability)],
+        )
+
+    def test_replay_writes_forecasts_and_warnings(self):
+        self.store_forecast(oct18(5, 30))
+        self.store_probability(oct18(5, 30))
+        self.store(warning_url("280000"), WARNINGS, oct18(5, 30))
+
+        output = self.replay(workers=2)
+
+        self.assertIn("forecast: jobs: 1, failed: 0, rows written: 10", output)
+        self.assertEqual(JmaForecast.objects.count(), 10)
+        self.assertEqual(
+            JmaForecast.objects.values_list(
+                "reported_at",
+                "weather_code",
+                "temperature_min",
+                "temperature_max",
+                "wind_speed",
+            ).get(jma_areas3_id="280010", target_date=date(2026, 10, 19)),
+            (oct18(5), "101", 11.0, 20.5, 5.0),
+        )
+        self.assertEqual(
+            list(JmaWarning.objects.order_by("pk").values_list("pk", "warnings")),
+            [("280010", "大雨警報,強風注意報"), ("280020", "")],
+        )
+        self.assertEqual(
+            JmaWarning.objects.get(pk="280020").cancelled_mask, WARNING_BITS["10"]
+        )
+        self.assertEqual(
+            dict(JmaCityWarning.objects.values_list("pk", "active_mask")),
+            {"2820100": WARNING_BITS["03"], "2820900": 0},
+        )
+
+        # 1プロセスで読み直しても同じ行になる
+        replayed = self.dump()
+        for model in (JmaForecast, JmaWarning, JmaCityWarning):
+            model.objects.all().delete()
+        self.replay(workers=1)
+        self.assertEqual(self.dump(), replayed)
+
+    def test_replay_does_not_roll_back_newer_forecasts(self):
+        self.store_forecast(oct18(5, 30))
+        self.store_probability(oct18(5, 30))
+        JmaForecast.objects.create(
+            jma_areas3_id="280010",
+            target_date=date(2026, 10, 19),
+            reported_at=oct18(11),
+            weather_code="300",
+        )
+
+        output = self.replay(workers=1)
+
+        self.assertIn("rows written: 9", output)
+        self.assertEqual(
+            JmaForecast.objects.values_list("reported_at", "weather_code").get(
+                jma_areas3_id="280010", target_date=date(2026, 10, 19)
+            ),
+            (oct18(11), "300"),
+        )
+        self.assertEqual(
+            JmaForecast.objects.get(
+                jma_areas3_id="280020", target_date=date(2026, 10, 19)
+            ).weather_code,
+            "301",
+        )
@@ -0,0 +1,4 @@
+from zoneinfo import ZoneInfo
+
+# 気象庁の発表時刻と予報の日付は日本時間
+JST = ZoneInfo("Asia/Tokyo")
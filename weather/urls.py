@@ -0,0 +1,12 @@
+from django.urls import path
+
+from weather import views
+
+app_name = "weather"
+urlpatterns = [
+    path("regions/<str:code>/", views.region_weather, name="region"),
+    path("cities/", views.city_list, name="city_list"),
+    path("cities/<str:code>/", views.city_weather, name="city"),
+    path("amedas/<str:code>/", views.amedas_weather, name="amedas"),
+    path("bulk/", views.bulk_weather, name="bulk"),
+]
@@ -1,3 +1,157 @@
-from django.shortcuts import render
+import json
 
-# Create your views here.
+from django.http import (
+    HttpResponse,
+    HttpResponseBadRequest,
+    HttpResponseNotModified,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+
+from weather.models import JmaCityForecast
+from weather.payloads import (
+    AMEDAS,
+    CITY,
+    KIND_BY_LENGTH,
+    REGION,
+    get_region_payloads,
+    get_version_key,
+    resolve_region_code,
+)
+from weather.warning_codes import WARNING_BITS
+
+# 1回の一括取得で受け付けるコードの上限と、1度にまとめて引く件数
+BULK_MAX_CODES = 10000
+BULK_CHUNK_SIZE = 500
+
+
+def _weather_response(request, kind: str, code: str):
+    version_key = get_version_key()
+    etag = f'"{version_key}-{kind}-{code}"'
+    if etag in request.headers.get("If-None-Match", ""):
+        return HttpResponseNotModified(headers={"ETag": etag})
+
+    region_code = resolve_region_code(kind, code)
+    payload = region_code and get_region_payloads([region_code], version_key).get(
+        region_code
+    )
+    if not payload:
+        return JsonResponse({"code": code, "error": "not found"}, status=404)
+
+    response = JsonResponse(
+        {"code": code, "kind": kind, **payload},
+        json_dumps_params={"ensure_ascii": False},
+    )
+    response["ETag"] = etag
+    return response
+
+
+@require_GET
+def region_weather(request, code: str):
+    return _weather_response(request, REGION, code)
+
+
+@require_GET
+def city_weather(request, code: str):
+    return _weather_response(request, CITY, code)
+
+
+@require_GET
+def amedas_weather(request, code: str):
+    return _weather_response(request, AMEDAS, code)
+
+
+@require_GET
+def city_list(request):
+    """
+    市区町村の予報と警報の一覧。JmaCityForecast だけを読む。
+    ?prefecture=280000 で都道府県、?warning=03 で警報の出ている市区町村に絞る
+    """
+    prefecture = request.GET.get("prefecture")
+    warning = request.GET.get("warning")
+    if warning is not None and warning not in WARNING_BITS:
+        return HttpResponseBadRequest(f"unknown warning code: {warning}")
+
+    version_key = get_version_key()
+    etag = f'"{version_key}-cities-{prefecture or "all"}-{warning or "any"}"'
+    if etag in request.headers.get("If-None-Match", ""):
+        return HttpResponseNotModified(headers={"ETag": etag})
+
+    cities = JmaCityForecast.objects.order_by("prefecture_code", "jma_areas4")
+    if prefecture:
+        cities = cities.filter(prefecture_code=prefecture)
+    if warning:
+        cities = cities.filter(active_mask__has_warning=warning)
+    response = JsonResponse(
+        {
+            "cities": [
+                {
+                    "code": city["jma_areas4_id"],
+                    "name": city["city_name"],
+                    "region": {
+                        "code": city["region_code"],
+                        "name": city["region_name"],
+                    },
+                    "prefecture": {
+                        "code": city["prefecture_code"],
+                        "name": city["prefecture_name"],
+                    },
+                    "forecast": city["weather_code"]
+                    and {
+                        "weather_code": city["weather_code"],
+                        "temperature_min": city["temperature_min"],
+                        "temperature_max": city["temperature_max"],
+                        "wind_speed": city["wind_speed"],
+                    },
+                    "warnings": city["warnings"].split(",") if city["warnings"] else [],
+                }
+                for city in cities.values()
+            ]
+        },
+        json_dumps_params={"ensure_ascii": False},
+    )
+    response["ETag"] = etag
+    return response
+
+
+def _bulk_lines(codes: list[str], version_key: str):
+    for start in range(0, len(codes), BULK_CHUNK_SIZE):
+        chunk = codes[start : start + BULK_CHUNK_SIZE]
+        region_codes = {}
+        for code in chunk:
+            kind = KIND_BY_LENGTH.get(len(code))
+            region_codes[code] = kind and resolve_region_code(kind, code)
+        payloads = get_region_payloads(
+            list({code for code in region_codes.values() if code}), version_key
+        )
+        for code in chunk:
+            payload = payloads.get(region_codes[code])
+            if payload:
+                line = {"code": code, "kind": KIND_BY_LENGTH[len(code)], **payload}
+            else:
+                line = {"code": code, "error": "not found"}
+            yield json.dumps(line, ensure_ascii=False) + "\n"
+
+
+@csrf_exempt
+@require_POST
+def bulk_weather(request):
+    """
+    {"codes": [...]} を受け取り、1行1コードの NDJSON を順に返す。
+    コードはリージョン(6桁)・市区町村(7桁)・アメダス(5桁)を混ぜてよい
+    """
+    try:
+        codes = json.loads(request.body)["codes"]
+    except (ValueError, KeyError, TypeError):
+        return HttpResponseBadRequest('expected {"codes": [...]}')
+    if not isinstance(codes, list) or not all(isinstance(c, str) for c in codes):
+        return HttpResponseBadRequest("codes must be a list of strings")
+    if len(codes) > BULK_MAX_CODES:
+        return HttpResponse(f"too many codes (max {BULK_MAX_CODES})", status=413)
+
+    return StreamingHttpResponse(
+        _bulk_lines(codes, get_version_key()),
+        content_type="application/x-ndjson; charset=utf-8",
+    )
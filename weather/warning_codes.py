@@ -0,0 +1,96 @@
+from typing import NamedTuple
+
+from django.db import models
+
+# 取り込む警報・注意報。キーは気象庁の警報コード
+M_TARGET_WARNINGS = {
+    "03": "大雨警報",
+    "24": "霜注意報",
+    "10": "大雨注意報",
+    "21": "乾燥注意報",
+    "14": "雷注意報",
+    "18": "洪水注意報",
+    "20": "濃霧注意報",
+    "15": "強風注意報",
+    "16": "波浪注意報",
+}
+
+# 警報コードの数値をそのままビット位置にする。対象を増やしても既存の値の意味は変わらない
+WARNING_BITS = {code: 1 << int(code) for code in sorted(M_TARGET_WARNINGS)}
+
+# JmaWarning / JmaCityWarning のビットマスクの列
+MASK_FIELDS = ["active_mask", "issued_mask", "continued_mask", "cancelled_mask"]
+
+STATUS_ISSUED = "発表"
+STATUS_CONTINUED = "継続"
+STATUS_CANCELLED = "解除"
+
+
+class WarningMasks(NamedTuple):
+    """
+    1地域分の警報の状態。
+
+    active は今出ている警報(発表・継続のほか「警報から注意報」などの切り替えも含む)。
+    issued / continued / cancelled は今回の発表での状態ごとの内訳
+    """
+
+    active: int = 0
+    issued: int = 0
+    continued: int = 0
+    cancelled: int = 0
+
+    def as_fields(self) -> dict[str, int]:
+        return dict(zip(MASK_FIELDS, self))
+
+
+def parse_warnings(warnings: list[dict]) -> WarningMasks:
+    """JMA の warnings 配列 [{"code": "03", "status": "発表"}, ...] をビットマスクにする"""
+    active = issued = continued = cancelled = 0
+    for warning in warnings:
+        bit = WARNING_BITS.get(warning.get("code"))
+        if bit is None:
+            continue
+        status = warning.get("status")
+        if status == STATUS_CANCELLED:
+            cancelled |= bit
+            continue
+        active |= bit
+        if status == STATUS_ISSUED:
+            issued |= bit
+        elif status == STATUS_CONTINUED:
+            continued |= bit
+    return WarningMasks(active, issued, continued, cancelled)
+
+
+def warning_codes(mask: int) -> list[str]:
+    return [code for code, bit in WARNING_BITS.items() if mask & bit]
+
+
+def warning_names(mask: int) -> list[str]:
+    return [M_TARGET_WARNINGS[code] for code in warning_codes(mask)]
+
+
+class WarningMaskField(models.BigIntegerField):
+    """
+    警報のビットマスク。has_warning で特定の警報が立っている行を引ける。
+
+    JmaCityWarning.objects.filter(active_mask__has_warning="03")  # 大雨警報
+    """
+
+
+@WarningMaskField.register_lookup
+class HasWarning(models.Lookup):
+    """
+    (列 & ビット) = ビット に展開する。ビットは SQL に直接埋め込むので、
+    同じ式で張った Index(F(列).bitand(ビット)) がそのまま使われる
+    """
+
+    lookup_name = "has_warning"
+    prepare_rhs = False
+
+    def as_sql(self, compiler, connection):
+        if self.rhs not in WARNING_BITS:
+            raise ValueError(f"unknown warning code: {self.rhs!r}")
+        bit = WARNING_BITS[self.rhs]
+        lhs, params = self.process_lhs(compiler, connection)
+        return f"({lhs} & {bit}) = {bit}", params